@@ -1,14 +1,23 @@
+import asyncio
+import json
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
-from ..models.llm_connector import generate_code_and_tests, auto_implement_code, list_project_files
+from ..models.llm_connector import generate_code_and_tests_async, auto_implement_code, list_project_files
 from ..models.safe_update import safe_self_update
+from ..models.jobs import submit_job, get_job, list_jobs, cancel_job, JobQueueFull
+from ..models.llm_cache import get_response_cache
+from ..models.llm_pool import get_llm_pool
+from ..models import metrics
 
 router = APIRouter()
 
 class ChatRequest(BaseModel):
     prompt: str
     files_to_include: Optional[List[str]] = None
+    background: bool = False  # Queue as a job and return its ID immediately
+    bypass_cache: bool = False  # Always ask LM Studio, even if a cached response exists
 
 class ImplementRequest(BaseModel):
     sandbox_files: list
@@ -17,14 +26,101 @@ class ImplementRequest(BaseModel):
 class SelfUpdateRequest(BaseModel):
     files_to_update: dict  # {file_path: new_content}
 
+@router.get("/health")
+async def health_endpoint():
+    """Liveness check used by staging smoke tests and deploys"""
+    return {"status": "ok"}
+
 @router.post("/chat")
 async def chat_endpoint(request: ChatRequest):
     try:
-        result = generate_code_and_tests(request.prompt, files_to_include=request.files_to_include)
+        if request.background:
+            job = submit_job(request.prompt, files_to_include=request.files_to_include,
+                             bypass_cache=request.bypass_cache)
+            return {"job_id": job["id"], "status": job["status"]}
+        result = await generate_code_and_tests_async(request.prompt, files_to_include=request.files_to_include,
+                                                     bypass_cache=request.bypass_cache)
         return {"response": result}
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/cache/stats")
+async def cache_stats_endpoint():
+    """Hit/miss counters and sizes of the LLM response cache"""
+    return get_response_cache().stats()
+
+@router.get("/llm/backends")
+async def llm_backends_endpoint():
+    """Health, outstanding requests and failure counts of each LLM backend"""
+    return {"backends": get_llm_pool().status()}
+
+@router.get("/metrics")
+async def metrics_endpoint():
+    """Per-stage latency histograms, attempt counters and in-flight gauges (Prometheus text format)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/jobs")
+async def list_jobs_endpoint(limit: int = 50):
+    """List recent background jobs, newest first"""
+    return {"jobs": list_jobs(limit)}
+
+@router.get("/jobs/{job_id}")
+async def job_status_endpoint(job_id: str):
+    """Return status, progress and partial or final results of a background job"""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job_endpoint(job_id: str):
+    """Cancel a queued or running background job"""
+    job = cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return {"job_id": job_id, "status": job["status"]}
+
+def _sse_event(event):
+    """Format a pipeline event as a Server-Sent Events frame"""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """Stream tokens and pipeline progress for a chat request as Server-Sent Events"""
+    queue = asyncio.Queue()
+    
+    async def run_pipeline():
+        try:
+            result = await generate_code_and_tests_async(
+                request.prompt, files_to_include=request.files_to_include, on_event=queue.put_nowait,
+                bypass_cache=request.bypass_cache
+            )
+            queue.put_nowait({"type": "result", "response": result})
+        except Exception as e:
+            queue.put_nowait({"type": "error", "error": str(e)})
+        finally:
+            queue.put_nowait(None)
+    
+    async def event_stream():
+        task = asyncio.create_task(run_pipeline())
+        try:
+            # Send something immediately so the browser sees the first byte right away
+            yield _sse_event({"type": "started"})
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield _sse_event(event)
+        finally:
+            # Client went away before completion - stop generating
+            if not task.done():
+                task.cancel()
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @router.post("/implement")
 async def implement_endpoint(request: ImplementRequest):
     """Automatically implement code that has passed tests"""
@@ -38,16 +134,22 @@ async def implement_endpoint(request: ImplementRequest):
 async def self_update_endpoint(request: SelfUpdateRequest):
     """Safely update Pleione's own code with comprehensive testing"""
     try:
-        result = safe_self_update(request.files_to_update)
+        # Staging, the test stages and the git commit block for up to minutes; keep the event loop free
+        result = await asyncio.to_thread(safe_self_update, request.files_to_update)
         return {"response": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+DEFAULT_FILE_EXTENSIONS = [".py", ".js", ".html", ".css", ".md", ".sh"]
+
 @router.get("/files")
-async def list_files_endpoint():
-    """List all files in the project for context selection"""
+async def list_files_endpoint(q: Optional[str] = None, extensions: Optional[str] = None,
+                              offset: int = 0, limit: Optional[int] = None):
+    """List project files for context selection (filtered by substring/extension, paginated)"""
     try:
-        files = list_project_files(".", extensions=[".py", ".js", ".html", ".css", ".md", ".sh"])
-        return {"files": files}
+        extension_list = extensions.split(",") if extensions else DEFAULT_FILE_EXTENSIONS
+        total, files = list_project_files(".", extensions=extension_list, contains=q,
+                                          offset=max(offset, 0), limit=limit, with_total=True)
+        return {"files": files, "total": total, "offset": offset, "limit": limit}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
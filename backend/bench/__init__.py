@@ -0,0 +1 @@
+# Pleione Benchmarking Module
@@ -0,0 +1,195 @@
+"""Stand-in for LM Studio's OpenAI-compatible API, for offline benchmarks.
+
+Serves /v1/models and /v1/chat/completions (plain and "stream": true) with
+a canned response whose code and test pass in the sandbox, so the whole
+generate -> parse -> test pipeline runs. Time to first token, token rate and
+failure injection are configurable; GET /stats reports what was served.
+
+    python3 -m backend.bench.fake_lm_studio --port 1234 --latency 0.5 --tokens-per-second 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_RESPONSE = """Here is a small, tested helper.
+
+```python
+# Filename: bench_feature.py
+def add(a, b):
+    \"\"\"Add two numbers\"\"\"
+    return a + b
+```
+
+```python
+# Filename: test_bench_feature.py
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../sandbox'))
+from bench_feature import add
+
+def test_add():
+    assert add(2, 3) == 5
+```
+"""
+
+DEFAULT_CONFIG = {
+    "latency": 0.2,  # seconds before the first token
+    "jitter": 0.0,  # +/- seconds added to latency at random
+    "tokens_per_second": 200.0,  # 0 = send everything at once
+    "error_rate": 0.0,  # fraction of requests answered with HTTP 500
+    "disconnect_rate": 0.0,  # fraction of streams cut off halfway (no [DONE])
+    "hang_rate": 0.0,  # fraction of requests that never answer (client timeout path)
+    "response": DEFAULT_RESPONSE,
+    "seed": None
+}
+
+def tokenize(text):
+    """Split into word-sized chunks (whitespace kept) that stand in for model tokens"""
+    return re.findall(r'\s*\S+|\s+', text)
+
+def create_app(config=None):
+    """FastAPI app serving the fake API; config overrides DEFAULT_CONFIG keys"""
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    stats = {"requests": 0, "streamed": 0, "in_flight": 0, "max_in_flight": 0,
+             "injected": {"error": 0, "disconnect": 0, "hang": 0}}
+    rng = random.Random(config["seed"])
+    app = FastAPI(title="Fake LM Studio")
+
+    def pick_failure():
+        roll = rng.random()
+        for kind, rate in (("error", config["error_rate"]), ("disconnect", config["disconnect_rate"]),
+                           ("hang", config["hang_rate"])):
+            if roll < rate:
+                stats["injected"][kind] += 1
+                return kind
+            roll -= rate
+        return None
+
+    async def first_token_delay():
+        delay = config["latency"] + (rng.uniform(-config["jitter"], config["jitter"]) if config["jitter"] else 0)
+        await asyncio.sleep(max(delay, 0))
+
+    def token_delay():
+        return 1 / config["tokens_per_second"] if config["tokens_per_second"] > 0 else 0
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "local-model", "object": "model"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        payload = await request.json()
+        stats["requests"] += 1
+        failure = pick_failure()
+        if failure == "error":
+            return JSONResponse({"error": {"message": "injected failure"}}, status_code=500)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = payload.get("model", "local-model")
+        tokens = tokenize(config["response"])
+
+        if payload.get("stream"):
+            stats["streamed"] += 1
+
+            async def events():
+                stats["in_flight"] += 1
+                stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+                try:
+                    await first_token_delay()
+                    if failure == "hang":
+                        await asyncio.Event().wait()
+                    cutoff = len(tokens) // 2 if failure == "disconnect" else len(tokens)
+                    for token in tokens[:cutoff]:
+                        chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                                 "model": model, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                        yield f"data: {json.dumps(chunk)}\n\n"
+                        await asyncio.sleep(token_delay())
+                    if failure == "disconnect":
+                        return
+                    done = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                            "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                    yield f"data: {json.dumps(done)}\n\n"
+                    yield "data: [DONE]\n\n"
+                finally:
+                    stats["in_flight"] -= 1
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await first_token_delay()
+            if failure == "hang":
+                await asyncio.Event().wait()
+            await asyncio.sleep(token_delay() * len(tokens))
+        finally:
+            stats["in_flight"] -= 1
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": config["response"]},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": sum(len(m.get("content", "")) for m in payload.get("messages", [])) // 4,
+                      "completion_tokens": len(tokens), "total_tokens": len(tokens)}
+        }
+
+    app.state.config = config
+    app.state.stats = stats
+    return app
+
+def add_fake_arguments(parser):
+    """Flags shared by this server and the load-test harness that launches it"""
+    parser.add_argument("--latency", type=float, default=DEFAULT_CONFIG["latency"], help="seconds to first token")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_CONFIG["jitter"], help="+/- seconds of random latency")
+    parser.add_argument("--tokens-per-second", type=float, default=DEFAULT_CONFIG["tokens_per_second"])
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests returning HTTP 500")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="fraction of streams cut off halfway")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="fraction of requests that never answer")
+    parser.add_argument("--response-file", help="file whose contents replace the canned completion")
+    parser.add_argument("--seed", type=int, default=None, help="make failure injection reproducible")
+
+def fake_arguments_to_argv(args):
+    """Re-serialize the shared flags to start this server as a subprocess"""
+    argv = ["--latency", str(args.latency), "--jitter", str(args.jitter),
+            "--tokens-per-second", str(args.tokens_per_second), "--error-rate", str(args.error_rate),
+            "--disconnect-rate", str(args.disconnect_rate), "--hang-rate", str(args.hang_rate)]
+    if args.response_file:
+        argv += ["--response-file", os.path.abspath(args.response_file)]
+    if args.seed is not None:
+        argv += ["--seed", str(args.seed)]
+    return argv
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Fake LM Studio (OpenAI-compatible) server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    add_fake_arguments(parser)
+    return parser
+
+def config_from_args(args):
+    response = DEFAULT_RESPONSE
+    if args.response_file:
+        with open(args.response_file, 'r') as f:
+            response = f.read()
+    return {"latency": args.latency, "jitter": args.jitter, "tokens_per_second": args.tokens_per_second,
+            "error_rate": args.error_rate, "disconnect_rate": args.disconnect_rate, "hang_rate": args.hang_rate,
+            "response": response, "seed": args.seed}
+
+if __name__ == "__main__":
+    import uvicorn
+    args = build_arg_parser().parse_args()
+    print(f"🎭 Fake LM Studio on http://{args.host}:{args.port}/v1/chat/completions")
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,258 @@
+"""Load test for Pleione's HTTP API, runnable offline.
+
+By default the harness brings up its own stack: the fake LM Studio and a
+Pleione server running in a throwaway copy of the project, so generated
+files never land in the working tree. It then drives the chosen endpoints
+at a fixed concurrency and reports p50/p95/p99 latency and throughput per
+endpoint. --target points it at an already-running server instead.
+
+Every chat request sends a different prompt, and the private server runs
+with request coalescing and the LLM and test-result caches off, so each
+request pays for a full generation instead of sharing or reusing one.
+
+    python3 -m backend.bench.loadtest --concurrency 8 --requests 200 --endpoints chat,files,implement
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+from .fake_lm_studio import add_fake_arguments, fake_arguments_to_argv
+
+ENDPOINTS = ("chat", "files", "implement")
+BENCH_PROMPT = "Write an add(a, b) helper with a test"
+# Settings of the private server, so identical work is never shared or served from a cache
+BENCH_SERVER_ENV = {"PLEIONE_COALESCE": "0", "PLEIONE_LLM_CACHE": "0", "PLEIONE_TEST_CACHE": "0"}
+# Created in the server's sandbox by the fake LM Studio's canned response
+BENCH_SANDBOX_FILE = "./backend/sandbox/bench_feature.py"
+COPY_IGNORE = shutil.ignore_patterns(".git", "__pycache__", ".pytest_cache", "node_modules",
+                                     "self_updates", "jobs", "cache", "candidates", "workspaces")
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of values (0 <= pct <= 100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(samples, elapsed):
+    """Per-endpoint latency percentiles (seconds), error counts and throughput (req/s)"""
+    report = {}
+    for endpoint in sorted({sample["endpoint"] for sample in samples}):
+        mine = [sample for sample in samples if sample["endpoint"] == endpoint]
+        latencies = [sample["latency"] for sample in mine if sample["ok"]]
+        report[endpoint] = {
+            "requests": len(mine),
+            "errors": len(mine) - len(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None,
+            "throughput": round(len(latencies) / elapsed, 3) if elapsed else None
+        }
+    return report
+
+def bench_prompt(run_id, index):
+    """BENCH_PROMPT made unique to one request of one run"""
+    return f"{BENCH_PROMPT} (bench run {run_id}, request {index})"
+
+async def _call(client, endpoint, prompt=BENCH_PROMPT):
+    """One request; returns ok (HTTP 200 and, for chat, no pipeline error)"""
+    if endpoint == "chat":
+        response = await client.post("/api/chat", json={"prompt": prompt})
+        return response.status_code == 200 and "error" not in response.json().get("response", {})
+    if endpoint == "files":
+        response = await client.get("/api/files", params={"limit": 50})
+        return response.status_code == 200
+    response = await client.post("/api/implement", json={"sandbox_files": [BENCH_SANDBOX_FILE],
+                                                         "test_results": {"all_passed": True}})
+    return response.status_code == 200 and response.json()["response"].get("status") == "implemented"
+
+async def run_load(base_url, endpoints, concurrency, total_requests, timeout=120, transport=None):
+    """Send total_requests (round-robin over endpoints) from `concurrency` workers
+
+    Returns (samples, elapsed seconds). One untimed warm-up request per
+    endpoint runs first; a chat warm-up always runs so /api/implement has
+    a sandbox file to implement. Each chat request gets its own prompt.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits, transport=transport) as client:
+        warmup = set(endpoints)
+        if "implement" in warmup:
+            warmup.add("chat")
+        for endpoint in sorted(warmup, key=ENDPOINTS.index):
+            await _call(client, endpoint, bench_prompt(run_id, "warmup"))
+
+        samples = []
+        next_index = 0
+
+        async def worker():
+            nonlocal next_index
+            while next_index < total_requests:
+                index = next_index
+                endpoint = endpoints[index % len(endpoints)]
+                next_index += 1
+                started = time.perf_counter()
+                try:
+                    ok = await _call(client, endpoint, bench_prompt(run_id, index))
+                except (httpx.HTTPError, ValueError, KeyError):
+                    ok = False
+                samples.append({"endpoint": endpoint, "latency": time.perf_counter() - started, "ok": ok})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples, time.perf_counter() - started
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_for(url, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{' '.join(proc.args)} exited with code {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not answer within {timeout}s")
+
+class BenchStack:
+    """Fake LM Studio + a Pleione server in a temporary copy of the project"""
+
+    def __init__(self, args, source_root="."):
+        self.args = args
+        self.source_root = os.path.abspath(source_root)
+        self.workdir = None
+        self.log = None
+        self.procs = []
+        self.fake_url = None
+        self.base_url = None
+
+    def __enter__(self):
+        self.workdir = tempfile.mkdtemp(prefix="pleione_bench_")
+        try:
+            self._start()
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def _start(self):
+        project = os.path.join(self.workdir, "project")
+        shutil.copytree(self.source_root, project, ignore=COPY_IGNORE, symlinks=True)
+        self.log = open(os.path.join(self.workdir, "servers.log"), 'w')
+
+        fake_port = _free_port()
+        self.fake_url = f"http://127.0.0.1:{fake_port}"
+        fake = subprocess.Popen([sys.executable, '-m', 'backend.bench.fake_lm_studio', '--port', str(fake_port),
+                                 *fake_arguments_to_argv(self.args)], cwd=project, stdout=self.log, stderr=self.log)
+        self.procs.append(fake)
+        _wait_for(f"{self.fake_url}/v1/models", fake)
+
+        app_port = _free_port()
+        self.base_url = f"http://127.0.0.1:{app_port}"
+        env = dict(os.environ, PLEIONE_LM_STUDIO_URL=f"{self.fake_url}/v1/chat/completions", **BENCH_SERVER_ENV)
+        app = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'backend.main:app', '--host', '127.0.0.1',
+                                '--port', str(app_port), '--log-level', 'warning'],
+                               cwd=project, env=env, stdout=self.log, stderr=self.log)
+        self.procs.append(app)
+        _wait_for(f"{self.base_url}/api/health", app)
+
+    def fake_stats(self):
+        try:
+            return httpx.get(f"{self.fake_url}/stats", timeout=5).json()
+        except httpx.HTTPError:
+            return None
+
+    def __exit__(self, *exc):
+        for proc in reversed(self.procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self.log:
+            self.log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+def _ms(value):
+    return f"{value * 1000:9.1f}" if value is not None else f"{'-':>9}"
+
+def format_report(report):
+    lines = [f"{'endpoint':<10} {'reqs':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}"]
+    for endpoint, row in report.items():
+        lines.append(f"{endpoint:<10} {row['requests']:>6} {row['errors']:>6} {_ms(row['p50'])} {_ms(row['p95'])} "
+                     f"{_ms(row['p99'])} {row['throughput'] if row['throughput'] is not None else '-':>8}")
+    return "\n".join(lines)
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Load-test Pleione's /api/chat, /api/files and /api/implement")
+    parser.add_argument("--target", help="base URL of a running server (default: start a private fake stack)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated subset of chat,files,implement")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100, help="total timed requests")
+    parser.add_argument("--timeout", type=float, default=120, help="per-request timeout in seconds")
+    parser.add_argument("--json", dest="json_path", help="also write the report as JSON to this path")
+    add_fake_arguments(parser)
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in endpoints if e not in ENDPOINTS]
+    if unknown or not endpoints:
+        print(f"❌ Unknown endpoint(s): {', '.join(unknown) or '(none given)'}")
+        return 2
+
+    def run(base_url):
+        print(f"🏋️ {args.requests} requests over {', '.join(endpoints)} at concurrency {args.concurrency} -> {base_url}")
+        samples, elapsed = asyncio.run(run_load(base_url, endpoints, args.concurrency, args.requests, args.timeout))
+        return {"elapsed": round(elapsed, 3), "concurrency": args.concurrency,
+                "throughput": round(sum(s["ok"] for s in samples) / elapsed, 3) if elapsed else None,
+                "endpoints": summarize(samples, elapsed)}
+
+    if args.target:
+        result = run(args.target.rstrip("/"))
+        # Whatever the target was started with; its coalescing and caches may still share work
+        result["server_settings"] = None
+    else:
+        with BenchStack(args) as stack:
+            result = run(stack.base_url)
+            result["fake_lm_studio"] = stack.fake_stats()
+            result["server_settings"] = dict(BENCH_SERVER_ENV)
+    result["unique_prompts"] = True
+
+    print(format_report(result["endpoints"]))
+    if result["server_settings"]:
+        print("⚙️ Unique prompt per request; server " + ", ".join(f"{k}={v}" for k, v in result["server_settings"].items()))
+    else:
+        print("⚙️ Unique prompt per request; target server settings unknown (coalescing and caches as configured there)")
+    print(f"⏱️ {result['elapsed']}s total, {result['throughput']} req/s overall")
+    if result.get("fake_lm_studio"):
+        stats = result["fake_lm_studio"]
+        print(f"🎭 LM requests {stats['requests']}, peak in flight {stats['max_in_flight']}, injected {stats['injected']}")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0 if all(row["errors"] == 0 for row in result["endpoints"].values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,63 @@
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 import uvicorn
 from .api.routes import router as chat_router
+from .models.llm_client import close_async_client, close_sync_client
+from .models.llm_pool import start_health_checks, stop_health_checks
+from .models.jobs import recover_jobs, shutdown_jobs, start_job_recovery, stop_job_recovery
+from .models.pytest_forkserver import start_forkserver, stop_forkserver, forkserver_available
+from .models.llm_connector import TEST_EXECUTION_MODE
+from .models.file_index import close_file_indexes
+from .models.workspaces import cleanup_workspaces
+from .models.metrics import HTTP_IN_FLIGHT, HTTP_DURATION
 
-app = FastAPI(title="Pleione AI Assistant", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app):
+    # Pick up background jobs persisted before a reload, then keep watching for handed-off ones
+    recover_jobs()
+    start_job_recovery()
+    cleanup_workspaces()
+    if TEST_EXECUTION_MODE == "forkserver" and forkserver_available():
+        start_forkserver()
+    # Probe the LLM backends' /v1/models so dead nodes are skipped
+    start_health_checks()
+    yield
+    await stop_job_recovery()
+    await shutdown_jobs()
+    await stop_health_checks()
+    # Release pooled keep-alive connections to LM Studio
+    await close_async_client()
+    close_sync_client()
+    stop_forkserver()
+    close_file_indexes()
+
+app = FastAPI(title="Pleione AI Assistant", version="1.0.0", lifespan=lifespan)
+
+@app.middleware("http")
+async def track_requests(request, call_next):
+    """In-flight gauge and per-route latency for /api/metrics (streams count until headers are sent)"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        with HTTP_IN_FLIGHT.track():
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_DURATION.observe(time.perf_counter() - started, method=request.method,
+                              route=_route_template(request), status=status)
+
+def _route_template(request):
+    """/api/jobs/abc -> /api/jobs/{job_id}, so labels don't grow with IDs"""
+    if request.scope.get("route") is None:
+        return "unmatched"
+    path = request.url.path
+    for name, value in request.path_params.items():
+        path = path.replace(f"/{value}", f"/{{{name}}}", 1)
+    return path
 
 # Include API routes
 app.include_router(chat_router, prefix="/api")
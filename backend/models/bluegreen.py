@@ -0,0 +1,327 @@
+"""Zero-downtime blue/green deploys behind a small local TCP proxy.
+
+The proxy owns the public port and forwards every new connection to the
+worker the state file names as active; connections already open stay on
+the worker they started on. A deploy applies the package, starts the new
+version on the other worker port, waits for /api/health, flips the state
+file and keeps probing for PLEIONE_DEPLOY_WATCH seconds. Only then is the
+old worker sent SIGTERM, which uvicorn turns into a graceful drain of its
+in-flight requests and background jobs. If the new worker never becomes
+healthy, or fails a probe while being watched, traffic is switched back to
+the old worker (still running) and the package is reverted.
+"""
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .update_packages import PACKAGES_DIR, apply_package, create_delta_package, load_manifest
+
+STATE_PATH = "./backend/self_updates/bluegreen.json"
+LOGS_DIR = "./backend/self_updates/logs/"
+PUBLIC_PORT = int(os.environ.get("PLEIONE_PORT", "8000"))
+WORKER_PORTS = {"blue": 8001, "green": 8002}
+HEALTH_TIMEOUT = float(os.environ.get("PLEIONE_DEPLOY_HEALTH_TIMEOUT", "30"))  # new worker must answer within this
+WATCH_SECONDS = float(os.environ.get("PLEIONE_DEPLOY_WATCH", "10"))  # probing after the switch, before draining
+DRAIN_TIMEOUT = float(os.environ.get("PLEIONE_DRAIN_TIMEOUT", "60"))  # old worker's grace period for in-flight work
+
+def _other(color):
+    return "green" if color == "blue" else "blue"
+
+def _is_zombie(pid):
+    """True if pid has exited but its parent has not reaped it yet (Linux /proc; False elsewhere)"""
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            stat = f.read()
+    except OSError:
+        return False
+    # The command name is parenthesized and may contain spaces; the state follows it
+    return stat.rsplit(")", 1)[-1].split()[:1] == ["Z"]
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        # Reap it first if it is our own exited child, otherwise kill(0) sees the zombie
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # Someone else's exited child (e.g. a worker the proxy started, seen from the deploy CLI)
+    return not _is_zombie(pid)
+
+def _reap_children():
+    """Collect every exited child of this process; returns their pids"""
+    reaped = []
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if not pid:
+            break
+        reaped.append(pid)
+    return reaped
+
+def load_state(state_path=STATE_PATH):
+    try:
+        with open(state_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state, state_path=STATE_PATH):
+    """Write the state atomically; the proxy reads it on the next connection"""
+    os.makedirs(os.path.dirname(state_path) or ".", exist_ok=True)
+    state["updated_at"] = time.time()
+    tmp_path = f"{state_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+# --- Proxy ---
+
+class _ActiveTarget:
+    """Active worker port, re-read only when the state file's mtime changes"""
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.mtime = None
+        self.port = None
+
+    def get(self):
+        try:
+            mtime = os.stat(self.state_path).st_mtime_ns
+        except OSError:
+            return self.port
+        if mtime != self.mtime:
+            active = load_state(self.state_path).get("active")
+            if active:
+                self.port = active["port"]
+            self.mtime = mtime
+        return self.port
+
+async def _pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        writer.close()
+
+async def _proxy_connection(target, client_reader, client_writer):
+    port = target.get()
+    try:
+        if port is None:
+            raise ConnectionRefusedError("no active worker")
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        client_writer.close()
+        return
+    try:
+        await asyncio.gather(_pipe(client_reader, upstream_writer), _pipe(upstream_reader, client_writer))
+    finally:
+        upstream_writer.close()
+        client_writer.close()
+
+async def start_proxy(port=PUBLIC_PORT, state_path=STATE_PATH, host="0.0.0.0"):
+    """Start listening; returns the asyncio server (already serving)"""
+    target = _ActiveTarget(state_path)
+    return await asyncio.start_server(
+        lambda reader, writer: _proxy_connection(target, reader, writer), host, port)
+
+# --- Workers ---
+
+def start_worker(color, root=".", port=None):
+    """Start a uvicorn worker for the code in root; returns (pid, port)"""
+    port = port or WORKER_PORTS[color]
+    os.makedirs(os.path.join(root, LOGS_DIR), exist_ok=True)
+    env = dict(os.environ, PLEIONE_JOB_DRAIN_TIMEOUT=str(DRAIN_TIMEOUT))
+    with open(os.path.join(root, LOGS_DIR, f"worker_{color}.log"), 'a') as log:
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'backend.main:app', '--host', '127.0.0.1', '--port', str(port),
+             '--timeout-graceful-shutdown', str(int(DRAIN_TIMEOUT))],
+            cwd=root, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    return proc.pid, port
+
+def check_health(port, timeout=2):
+    try:
+        return httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=timeout).status_code == 200
+    except httpx.HTTPError:
+        return False
+
+def wait_healthy(pid, port, timeout=HEALTH_TIMEOUT):
+    """Poll the worker until /api/health answers; (healthy, reason)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not pid_alive(pid):
+            return False, "worker exited during startup"
+        if check_health(port, timeout=1):
+            return True, ""
+        time.sleep(0.2)
+    return False, f"worker did not become healthy within {timeout}s"
+
+def watch_healthy(pid, port, seconds=WATCH_SECONDS, interval=1.0):
+    """Keep probing a worker that is already taking traffic; (healthy, reason)"""
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if not pid_alive(pid):
+            return False, "worker exited after the switch"
+        if not check_health(port):
+            return False, "health check failed after the switch"
+        time.sleep(interval)
+    return True, ""
+
+def stop_worker(pid, drain_timeout=DRAIN_TIMEOUT):
+    """SIGTERM (graceful drain), then SIGKILL if it is still running after the grace period"""
+    if not pid_alive(pid):
+        return
+    os.kill(pid, signal.SIGTERM)
+    # uvicorn waits up to drain_timeout for requests, then the job drain gets as long again
+    deadline = time.monotonic() + 2 * drain_timeout + 5
+    while time.monotonic() < deadline:
+        if not pid_alive(pid):
+            return
+        time.sleep(0.2)
+    os.kill(pid, signal.SIGKILL)
+
+# --- Commands ---
+
+def start(port=PUBLIC_PORT, root=".", state_path=STATE_PATH):
+    """Start (or adopt) the active worker, then run the proxy in the foreground"""
+    state = load_state(state_path)
+    active = state.get("active")
+    if not active or not pid_alive(active.get("pid")):
+        pid, worker_port = start_worker("blue", root)
+        healthy, reason = wait_healthy(pid, worker_port)
+        if not healthy:
+            stop_worker(pid, drain_timeout=0)
+            print(f"❌ Pleione worker failed to start: {reason}")
+            return 1
+        state["active"] = {"color": "blue", "port": worker_port, "pid": pid}
+    state["proxy_pid"] = os.getpid()
+    state["public_port"] = port
+    save_state(state, state_path)
+    print(f"✅ Proxy on port {port} -> {state['active']['color']} worker on port {state['active']['port']}")
+
+    async def reap():
+        # Workers started here are stopped by the deploy CLI, so reap them as they exit
+        while True:
+            for pid in _reap_children():
+                print(f"🪦 Worker pid {pid} exited")
+            await asyncio.sleep(1)
+
+    async def serve():
+        server = await start_proxy(port, state_path)
+        reaper = asyncio.create_task(reap())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reaper.cancel()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def deploy(manifest_path, root=".", state_path=STATE_PATH, packages_dir=None):
+    """Apply a package and move traffic to a new worker without stopping the old one first
+
+    Returns {"status": "deployed" | "rolled_back" | "failed", "message", ...}.
+    """
+    packages_dir = packages_dir or os.path.dirname(manifest_path) or PACKAGES_DIR
+    state = load_state(state_path)
+    old = state.get("active")
+    if not pid_alive(state.get("proxy_pid")) or not old or not pid_alive(old.get("pid")):
+        return {"status": "failed",
+                "message": "Blue/green proxy is not running - start Pleione with PLEIONE_DEPLOY_MODE=bluegreen ./run.sh"}
+
+    # Snapshot what the package overwrites, so switch-back can restore it
+    manifest = load_manifest(manifest_path)
+    _, snapshot_path = create_delta_package(
+        root, list(manifest["files"]) + manifest["deleted"], packages_dir=packages_dir,
+        metadata={"rollback_for": manifest["id"]})
+    applied = apply_package(manifest_path, root=root, packages_dir=packages_dir)
+    if applied["status"] != "success":
+        return {"status": "failed", "message": applied["message"]}
+
+    color = _other(old["color"])
+    pid, port = start_worker(color, root)
+    new = {"color": color, "port": port, "pid": pid, "package": manifest["id"]}
+
+    def switch_back(reason):
+        state["active"] = old
+        state.pop("draining", None)
+        save_state(state, state_path)
+        stop_worker(pid, drain_timeout=5)
+        apply_package(snapshot_path, root=root, force=True, packages_dir=packages_dir)
+        return {"status": "rolled_back", "message": f"{color} worker {reason}; still serving {old['color']}",
+                "snapshot": snapshot_path}
+
+    healthy, reason = wait_healthy(pid, port)
+    if not healthy:
+        return switch_back(reason)
+
+    state["active"] = new
+    state["draining"] = old
+    save_state(state, state_path)
+    print(f"🔀 Traffic switched: {old['color']} -> {color} (port {port})")
+
+    healthy, reason = watch_healthy(pid, port)
+    if not healthy:
+        return switch_back(reason)
+
+    started = time.monotonic()
+    stop_worker(old["pid"])
+    state.pop("draining", None)
+    save_state(state, state_path)
+    return {"status": "deployed", "active": new, "snapshot": snapshot_path,
+            "drain_duration": round(time.monotonic() - started, 3),
+            "message": f"Serving {color} on port {port}; {old['color']} drained"}
+
+def _main(argv):
+    """python3 -m backend.models.bluegreen start [port] | deploy <manifest> | status"""
+    if not argv:
+        print(_main.__doc__)
+        return 2
+    command, args = argv[0], argv[1:]
+    if command == "start":
+        return start(int(args[0]) if args else PUBLIC_PORT)
+    if command == "deploy" and args:
+        result = deploy(args[0])
+        icon = {"deployed": "✅", "rolled_back": "↩️"}.get(result["status"], "❌")
+        print(f"{icon} {result['message']}")
+        if result.get("snapshot"):
+            print(f"   Revert files with: python3 -m backend.models.update_packages apply {result['snapshot']} --force")
+        return 0 if result["status"] == "deployed" else 1
+    if command == "status":
+        state = load_state()
+        for role in ("active", "draining"):
+            worker = state.get(role)
+            if worker:
+                alive = "up" if pid_alive(worker["pid"]) else "down"
+                print(f"{role}: {worker['color']} port {worker['port']} pid {worker['pid']} ({alive})")
+        return 0
+    print(_main.__doc__)
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,129 @@
+"""Single-flight coalescing of identical in-flight generations.
+
+Requests with the same normalized prompt, context file contents and options
+share one generate_code_and_tests run: the first caller starts it, later
+callers attach to it, receive the progress events emitted so far plus the
+rest as they happen, and get a copy of its result. The run is only
+cancelled when every caller waiting on it has gone away.
+"""
+import asyncio
+import concurrent.futures
+import copy
+import hashlib
+import json
+import os
+import threading
+
+from .metrics import Counter
+
+COALESCE_ENABLED = os.environ.get("PLEIONE_COALESCE", "1") == "1"
+
+COALESCED_GENERATIONS = Counter("pleione_coalesced_generations_total",
+                                "Generation requests served by attaching to an identical in-flight run")
+
+_flights = {}  # key -> flight dict
+_lock = threading.Lock()
+
+def _file_digest(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+def generation_key(prompt, files_to_include=None, **options):
+    """Hash of the whitespace-normalized prompt, the context files' contents and the options"""
+    material = {
+        "prompt": " ".join(prompt.split()),
+        "files": {path: _file_digest(path) for path in sorted(files_to_include or [])},
+        "options": options
+    }
+    encoded = json.dumps(material, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+def in_flight():
+    """Number of distinct generations currently running"""
+    with _lock:
+        return len(_flights)
+
+def _deliver(listener, event):
+    loop, callback = listener
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if loop is running:
+        callback(event)
+    else:
+        loop.call_soon_threadsafe(callback, event)
+
+async def run_coalesced(key, run, on_event=None):
+    """Await run(emit) once per key, however many callers ask concurrently
+
+    run is called (by the first caller only) with an emit function, or with
+    None when that caller wanted no events; so that a later caller wanting
+    events is not attached to a run that emits none, the key must tell the
+    two apart. Callers other than the first get a deep copy of the result
+    marked "coalesced": True.
+    """
+    loop = asyncio.get_running_loop()
+    listener = (loop, on_event) if on_event else None
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = {"future": concurrent.futures.Future(), "task": None, "loop": loop,
+                      "listeners": [], "events": [], "waiters": 0}
+            _flights[key] = flight
+        replay = list(flight["events"])
+        flight["waiters"] += 1
+        if listener:
+            flight["listeners"].append(listener)
+
+    if leader:
+        def emit(event):
+            with _lock:
+                flight["events"].append(event)
+                listeners = list(flight["listeners"])
+            for target in listeners:
+                _deliver(target, event)
+
+        def finish(task):
+            with _lock:
+                if _flights.get(key) is flight:
+                    del _flights[key]
+            if task.cancelled():
+                flight["future"].set_exception(RuntimeError("Generation was cancelled"))
+            elif task.exception() is not None:
+                flight["future"].set_exception(task.exception())
+            else:
+                flight["future"].set_result(task.result())
+
+        flight["task"] = asyncio.ensure_future(run(emit if on_event else None))
+        flight["task"].add_done_callback(finish)
+    else:
+        COALESCED_GENERATIONS.inc()
+        print("🔗 Attached to an identical generation already in flight")
+        if on_event:
+            for event in replay:
+                on_event(event)
+
+    try:
+        # shield: one caller going away must not cancel the shared future
+        result = await asyncio.shield(asyncio.wrap_future(flight["future"]))
+    except asyncio.CancelledError:
+        with _lock:
+            flight["waiters"] -= 1
+            if listener in flight["listeners"]:
+                flight["listeners"].remove(listener)
+            abandoned = flight["waiters"] == 0
+            if abandoned and _flights.get(key) is flight:
+                del _flights[key]
+        if abandoned and flight["task"] is not None:
+            flight["loop"].call_soon_threadsafe(flight["task"].cancel)
+        raise
+    if leader:
+        return result
+    result = copy.deepcopy(result)
+    result["coalesced"] = True
+    return result
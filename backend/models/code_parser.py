@@ -0,0 +1,113 @@
+"""Incremental parser for the fenced code blocks in an LLM response.
+
+Text can be fed in arbitrary chunks (e.g. streamed tokens); complete lines
+drive a small state machine, and each python block is written to disk the
+moment its closing fence arrives. A block's filename comes from a
+`# Filename:` / `# File:` header inside it, or from a `name.py` mentioned in
+the prose just above it when that agrees with the content (test functions
+or a pytest/unittest import make a block a test file); blocks with neither
+get a generated name.
+"""
+import datetime
+import os
+import re
+import uuid
+
+PYTHON_FENCE_LANGUAGES = {"python", "py", "python3"}
+FILENAME_HEADER_RE = re.compile(r'^\s*#\s*(?:file(?:name)?|path)\s*:\s*`?([\w./\\-]+\.py)`?', re.IGNORECASE)
+PROSE_FILENAME_RE = re.compile(r'([\w-]+\.py)\b')
+TEST_CONTENT_RE = re.compile(r'^(?:def test_\w+|class Test\w+|import pytest|from pytest |import unittest|from unittest )', re.MULTILINE)
+
+def is_test_file(file_path):
+    """pytest's default discovery rule: test_*.py or *_test.py"""
+    name = os.path.basename(file_path)
+    return name.startswith("test_") or name.endswith("_test.py")
+
+class CodeFenceParser:
+    """Feed response text in any chunking; call close() for the list of files written
+
+    on_file(path) is called right after each file is written.
+    """
+
+    def __init__(self, sandbox_dir, test_dir, on_file=None):
+        self.sandbox_dir = sandbox_dir
+        self.test_dir = test_dir
+        self.on_file = on_file
+        self.files_created = []
+        self._partial = ""
+        self._fence = None  # None outside a block, else the block's language
+        self._lines = []
+        self._filename = None
+        self._prose_filename = None
+        self._last_code_stem = None
+
+    def feed(self, text):
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line)
+
+    def close(self):
+        """Flush the last line; a block still open (truncated response) is discarded"""
+        if self._partial:
+            self._line(self._partial)
+            self._partial = ""
+        self._fence = None
+        return self.files_created
+
+    def _line(self, line):
+        stripped = line.strip()
+        if self._fence is None:
+            if stripped.startswith("```"):
+                self._fence = stripped[3:].strip().lower() or "text"
+                self._lines = []
+                self._filename = None
+            else:
+                mentioned = PROSE_FILENAME_RE.findall(stripped)
+                if mentioned:
+                    self._prose_filename = mentioned[-1]
+            return
+        if stripped.startswith("```") and not stripped[3:].strip():
+            if self._fence in PYTHON_FENCE_LANGUAGES and any(l.strip() for l in self._lines):
+                self._save()
+            self._fence = None
+            self._prose_filename = None
+            return
+        if self._fence in PYTHON_FENCE_LANGUAGES and self._filename is None:
+            match = FILENAME_HEADER_RE.match(line)
+            if match:
+                self._filename = match.group(1)
+        self._lines.append(line)
+
+    def _name_block(self, code):
+        looks_like_tests = bool(TEST_CONTENT_RE.search(code))
+        name = self._filename
+        # A name from the prose ("tests for calculator.py:") only counts if it agrees with the content
+        if name is None and self._prose_filename and is_test_file(self._prose_filename) == looks_like_tests:
+            name = self._prose_filename
+        if name:
+            # Never let a generated name escape the sandbox
+            return os.path.basename(name.replace('\\', '/'))
+        # The random suffix keeps names from two generations in the same second apart once promoted
+        stem = f"generated_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        # Unnamed tests are paired with the code block before them
+        base = f"test_{self._last_code_stem or stem}" if looks_like_tests else stem
+        taken = {os.path.basename(path) for path in self.files_created}
+        name, n = f"{base}.py", 2
+        while name in taken:
+            name, n = f"{base}_{n}.py", n + 1
+        return name
+
+    def _save(self):
+        code = '\n'.join(self._lines)
+        name = self._name_block(code)
+        file_path = os.path.join(self.test_dir if is_test_file(name) else self.sandbox_dir, name)
+        with open(file_path, 'w') as f:
+            f.write(code)
+        if not is_test_file(name):
+            self._last_code_stem = os.path.splitext(name)[0]
+        if file_path not in self.files_created:
+            self.files_created.append(file_path)
+        print(f"✅ Created file: {file_path}")
+        if self.on_file:
+            self.on_file(file_path)
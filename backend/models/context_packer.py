@@ -0,0 +1,86 @@
+import os
+
+# Model context configuration. LM Studio does not report the loaded model's
+# window over the OpenAI API, so it is configured here.
+LLM_CONTEXT_WINDOW = int(os.environ.get("PLEIONE_LLM_CONTEXT_WINDOW", "8192"))
+LLM_MAX_TOKENS = int(os.environ.get("PLEIONE_LLM_MAX_TOKENS", "2000"))
+
+CHARS_PER_TOKEN = 4          # Rough average for English text and code
+MESSAGE_OVERHEAD_TOKENS = 4  # Role markers and separators per chat message
+MIN_TRIMMED_TOKENS = 256     # Don't bother including a trimmed file smaller than this
+
+def estimate_tokens(text):
+    """Cheap token estimate (no tokenizer dependency): ~4 characters per token"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def format_context_message(file_path, file_content):
+    return f"Here is the current content of {file_path}:\n{file_content}"
+
+def _rank(prompt, context_files):
+    """Files named in the prompt come first; otherwise keep the caller's order"""
+    prompt_lower = prompt.lower()
+    def mentioned(item):
+        file_path = item[1][0]
+        return os.path.basename(file_path).lower() in prompt_lower
+    ordered = sorted(enumerate(context_files.items()), key=lambda item: (not mentioned(item), item[0]))
+    return [entry for _, entry in ordered]
+
+def _trim_to_tokens(content, tokens):
+    """Keep whole leading lines of content within roughly `tokens` tokens"""
+    budget = tokens * CHARS_PER_TOKEN
+    cut = content.rfind("\n", 0, budget)
+    kept = content[:cut + 1] if cut > 0 else content[:budget]
+    dropped_lines = content[len(kept):].count("\n") + 1
+    return kept + f"\n... [truncated {dropped_lines} more lines to fit the context window]\n"
+
+def pack_context(prompt, context_files, system_prompt="", context_window=None, max_tokens=None):
+    """Fit context files into the model window, reserving room for the completion
+
+    Returns (packed_files, report). Files are taken in rank order while they
+    fit; one that doesn't is trimmed to the remaining budget if that leaves a
+    useful amount, and dropped otherwise. The report lists what was
+    included, trimmed and dropped, with token estimates.
+    """
+    context_window = context_window or LLM_CONTEXT_WINDOW
+    max_tokens = max_tokens or LLM_MAX_TOKENS
+    prompt_tokens = (estimate_tokens(system_prompt) + estimate_tokens(prompt) + 2 * MESSAGE_OVERHEAD_TOKENS)
+    budget = context_window - max_tokens - prompt_tokens
+
+    report = {
+        "context_window": context_window,
+        "reserved_for_completion": max_tokens,
+        "prompt_tokens": prompt_tokens,
+        "context_tokens": 0,
+        "included": [],
+        "trimmed": [],
+        "dropped": []
+    }
+    packed = {}
+    if not context_files:
+        return packed, report
+    if budget <= 0:
+        report["dropped"] = [{"path": path, "tokens": estimate_tokens(content), "reason": "prompt fills the context window"}
+                             for path, content in context_files.items()]
+        return packed, report
+
+    remaining = budget
+    for file_path, file_content in _rank(prompt, context_files):
+        tokens = estimate_tokens(format_context_message(file_path, file_content)) + MESSAGE_OVERHEAD_TOKENS
+        if tokens <= remaining:
+            packed[file_path] = file_content
+            report["included"].append(file_path)
+            remaining -= tokens
+            continue
+        header_tokens = estimate_tokens(format_context_message(file_path, "")) + MESSAGE_OVERHEAD_TOKENS + 32
+        available = remaining - header_tokens
+        if available >= MIN_TRIMMED_TOKENS:
+            trimmed = _trim_to_tokens(file_content, available)
+            packed[file_path] = trimmed
+            kept_tokens = estimate_tokens(format_context_message(file_path, trimmed)) + MESSAGE_OVERHEAD_TOKENS
+            report["trimmed"].append({"path": file_path, "tokens": tokens, "kept_tokens": kept_tokens})
+            remaining -= kept_tokens
+        else:
+            report["dropped"].append({"path": file_path, "tokens": tokens, "reason": "does not fit the remaining context budget"})
+
+    report["context_tokens"] = budget - remaining
+    return packed, report
@@ -0,0 +1,239 @@
+import atexit
+import fnmatch
+import os
+import threading
+import time
+
+try:
+    import watchfiles  # Ships with uvicorn[standard]; uses inotify on Linux
+except ImportError:
+    watchfiles = None
+
+# Always skipped, in addition to whatever .gitignore lists
+DEFAULT_EXCLUDES = [
+    ".git/",
+    "__pycache__/",
+    "node_modules/",
+    ".pytest_cache/",
+    "/backend/self_updates/staging/",
+    "/backend/jobs/",
+]
+
+# Without a watcher, directory mtimes are re-checked at most this often
+REFRESH_INTERVAL = 1.0
+
+class GitIgnore:
+    """Minimal .gitignore matcher: anchors, directory-only patterns and negation"""
+
+    def __init__(self, patterns):
+        self.rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            if negate:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            # A slash anywhere but the end anchors the pattern to the root
+            anchored = "/" in pattern
+            pattern = pattern.lstrip("/")
+            self.rules.append((pattern, negate, dir_only, anchored))
+
+    @classmethod
+    def from_file(cls, path, extra_patterns=()):
+        patterns = list(extra_patterns)
+        try:
+            with open(path, 'r') as f:
+                patterns.extend(f.read().splitlines())
+        except OSError:
+            pass
+        return cls(patterns)
+
+    def ignored(self, rel_path, is_dir):
+        """Return True if the root-relative path should be left out of the index"""
+        ignored = False
+        name = rel_path.rsplit("/", 1)[-1]
+        for pattern, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            target = rel_path if anchored else name
+            if fnmatch.fnmatchcase(target, pattern):
+                ignored = not negate
+        return ignored
+
+class ProjectFileIndex:
+    """In-memory index of project files, kept current incrementally
+
+    Directories are scanned once, then only re-scanned when they change:
+    through filesystem notifications when watchfiles is available, or by
+    comparing directory mtimes otherwise. Ignored directories (see
+    DEFAULT_EXCLUDES and .gitignore) are never entered.
+    """
+
+    def __init__(self, root="."):
+        self.root = os.path.abspath(root)
+        self.ignore = GitIgnore.from_file(os.path.join(self.root, ".gitignore"), DEFAULT_EXCLUDES)
+        self._lock = threading.RLock()
+        self._dir_files = {}
+        self._dir_mtimes = {}
+        self._sorted = None
+        self._last_refresh = 0.0
+        self._watcher = None
+        self._stop = threading.Event()
+        self._rescan_dir("")
+        self._start_watcher()
+
+    def _abs(self, rel_dir):
+        return os.path.join(self.root, rel_dir) if rel_dir else self.root
+
+    def _remove_subtree(self, rel_dir):
+        prefix = rel_dir + "/"
+        for indexed in [d for d in self._dir_files if d == rel_dir or d.startswith(prefix)]:
+            self._dir_files.pop(indexed, None)
+            self._dir_mtimes.pop(indexed, None)
+        self._sorted = None
+
+    def _rescan_dir(self, rel_dir):
+        """Re-read one directory, descending only into subdirectories that are new"""
+        with self._lock:
+            path = self._abs(rel_dir)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                entries = list(os.scandir(path))
+            except (FileNotFoundError, NotADirectoryError):
+                self._remove_subtree(rel_dir)
+                return
+
+            files = set()
+            subdirs = set()
+            for entry in entries:
+                rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if self.ignore.ignored(rel, is_dir):
+                    continue
+                if is_dir:
+                    subdirs.add(rel)
+                elif entry.is_file():
+                    files.add(entry.name)
+
+            was_indexed = rel_dir in self._dir_files
+            self._dir_files[rel_dir] = files
+            self._dir_mtimes[rel_dir] = mtime
+            self._sorted = None
+
+            # A directory seen for the first time has no indexed children yet
+            known = set()
+            if was_indexed:
+                prefix = rel_dir + "/" if rel_dir else ""
+                known = {d for d in self._dir_files
+                         if d and d.startswith(prefix) and "/" not in d[len(prefix):]}
+            for gone in known - subdirs:
+                self._remove_subtree(gone)
+            for new in subdirs - known:
+                self._rescan_dir(new)
+
+    def refresh(self, force=False):
+        """mtime fallback: re-scan only directories whose mtime changed"""
+        if self._watcher is not None and not force:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_refresh < REFRESH_INTERVAL:
+            return
+        self._last_refresh = now
+        with self._lock:
+            for rel_dir, mtime in list(self._dir_mtimes.items()):
+                if rel_dir not in self._dir_mtimes:
+                    continue  # Removed while refreshing a parent
+                try:
+                    changed = os.stat(self._abs(rel_dir)).st_mtime_ns != mtime
+                except OSError:
+                    changed = True
+                if changed:
+                    self._rescan_dir(rel_dir)
+
+    def _start_watcher(self):
+        if watchfiles is None:
+            return
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        """Apply filesystem notifications by re-scanning the affected directories"""
+        def keep(change, path):
+            rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+            return not any(self.ignore.ignored(part, True) for part in _parents(rel))
+
+        try:
+            for changes in watchfiles.watch(self.root, watch_filter=keep, stop_event=self._stop,
+                                            debounce=200, raise_interrupt=False):
+                dirty = set()
+                for _, path in changes:
+                    rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+                    dirty.add(rel.rsplit("/", 1)[0] if "/" in rel else "")
+                for rel_dir in sorted(dirty):
+                    self._rescan_dir(rel_dir)
+        except Exception as e:
+            print(f"⚠️ File watcher stopped, falling back to mtime scans: {e}")
+        self._watcher = None
+
+    def close(self):
+        """Stop the watcher thread (the index keeps working on mtime scans)"""
+        self._stop.set()
+        watcher = self._watcher
+        if watcher is not None and watcher is not threading.current_thread():
+            watcher.join(timeout=2)
+
+    def all_files(self):
+        """Return every indexed file as a sorted list of root-relative paths"""
+        self.refresh()
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sorted(
+                    f"{rel_dir}/{name}" if rel_dir else name
+                    for rel_dir, names in self._dir_files.items()
+                    for name in names
+                )
+            return self._sorted
+
+    def query(self, extensions=None, contains=None, offset=0, limit=None):
+        """Return (total, page) of indexed files filtered by extension and substring"""
+        files = self.all_files()
+        if extensions:
+            extensions = tuple(extensions)
+            files = [f for f in files if f.endswith(extensions)]
+        if contains:
+            needle = contains.lower()
+            files = [f for f in files if needle in f.lower()]
+        end = None if limit is None else offset + limit
+        return len(files), files[offset:end]
+
+def _parents(rel_path):
+    """Yield each directory prefix of a relative path (a/b/c -> a, a/b)"""
+    parts = rel_path.split("/")
+    for i in range(1, len(parts)):
+        yield "/".join(parts[:i])
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_file_index(root="."):
+    """Return the shared index for root, building it on first use"""
+    key = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = ProjectFileIndex(key)
+            _indexes[key] = index
+        return index
+
+def close_file_indexes():
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+        _indexes.clear()
+    for index in indexes:
+        index.close()
+
+# A watcher thread still blocked in native code at interpreter exit aborts the process
+atexit.register(close_file_indexes)
@@ -0,0 +1,132 @@
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from .metrics import observe_stage
+
+try:
+    import fcntl  # POSIX; serializes git access across processes
+except ImportError:
+    fcntl = None
+
+# Recent git operations with their durations, newest last
+GIT_TIMINGS = deque(maxlen=100)
+GIT_TIMEOUT = 60
+
+_thread_lock = threading.RLock()
+_lock_depth = threading.local()
+
+# "[master 1a2b3c4d] message" / "[main (root-commit) 1a2b3c4d] message"
+_COMMIT_HASH = re.compile(r"^\[[^\]]*?([0-9a-f]{7,40})\]", re.MULTILINE)
+
+def find_git_dir(root="."):
+    """Return the .git directory for root (searching upwards), or None outside a repository"""
+    current = os.path.abspath(root)
+    while True:
+        candidate = os.path.join(current, ".git")
+        if os.path.isdir(candidate):
+            return candidate
+        if os.path.isfile(candidate):
+            # Worktrees and submodules: ".git" is a file pointing at the real directory
+            with open(candidate, 'r') as f:
+                content = f.read().strip()
+            if content.startswith("gitdir:"):
+                return os.path.normpath(os.path.join(current, content[len("gitdir:"):].strip()))
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+
+@contextmanager
+def git_lock(root="."):
+    """Serialize repository access between threads and between processes
+
+    Re-entrant within a thread, so locked helpers can call each other.
+    """
+    with _thread_lock:
+        depth = getattr(_lock_depth, "value", 0)
+        lock_file = None
+        git_dir = find_git_dir(root) if depth == 0 else None
+        if git_dir and fcntl is not None:
+            lock_file = open(os.path.join(git_dir, "pleione.lock"), 'w')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _lock_depth.value = depth + 1
+        try:
+            yield
+        finally:
+            _lock_depth.value = depth
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+def _subcommand(args):
+    """The git subcommand in args, skipping `-c key=value` options"""
+    i = 0
+    while i < len(args) and args[i] == '-c':
+        i += 2
+    return args[i] if i < len(args) else ""
+
+def run_git(args, root=".", check=False, timings=None):
+    """Run one git command in root and record how long it took (also in `timings`, if given)"""
+    started = time.monotonic()
+    result = subprocess.run(['git', *args], cwd=root, capture_output=True, text=True, timeout=GIT_TIMEOUT)
+    timing = {"op": _subcommand(args), "duration": round(time.monotonic() - started, 4), "returncode": result.returncode}
+    GIT_TIMINGS.append(timing)
+    observe_stage("git", timing["duration"], timing["op"], error=result.returncode != 0)
+    if timings is not None:
+        timings.append(timing)
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, ['git', *args], result.stdout, result.stderr)
+    return result
+
+def commit_paths(message, paths=None, root="."):
+    """Commit the given paths plus any modified tracked files
+
+    Only `paths` are handed to `git add`, so untracked trees (sandbox,
+    staging, packages) are never scanned; tracked modifications and
+    deletions are picked up by `git commit -a`. The new hash is read from
+    the commit output. Returns a result dict with per-operation timings.
+    """
+    with git_lock(root):
+        timings = []
+        try:
+            if find_git_dir(root) is None:
+                run_git(['init'], root, check=True, timings=timings)
+                run_git(['add', '-A'], root, check=True, timings=timings)
+                run_git(['commit', '-m', 'Initial commit'], root, check=True, timings=timings)
+                print("✅ Git repository initialized")
+
+            existing = [p for p in (paths or []) if os.path.exists(os.path.join(root, p))]
+            if existing:
+                run_git(['add', '-A', '--', *existing], root, check=True, timings=timings)
+
+            result = run_git(['-c', 'core.abbrev=8', 'commit', '-a', '-m', message], root, timings=timings)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+            detail = getattr(e, "stderr", None) or str(e)
+            return {"status": "error", "message": f"Git backup failed: {detail.strip()}",
+                    "timings": timings}
+
+        if result.returncode == 0:
+            match = _COMMIT_HASH.search(result.stdout)
+            commit_hash = match.group(1)[:8] if match else ""
+            return {"status": "success", "commit_hash": commit_hash, "timings": timings}
+        if "nothing to commit" in result.stdout or "nothing added to commit" in result.stdout:
+            return {"status": "no_changes", "message": "No changes to backup", "timings": timings}
+        return {"status": "error", "message": f"Git backup failed: {(result.stderr or result.stdout).strip()}",
+                "timings": timings}
+
+def reset_hard(steps_back=1, root="."):
+    """Move HEAD (and the working tree) back steps_back commits in one git call"""
+    with git_lock(root):
+        timings = []
+        try:
+            result = run_git(['reset', '--hard', f'HEAD~{steps_back}'], root, check=True, timings=timings)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+            detail = getattr(e, "stderr", None) or str(e)
+            return {"status": "error", "message": f"Git rollback failed: {detail.strip()}",
+                    "timings": timings}
+        # "HEAD is now at 1a2b3c4 message"
+        return {"status": "success", "head": result.stdout.strip(), "timings": timings}
@@ -0,0 +1,197 @@
+import ast
+import os
+import sys
+
+# Changes to these can affect every test, so they always trigger the full suite
+FULL_SUITE_TRIGGERS = {"requirements.txt", "conftest.py", "pytest.ini", "pyproject.toml", "setup.cfg", "tox.ini"}
+# Directories whose modules tests import by bare name after a sys.path.append
+BARE_IMPORT_DIRS = ["backend/sandbox", "backend/tests"]
+# The frontend is only observable through the app that serves it
+FRONTEND_OBSERVERS = ["backend/main.py"]
+SKIPPED_DIRS = {".git", "__pycache__", "node_modules", "self_updates", "jobs", "cache"}
+
+def _python_files(root, top="backend"):
+    # Overlay staging trees link unchanged directories, so follow symlinks
+    for dirpath, dirnames, filenames in os.walk(os.path.join(root, top), followlinks=True):
+        dirnames[:] = [d for d in dirnames if d not in SKIPPED_DIRS]
+        for filename in filenames:
+            if filename.endswith(".py"):
+                path = os.path.join(dirpath, filename)
+                yield os.path.relpath(path, root).replace(os.sep, "/")
+
+def _module_name(rel_path):
+    """backend/models/x.py -> backend.models.x, backend/models/__init__.py -> backend.models"""
+    parts = rel_path[:-3].split("/")
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+def _parent_packages(rel_path, modules):
+    """__init__.py files executed when rel_path's module is imported"""
+    parts = rel_path.split("/")[:-1]
+    inits = []
+    for i in range(1, len(parts) + 1):
+        init = "/".join(parts[:i]) + "/__init__.py"
+        if init in modules.values():
+            inits.append(init)
+    return inits
+
+class ImportGraph:
+    """Static import graph over the backend package, its tests and sandbox modules"""
+
+    def __init__(self, root="."):
+        self.root = root
+        self.files = sorted(_python_files(root))
+        self.modules = {_module_name(f): f for f in self.files if "/" in f}
+        self.bare = {}
+        for directory in BARE_IMPORT_DIRS:
+            for f in self.files:
+                if os.path.dirname(f) == directory:
+                    self.bare.setdefault(os.path.basename(f)[:-3], f)
+        self.deps = {}
+        self.dynamic = set()
+        self.unparsable = set()
+        for f in self.files:
+            self.deps[f] = self._imports_of(f)
+
+    def _resolve(self, name, importer):
+        """Map an imported module name to a project file, or None for third-party/stdlib"""
+        candidates = []
+        if name in self.modules:
+            candidates.append(self.modules[name])
+        else:
+            top = name.split(".")[0]
+            sibling = os.path.join(os.path.dirname(importer), top + ".py").replace(os.sep, "/")
+            if sibling in self.deps or sibling in self.files:
+                candidates.append(sibling)
+            elif top in self.bare:
+                candidates.append(self.bare[top])
+        resolved = set()
+        for candidate in candidates:
+            resolved.add(candidate)
+            resolved.update(_parent_packages(candidate, self.modules))
+        return resolved
+
+    def _imports_of(self, rel_path):
+        try:
+            with open(os.path.join(self.root, rel_path), 'r') as f:
+                tree = ast.parse(f.read(), filename=rel_path)
+        except (OSError, SyntaxError, ValueError):
+            self.unparsable.add(rel_path)
+            return set()
+
+        package = _module_name(rel_path)
+        if not rel_path.endswith("__init__.py"):
+            package = package.rpartition(".")[0]
+
+        deps = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    deps |= self._resolve(alias.name, rel_path)
+            elif isinstance(node, ast.ImportFrom):
+                if node.level:
+                    base = package.split(".")
+                    base = base[:len(base) - (node.level - 1)] if node.level > 1 else base
+                    module = ".".join(base + ([node.module] if node.module else []))
+                else:
+                    module = node.module or ""
+                deps |= self._resolve(module, rel_path)
+                # `from pkg import submodule` imports the submodule too
+                for alias in node.names:
+                    deps |= self._resolve(f"{module}.{alias.name}", rel_path) if f"{module}.{alias.name}" in self.modules else set()
+            elif isinstance(node, ast.Call):
+                func = node.func
+                name = getattr(func, "attr", None) or getattr(func, "id", None)
+                if name in ("import_module", "__import__"):
+                    self.dynamic.add(rel_path)
+        deps.discard(rel_path)
+        return deps
+
+    def closure(self, rel_path):
+        """Every project file rel_path can execute through imports"""
+        seen = set()
+        stack = [rel_path]
+        while stack:
+            current = stack.pop()
+            for dep in self.deps.get(current, ()):
+                if dep not in seen:
+                    seen.add(dep)
+                    stack.append(dep)
+        return seen
+
+def _is_test_file(rel_path, test_dir):
+    return os.path.dirname(rel_path) == test_dir and os.path.basename(rel_path).startswith("test_")
+
+def select_tests(changed_paths, root=".", test_dir="backend/tests", full_if_empty=False):
+    """Map changed paths to the tests that can observe them
+
+    Returns a report: mode ("affected" or "full"), selected test files,
+    skipped tests with the reason, why each selected test was chosen, and
+    fallback_reason when the full suite had to be used.
+    """
+    graph = ImportGraph(root)
+    tests = [f for f in graph.files if _is_test_file(f, test_dir)]
+    changed = [os.path.normpath(p).replace(os.sep, "/") for p in changed_paths]
+    report = {"mode": "affected", "selected": [], "skipped": {}, "reasons": {},
+              "unobserved_changes": [], "fallback_reason": None}
+
+    def full(reason):
+        report.update(mode="full", selected=tests, skipped={}, fallback_reason=reason)
+        report["reasons"] = {t: [reason] for t in tests}
+        return report
+
+    for path in changed:
+        if os.path.basename(path) in FULL_SUITE_TRIGGERS:
+            return full(f"{path} can affect every test")
+        if path in graph.unparsable:
+            return full(f"{path} could not be parsed")
+
+    reasons = {}
+    for test in tests:
+        closure = graph.closure(test)
+        why = []
+        if test in graph.dynamic:
+            why.append("uses dynamic imports")
+        for path in changed:
+            if path == test:
+                why.append("test file changed")
+            elif path in closure:
+                why.append(f"imports {path}")
+            elif path.startswith("frontend/") and any(o in closure for o in FRONTEND_OBSERVERS):
+                why.append(f"loads the app serving {path}")
+        if why:
+            reasons[test] = why
+
+    for path in changed:
+        observed = any(path == t or any(path in w for w in why) for t, why in reasons.items())
+        if not observed:
+            report["unobserved_changes"].append(path)
+
+    if not reasons and full_if_empty:
+        return full("no tests observe the changed files")
+
+    report["selected"] = [t for t in tests if t in reasons]
+    report["reasons"] = reasons
+    report["skipped"] = {t: "does not import any changed file" for t in tests if t not in reasons}
+    return report
+
+def _main(argv):
+    """CLI for shell scripts: print the selected test files, one per line"""
+    import json
+    full_if_empty = "--full-if-empty" in argv
+    as_json = "--json" in argv
+    paths = [a for a in argv if not a.startswith("--")]
+    report = select_tests(paths, full_if_empty=full_if_empty)
+    if as_json:
+        print(json.dumps(report, indent=2))
+        return
+    for test, reason in report["skipped"].items():
+        print(f"⏭️  Skipping {test}: {reason}", file=sys.stderr)
+    if report["fallback_reason"]:
+        print(f"🧪 Running full suite: {report['fallback_reason']}", file=sys.stderr)
+    for test in report["selected"]:
+        print(test)
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
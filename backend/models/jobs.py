@@ -0,0 +1,286 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from .llm_connector import generate_code_and_tests_async
+
+# Background job configuration
+JOBS_DIR = "./backend/jobs/"
+JOB_MAX_WORKERS = int(os.environ.get("PLEIONE_JOB_MAX_WORKERS", "2"))
+JOB_MAX_PENDING = int(os.environ.get("PLEIONE_JOB_MAX_PENDING", "50"))
+JOB_FLUSH_INTERVAL = 1.0  # seconds between partial-result writes while streaming
+# Seconds shutdown waits for in-flight jobs before cancelling them (blue/green workers drain)
+JOB_DRAIN_TIMEOUT = float(os.environ.get("PLEIONE_JOB_DRAIN_TIMEOUT", "0"))
+# Finished jobs are deleted once older than this, and beyond the newest JOB_MAX_FINISHED
+JOB_TTL = float(os.environ.get("PLEIONE_JOB_TTL", str(7 * 24 * 3600)))
+JOB_MAX_FINISHED = int(os.environ.get("PLEIONE_JOB_MAX_FINISHED", "500"))
+# Seconds between rescans of JOBS_DIR for jobs handed off or left behind by another worker
+JOB_RECOVER_INTERVAL = float(os.environ.get("PLEIONE_JOB_RECOVER_INTERVAL", "5"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+class JobQueueFull(Exception):
+    """Raised when the number of pending jobs reaches JOB_MAX_PENDING"""
+
+_jobs = {}
+_tasks = {}
+_semaphore = None
+
+def _get_semaphore():
+    """Bound the number of generations running at once"""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(JOB_MAX_WORKERS)
+    return _semaphore
+
+def _job_path(job_id):
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+def _save_job(job):
+    """Persist job state atomically so it survives a server reload"""
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    job["updated_at"] = time.time()
+    tmp_path = _job_path(job["id"]) + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, _job_path(job["id"]))
+
+def _load_job(job_id):
+    try:
+        with open(_job_path(job_id), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _finished_at(job):
+    return job.get("finished_at") or job.get("updated_at") or job["created_at"]
+
+def prune_jobs(now=None):
+    """Delete finished jobs older than JOB_TTL and the oldest beyond JOB_MAX_FINISHED; returns how many"""
+    now = time.time() if now is None else now
+    finished = sorted((job for job in _jobs.values() if job["status"] not in ACTIVE_STATUSES),
+                      key=_finished_at, reverse=True)
+    expired = [job for index, job in enumerate(finished)
+               if index >= JOB_MAX_FINISHED or now - _finished_at(job) > JOB_TTL]
+    for job in expired:
+        _jobs.pop(job["id"], None)
+        try:
+            os.remove(_job_path(job["id"]))
+        except FileNotFoundError:
+            pass  # Another worker pruned it first
+    if expired:
+        print(f"🧹 Removed {len(expired)} finished job(s)")
+    return len(expired)
+
+def _pending_count():
+    return sum(1 for job in _jobs.values() if job["status"] in ACTIVE_STATUSES)
+
+def submit_job(prompt, files_to_include=None, bypass_cache=False):
+    """Queue a generate_code_and_tests run and return its job record immediately"""
+    if _pending_count() >= JOB_MAX_PENDING:
+        raise JobQueueFull(f"Too many pending jobs (limit {JOB_MAX_PENDING})")
+
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "queued",
+        "owner_pid": os.getpid(),
+        "prompt": prompt,
+        "files_to_include": files_to_include,
+        "bypass_cache": bypass_cache,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "attempt": 0,
+        "stage": "queued",
+        "partial_response": "",
+        "result": None,
+        "error": None
+    }
+    _jobs[job["id"]] = job
+    _save_job(job)
+    _start_task(job)
+    print(f"📥 Job queued: {job['id']}")
+    return job
+
+def _start_task(job):
+    _tasks[job["id"]] = asyncio.create_task(_run_job(job))
+
+async def _run_job(job):
+    """Run one job inside the bounded worker pool, recording progress as it goes"""
+    last_flush = 0.0
+
+    def on_event(event):
+        nonlocal last_flush
+        if event["type"] == "attempt":
+            job["attempt"] = event["attempt"]
+            job["partial_response"] = ""
+        elif event["type"] == "token":
+            job["partial_response"] += event["text"]
+        if event["type"] != "token":
+            job["stage"] = event["type"]
+        now = time.monotonic()
+        if event["type"] != "token" or now - last_flush >= JOB_FLUSH_INTERVAL:
+            last_flush = now
+            _save_job(job)
+
+    try:
+        async with _get_semaphore():
+            job["status"] = "running"
+            job["stage"] = "running"
+            job["started_at"] = time.time()
+            _save_job(job)
+            print(f"⚙️ Job started: {job['id']}")
+            result = await generate_code_and_tests_async(
+                job["prompt"], files_to_include=job["files_to_include"], on_event=on_event,
+                bypass_cache=job.get("bypass_cache", False)
+            )
+        job["result"] = result
+        job["status"] = "failed" if "error" in result else "completed"
+        job["error"] = result.get("error")
+    except asyncio.CancelledError:
+        # cancel_job sets "cancelled"; on shutdown a queued job stays queued so
+        # recover_jobs picks it up again, and a running one is marked interrupted
+        if job["status"] == "running":
+            job["status"] = "interrupted"
+        raise
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+    finally:
+        job["stage"] = job["status"]
+        if job["status"] != "queued":
+            job["finished_at"] = time.time()
+        _save_job(job)
+        _tasks.pop(job["id"], None)
+        print(f"🏁 Job {job['id']}: {job['status']}")
+        if job["status"] not in ACTIVE_STATUSES:
+            prune_jobs()
+
+def get_job(job_id):
+    """Return the job record from memory, falling back to disk"""
+    return _jobs.get(job_id) or _load_job(job_id)
+
+def list_jobs(limit=50):
+    """Return the most recent jobs, newest first"""
+    jobs = dict(_jobs)
+    if os.path.isdir(JOBS_DIR):
+        for filename in os.listdir(JOBS_DIR):
+            job_id, ext = os.path.splitext(filename)
+            if ext == ".json" and job_id not in jobs:
+                job = _load_job(job_id)
+                if job:
+                    jobs[job_id] = job
+    ordered = sorted(jobs.values(), key=lambda job: job["created_at"], reverse=True)
+    return ordered[:limit]
+
+def cancel_job(job_id):
+    """Cancel a queued or running job; returns the job record or None if unknown"""
+    job = get_job(job_id)
+    if job is None:
+        return None
+    if job["status"] not in ACTIVE_STATUSES:
+        return job
+    job["status"] = "cancelled"
+    task = _tasks.get(job_id)
+    if task is not None:
+        task.cancel()
+    else:
+        job["finished_at"] = time.time()
+        _save_job(job)
+    print(f"🛑 Job cancelled: {job_id}")
+    return job
+
+def _owned_by_live_worker(job):
+    """True if another server process (e.g. the draining blue/green worker) still runs this job"""
+    pid = job.get("owner_pid")
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def recover_jobs():
+    """Reload persisted jobs after a restart
+
+    Jobs that were still queued are re-queued. Jobs that were mid-generation
+    cannot be resumed and are marked "interrupted". Active jobs whose owner
+    process is still alive are left to it; get_job reads them from disk.
+    Runs at startup and then every JOB_RECOVER_INTERVAL (run_job_recovery),
+    so jobs a draining blue/green worker hands off are picked up too.
+    Finished jobs past their retention are deleted (prune_jobs).
+    """
+    if not os.path.isdir(JOBS_DIR):
+        return
+    for filename in os.listdir(JOBS_DIR):
+        job_id, ext = os.path.splitext(filename)
+        if ext != ".json" or job_id in _jobs:
+            continue
+        job = _load_job(job_id)
+        if job is None:
+            continue
+        if job["status"] in ACTIVE_STATUSES and _owned_by_live_worker(job):
+            continue
+        _jobs[job_id] = job
+        if job["status"] == "queued":
+            job["owner_pid"] = os.getpid()
+            _start_task(job)
+            print(f"♻️ Re-queued job: {job_id}")
+        elif job["status"] == "running":
+            job["status"] = "interrupted"
+            job["stage"] = "interrupted"
+            _save_job(job)
+    prune_jobs()
+
+async def run_job_recovery(interval=JOB_RECOVER_INTERVAL):
+    """Call recover_jobs every interval seconds until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        recover_jobs()
+
+_recovery_task = None
+
+def start_job_recovery():
+    """Start the periodic recover_jobs rescan on the running loop"""
+    global _recovery_task
+    if _recovery_task is None or _recovery_task.done():
+        _recovery_task = asyncio.get_running_loop().create_task(run_job_recovery())
+
+async def stop_job_recovery():
+    global _recovery_task
+    task, _recovery_task = _recovery_task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+async def shutdown_jobs(drain_timeout=None):
+    """Cancel in-flight jobs on shutdown so their state is persisted
+
+    Jobs still waiting for a worker slot are handed off right away: they are
+    saved as queued with no owner, so the worker taking over (or the next
+    start) re-queues them instead of waiting for this one to exit. With a
+    drain timeout, running jobs first get that long to finish on their own.
+    """
+    drain_timeout = JOB_DRAIN_TIMEOUT if drain_timeout is None else drain_timeout
+    handed_off = [job_id for job_id in _tasks if _jobs[job_id]["status"] == "queued"]
+    for job_id in handed_off:
+        _jobs[job_id]["owner_pid"] = None
+        _tasks[job_id].cancel()
+    if handed_off:
+        print(f"📤 Handed off {len(handed_off)} queued job(s)")
+    tasks = list(_tasks.values())
+    if tasks and drain_timeout > 0:
+        print(f"⏳ Draining {len(tasks)} job(s) for up to {drain_timeout:.0f}s")
+        await asyncio.wait(tasks, timeout=drain_timeout)
+        tasks = [task for task in tasks if not task.done()]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
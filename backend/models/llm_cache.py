@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Response cache configuration (opt-in: PLEIONE_LLM_CACHE=1)
+LLM_CACHE_ENABLED = os.environ.get("PLEIONE_LLM_CACHE", "0") == "1"
+LLM_CACHE_DIR = os.environ.get("PLEIONE_LLM_CACHE_DIR", "./backend/cache/llm/")
+LLM_CACHE_MEMORY_BYTES = int(os.environ.get("PLEIONE_LLM_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+LLM_CACHE_DISK_BYTES = int(os.environ.get("PLEIONE_LLM_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+LLM_CACHE_TTL = float(os.environ.get("PLEIONE_LLM_CACHE_TTL", str(24 * 3600)))
+
+def cache_key(payload):
+    """Content address of a completion request: model, messages, temperature, max_tokens"""
+    material = {
+        "model": payload.get("model"),
+        "messages": payload.get("messages"),
+        "temperature": payload.get("temperature"),
+        "max_tokens": payload.get("max_tokens")
+    }
+    encoded = json.dumps(material, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+class ResponseCache:
+    """Two-tier (memory LRU + disk) cache of completion text with TTL and size caps"""
+
+    def __init__(self, cache_dir=LLM_CACHE_DIR, memory_bytes=LLM_CACHE_MEMORY_BYTES,
+                 disk_bytes=LLM_CACHE_DISK_BYTES, ttl=LLM_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (created, text)
+        self._memory_size = 0
+        self._disk_size = None  # computed lazily on first write
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+                         "expired": 0, "memory_evictions": 0, "disk_evictions": 0}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _expired(self, created):
+        return time.time() - created > self.ttl
+
+    def _remember(self, key, created, text):
+        """Insert into the memory tier and evict least-recently-used entries over budget"""
+        size = len(text.encode("utf-8"))
+        if size > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key)[1].encode("utf-8"))
+        self._memory[key] = (created, text)
+        self._memory_size += size
+        while self._memory_size > self.memory_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted.encode("utf-8"))
+            self.counters["memory_evictions"] += 1
+
+    def get(self, key):
+        """Return cached text for key, or None on a miss"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[1]
+                self._memory_size -= len(self._memory.pop(key)[1].encode("utf-8"))
+                self.counters["expired"] += 1
+
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.counters["misses"] += 1
+            return None
+
+        with self._lock:
+            if self._expired(record["created"]):
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                self._remove_file(path)
+                return None
+            # Touch so disk eviction sees it as recently used
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            self._remember(key, record["created"], record["text"])
+            self.counters["disk_hits"] += 1
+            return record["text"]
+
+    def put(self, key, text):
+        """Store completion text in both tiers"""
+        created = time.time()
+        record = json.dumps({"created": created, "text": text})
+        with self._lock:
+            self._remember(key, created, text)
+            self.counters["stores"] += 1
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self._disk_size is None:
+                    self._disk_size = sum(size for _, size, _ in self._disk_entries())
+                if os.path.exists(path):
+                    self._disk_size -= os.path.getsize(path)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'w') as f:
+                    f.write(record)
+                os.replace(tmp_path, path)
+                self._disk_size += len(record.encode("utf-8"))
+                self._evict_disk()
+            except OSError as e:
+                print(f"⚠️ LLM cache write failed: {e}")
+
+    def _disk_entries(self):
+        """Yield (mtime, size, path) for every cached response on disk"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".json"):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def _remove_file(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            if self._disk_size is not None:
+                self._disk_size -= size
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        """Drop expired entries, then the least recently used, until under the disk budget"""
+        if self._disk_size <= self.disk_bytes:
+            return
+        now = time.time()
+        for mtime, size, path in sorted(self._disk_entries()):
+            if self._disk_size <= self.disk_bytes and now - mtime <= self.ttl:
+                break
+            self._remove_file(path)
+            self.counters["disk_evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            for _, _, path in list(self._disk_entries()):
+                self._remove_file(path)
+            self._disk_size = 0
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                "enabled": LLM_CACHE_ENABLED,
+                **self.counters,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._disk_size
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """Return the shared response cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+def cache_lookup(payload, bypass_cache=False):
+    """Return (key, cached_text) for a payload; key is None when caching is off"""
+    if not LLM_CACHE_ENABLED or bypass_cache:
+        return None, None
+    key = cache_key(payload)
+    return key, get_response_cache().get(key)
+
+def cache_store(key, text):
+    """Store a successful completion (error strings are never cached)"""
+    if key is None or text.startswith("Error"):
+        return
+    get_response_cache().put(key, text)
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import threading
+
+import httpx
+
+# Connection pool configuration for the LM Studio HTTP client.
+# Override with environment variables when serving several concurrent users.
+LLM_POOL_MAX_CONNECTIONS = int(os.environ.get("PLEIONE_LLM_POOL_MAX_CONNECTIONS", "20"))
+LLM_POOL_MAX_KEEPALIVE = int(os.environ.get("PLEIONE_LLM_POOL_MAX_KEEPALIVE", "10"))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.environ.get("PLEIONE_LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("PLEIONE_LLM_CONNECT_TIMEOUT", "10"))
+
+# One async client per event loop (httpx pools are bound to the loop that created them)
+_async_clients = {}
+_sync_client = None
+_lock = threading.Lock()
+
+def get_pool_limits():
+    """Return the httpx pool limits used for LM Studio connections"""
+    return httpx.Limits(
+        max_connections=LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY
+    )
+
+def make_timeout(total):
+    """Build an httpx timeout with a short connect phase and `total` for the rest"""
+    return httpx.Timeout(total, connect=min(LLM_CONNECT_TIMEOUT, total))
+
+def get_async_client():
+    """Return the keep-alive async client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(limits=get_pool_limits())
+            _async_clients[loop] = client
+        return client
+
+def get_sync_client():
+    """Return the shared keep-alive client for synchronous callers"""
+    global _sync_client
+    with _lock:
+        if _sync_client is None or _sync_client.is_closed:
+            _sync_client = httpx.Client(limits=get_pool_limits())
+        return _sync_client
+
+async def close_async_client():
+    """Close the async client bound to the running event loop, if any"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+def close_sync_client():
+    """Close the shared synchronous client, if any"""
+    global _sync_client
+    with _lock:
+        client, _sync_client = _sync_client, None
+    if client is not None:
+        client.close()
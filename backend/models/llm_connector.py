@@ -1,30 +1,81 @@
-import requests
+import asyncio
+import httpx
 import json
 import os
 import re
-import datetime
-import subprocess
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from .llm_client import get_async_client, make_timeout, close_async_client
+from .test_executor import run_tests_parallel, run_tests_forkserver
+from .pytest_forkserver import forkserver_available
+from .file_index import get_file_index
+from .llm_cache import cache_lookup, cache_store
+from .context_packer import pack_context, format_context_message, estimate_tokens, LLM_MAX_TOKENS
+from .code_parser import CodeFenceParser, is_test_file
+from .result_cache import RESULT_CACHE_ENABLED, result_cache_key, lookup_pass, store_pass
+from .coalesce import COALESCE_ENABLED, generation_key, run_coalesced
+from .workspaces import create_workspace, close_workspace, promote_files, PromotionConflict
+from .llm_pool import get_llm_pool, CONNECT_ERRORS
+from .llm_timeouts import plan_timeouts, payload_prompt_tokens, record_completion
+from .sandbox_limits import run_limited
+from .metrics import (timed, observe_stage, LLM_IN_FLIGHT, GENERATION_ATTEMPTS, GENERATIONS,
+                      ATTEMPTS_PER_GENERATION, TEST_FILES, TEST_CPU_SECONDS, TEST_MAX_RSS, TEST_LIMIT_HITS)
 
 # Utility: List all files in the project
-def list_project_files(root_dir=".", extensions=None):
-    """Return a list of all files in the project, optionally filtered by extension(s)"""
-    file_list = []
-    for dirpath, _, filenames in os.walk(root_dir):
-        for filename in filenames:
-            if extensions:
-                if any(filename.endswith(ext) for ext in extensions):
-                    file_list.append(os.path.join(dirpath, filename))
-            else:
-                file_list.append(os.path.join(dirpath, filename))
-    return file_list
+def list_project_files(root_dir=".", extensions=None, contains=None, offset=0, limit=None, with_total=False):
+    """Return project files from the cached index, optionally filtered by extension(s)
+
+    Paths keep the "./dir/file" form of a walk from root_dir. Ignored paths
+    (.gitignore, .git, __pycache__, staging copies, ...) are left out. With
+    with_total=True, returns (total_matches, page) for paginated callers.
+    """
+    total, files = get_file_index(root_dir).query(extensions=extensions, contains=contains,
+                                                  offset=offset, limit=limit)
+    files = [os.path.join(root_dir, f) for f in files]
+    return (total, files) if with_total else files
 
 # Utility: Read file contents
-def read_file_contents(file_path, max_lines=200):
-    """Read up to max_lines from a file and return as a string"""
+CONTEXT_FILE_MAX_BYTES = 256 * 1024  # Never read more than this from one context file
+FILE_READ_CACHE_ENTRIES = 256
+
+_file_read_cache = OrderedDict()
+_file_read_cache_lock = threading.Lock()
+
+def read_file_contents(file_path, max_lines=200, max_bytes=CONTEXT_FILE_MAX_BYTES):
+    """Read up to max_lines (and at most max_bytes) from a file and return as a string
+
+    The file is streamed and reading stops at whichever limit is hit first.
+    Results are cached by (path, mtime, size), so unchanged files are only
+    stat'ed on repeat requests and retries.
+    """
     try:
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-            return ''.join(lines[:max_lines])
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size, max_lines, max_bytes)
+        with _file_read_cache_lock:
+            if key in _file_read_cache:
+                _file_read_cache.move_to_end(key)
+                return _file_read_cache[key]
+        
+        lines = []
+        remaining = max_bytes
+        with open(file_path, 'rb') as f:
+            while len(lines) < max_lines and remaining > 0:
+                # readline's limit keeps one huge line (minified JS, data) from being loaded whole
+                line = f.readline(remaining)
+                if not line:
+                    break
+                lines.append(line)
+                remaining -= len(line)
+        content = b''.join(lines).decode('utf-8', errors='replace')
+        
+        with _file_read_cache_lock:
+            _file_read_cache[key] = content
+            while len(_file_read_cache) > FILE_READ_CACHE_ENTRIES:
+                _file_read_cache.popitem(last=False)
+        return content
     except Exception as e:
         return f"Error reading {file_path}: {str(e)}"
 
@@ -39,164 +90,307 @@ def update_file_contents(file_path, new_content):
         return f"Error updating {file_path}: {str(e)}"
 
 # LM Studio configuration
-LM_STUDIO_URL = "http://localhost:1234/v1/chat/completions"
+LM_STUDIO_URL = os.environ.get("PLEIONE_LM_STUDIO_URL", "http://localhost:1234/v1/chat/completions")
 LM_STUDIO_MODEL = "local-model"  # This will use whatever model is loaded in LM Studio
 
-# Timeout configurations (in seconds)
-TIMEOUT_SIMPLE = 120      # 2 minutes for simple requests
-TIMEOUT_COMPLEX = 600     # 10 minutes for complex code generation
-TIMEOUT_MASSIVE = 900     # 15 minutes for large multi-file projects
+SYSTEM_PROMPT = "You are Pleione, a helpful AI assistant that generates safe, well-tested code. Always provide working code with proper error handling and include test cases."
 
-def get_request_timeout(prompt, context_files=None):
-    """Determine appropriate timeout based on request complexity"""
-    # Count complexity factors
-    complexity_score = 0
-    
-    # Length-based factors
-    if len(prompt) > 1000:
-        complexity_score += 2
-    elif len(prompt) > 500:
-        complexity_score += 1
-    
-    # Context files factor
-    if context_files and len(context_files) > 3:
-        complexity_score += 2
-    elif context_files and len(context_files) > 1:
-        complexity_score += 1
-    
-    # Keywords indicating complex operations
-    complex_keywords = ['refactor', 'implement', 'create system', 'build application', 
-                       'full project', 'multiple files', 'complex', 'advanced']
-    if any(keyword in prompt.lower() for keyword in complex_keywords):
-        complexity_score += 2
-    
-    # Return appropriate timeout
-    if complexity_score >= 4:
-        return TIMEOUT_MASSIVE
-    elif complexity_score >= 2:
-        return TIMEOUT_COMPLEX
-    else:
-        return TIMEOUT_SIMPLE
-
-def get_llm_response(prompt, context_files=None):
-    """Get response from LM Studio API with dynamic timeout based on complexity"""
-    try:
-        # Determine appropriate timeout
-        timeout = get_request_timeout(prompt, context_files)
-        print(f"🕐 Request complexity timeout: {timeout} seconds")
-        
-        messages = [
-            {
-                "role": "system",
-                "content": "You are Pleione, a helpful AI assistant that generates safe, well-tested code. Always provide working code with proper error handling and include test cases."
-            },
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ]
-        # If context files are provided, add them to the prompt
-        if context_files:
-            for file_path, file_content in context_files.items():
-                messages.append({
-                    "role": "user",
-                    "content": f"Here is the current content of {file_path}:\n{file_content}"
-                })
-        payload = {
-            "model": LM_STUDIO_MODEL,
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 2000
+def build_llm_payload(prompt, context_files=None, temperature=0.7):
+    """Build the OpenAI-compatible chat completion payload for LM Studio"""
+    messages = [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": prompt
         }
-        headers = {
-            "Content-Type": "application/json"
-        }
-        # Use dynamic timeout based on request complexity
-        response = requests.post(LM_STUDIO_URL, json=payload, headers=headers, timeout=timeout)
-        if response.status_code == 200:
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        else:
-            return f"Error: LM Studio API returned status {response.status_code}"
-    except requests.exceptions.ConnectionError:
+    ]
+    # If context files are provided, add them to the prompt (packed to fit the context window)
+    if context_files:
+        context_files, _ = pack_context(prompt, context_files, system_prompt=SYSTEM_PROMPT)
+        for file_path, file_content in context_files.items():
+            messages.append({
+                "role": "user",
+                "content": format_context_message(file_path, file_content)
+            })
+    return {
+        "model": LM_STUDIO_MODEL,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": LLM_MAX_TOKENS
+    }
+
+def _llm_error_message(error):
+    """Map a transport exception to the error strings callers check for"""
+    if isinstance(error, httpx.ConnectError):
         return "Error: Cannot connect to LM Studio. Please ensure LM Studio is running on port 1234."
-    except requests.exceptions.Timeout:
+    if isinstance(error, httpx.TimeoutException):
         return "Error: Request to LM Studio timed out."
+    return f"Error connecting to LM Studio: {str(error)}"
+
+def _plan_request(payload):
+    """Timeouts for a payload, sized from the loaded model's recorded speed"""
+    prompt_tokens = payload_prompt_tokens(payload)
+    plan = plan_timeouts(prompt_tokens, payload["max_tokens"])
+    print(f"🕐 LLM timeouts ({plan['source']}): first token {plan['first_token']}s, "
+          f"idle {plan['idle']}s, total {plan['total']}s")
+    return prompt_tokens, plan
+
+def get_llm_response(prompt, context_files=None, bypass_cache=False):
+    """Synchronous get_llm_response_async for scripts; not for use inside a running event loop"""
+    async def _run():
+        try:
+            return await get_llm_response_async(prompt, context_files, bypass_cache)
+        finally:
+            # The pooled client is bound to this short-lived event loop
+            await close_async_client()
+    return asyncio.run(_run())
+
+async def get_llm_response_async(prompt, context_files=None, bypass_cache=False, temperature=0.7):
+    """Get the whole completion from LM Studio without blocking the event loop
+
+    The completion is streamed under the hood and collected, so a backend
+    that never answers or stalls mid-answer is given up on after the
+    first-token or idle timeout rather than the overall deadline.
+    """
+    try:
+        payload = build_llm_payload(prompt, context_files, temperature)
+        cache_key, cached = await asyncio.to_thread(cache_lookup, payload, bypass_cache)
+        if cached is not None:
+            print("⚡ LLM response served from cache")
+            return cached
+        
+        parts = []
+        with timed("llm_request", "async"), LLM_IN_FLIGHT.track():
+            async for delta in stream_llm_response(prompt, context_files, temperature):
+                parts.append(delta)
+        content = "".join(parts)
+        await asyncio.to_thread(cache_store, cache_key, content)
+        return content
+    except httpx.HTTPStatusError as e:
+        return f"Error: LM Studio API returned status {e.response.status_code}"
     except Exception as e:
-        return f"Error connecting to LM Studio: {str(e)}"
+        return _llm_error_message(e)
 
-def parse_and_save_code(llm_response, sandbox_dir, test_dir):
-    """Parse LLM response and save code files to sandbox"""
-    files_created = []
-    
-    # Enhanced prompt asks for specific format, so we parse it
-    lines = llm_response.split('\n')
-    current_section = None
-    current_code = []
-    current_filename = None
-    
-    for line in lines:
-        # Look for code blocks
-        if '```python' in line.lower():
-            current_section = 'code'
-            current_code = []
+async def _stream_deltas(response, plan, started, progress):
+    """Text deltas from an SSE completion response, enforcing the planned timeouts
+
+    Raises httpx.ReadTimeout when no token arrives within the first-token
+    timeout, when the stream then goes quiet for longer than the idle
+    timeout, or when the overall deadline passes. progress gets the reported
+    model and the time of the first token.
+    """
+    deadline = started + plan["total"]
+    last_token_at = started
+    lines = response.aiter_lines()
+    while True:
+        # Keep-alive or role-only chunks don't count as progress
+        limit = plan["first_token"] if progress["first_token_at"] is None else plan["idle"]
+        now = time.monotonic()
+        wait = min(last_token_at + limit, deadline) - now
+        try:
+            line = await asyncio.wait_for(lines.__anext__(), timeout=max(wait, 0))
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError:
+            if now + wait >= deadline:
+                reason = f"no end of response within {plan['total']}s"
+            elif progress["first_token_at"] is None:
+                reason = f"no first token within {plan['first_token']}s"
+            else:
+                reason = f"stream stalled for {plan['idle']}s"
+            raise httpx.ReadTimeout(f"LM Studio {reason}", request=response.request)
+        # OpenAI-compatible servers send "data: {json}" lines and a final "data: [DONE]"
+        if not line.startswith("data:"):
             continue
-        elif '```' in line and current_section:
-            # End of code block - save the file
-            if current_code and current_filename:
-                file_path = os.path.join(sandbox_dir if 'test_' not in current_filename else test_dir, current_filename)
-                with open(file_path, 'w') as f:
-                    f.write('\n'.join(current_code))
-                files_created.append(file_path)
-                print(f"✅ Created file: {file_path}")
-            current_section = None
-            current_code = []
-            current_filename = None
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        try:
+            chunk = json.loads(data)
+        except json.JSONDecodeError:
             continue
-        
-        # Look for filename hints
-        if current_section == 'code' and not current_filename:
-            # Try to extract filename from comments
-            if '# File:' in line or '# Filename:' in line:
-                current_filename = line.split(':')[-1].strip()
-            elif 'def ' in line and 'test_' in line:
-                # This looks like a test function
-                current_filename = f"test_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.py"
-            elif 'def ' in line or 'class ' in line:
-                # This looks like main code
-                current_filename = f"generated_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.py"
-        
-        if current_section == 'code':
-            current_code.append(line)
+        progress["model"] = chunk.get("model") or progress["model"]
+        choices = chunk.get("choices") or [{}]
+        delta = choices[0].get("delta", {}).get("content")
+        if delta:
+            last_token_at = time.monotonic()
+            if progress["first_token_at"] is None:
+                progress["first_token_at"] = last_token_at
+            yield delta
+
+async def stream_llm_response(prompt, context_files=None, temperature=0.7):
+    """Yield completion text deltas from LM Studio as they arrive ("stream": true)
+
+    The request goes to the least busy healthy backend in the pool and moves
+    to another one if the connection fails; stalls raise httpx.ReadTimeout.
+    """
+    payload = build_llm_payload(prompt, context_files, temperature)
+    payload["stream"] = True
+    prompt_tokens, plan = _plan_request(payload)
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
+    }
+    pool = get_llm_pool()
+    tried = []
+    parts = []
+    while True:
+        # A slot holder gives up within its own planned total, so waiting longer is pointless
+        backend = await pool.acquire(exclude=tried, timeout=plan["total"])
+        started = time.monotonic()
+        progress = {"model": None, "first_token_at": None}
+        try:
+            async with get_async_client().stream("POST", backend["url"], json=payload, headers=headers,
+                                                 timeout=make_timeout(plan["total"])) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise httpx.HTTPStatusError(f"LM Studio API returned status {response.status_code}",
+                                                request=response.request, response=response)
+                async for delta in _stream_deltas(response, plan, started, progress):
+                    parts.append(delta)
+                    yield delta
+            pool.succeeded(backend)
+            break
+        except CONNECT_ERRORS as e:
+            # Nothing was yielded before the connection existed, so another backend can take over
+            pool.failed_over(backend, e, tried)
+        finally:
+            pool.release(backend)
+    if progress["first_token_at"] is not None:
+        await asyncio.to_thread(record_completion, progress["model"], prompt_tokens, estimate_tokens("".join(parts)),
+                                time.monotonic() - started, progress["first_token_at"] - started)
+
+async def _get_llm_response_streaming(prompt, context_files, on_event, bypass_cache=False):
+    """Collect a streamed completion, forwarding each token to on_event"""
+    cache_key, cached = await asyncio.to_thread(cache_lookup, build_llm_payload(prompt, context_files), bypass_cache)
+    if cached is not None:
+        print("⚡ LLM response served from cache")
+        on_event({"type": "token", "text": cached, "cached": True})
+        return cached
     
-    return files_created
+    print("🕐 Streaming response from LM Studio")
+    parts = []
+    started = time.perf_counter()
+    try:
+        with LLM_IN_FLIGHT.track():
+            async for token in stream_llm_response(prompt, context_files=context_files):
+                parts.append(token)
+                on_event({"type": "token", "text": token})
+    except httpx.HTTPStatusError as e:
+        observe_stage("llm_request", time.perf_counter() - started, "stream", error=True)
+        return f"Error: LM Studio API returned status {e.response.status_code}"
+    except Exception as e:
+        observe_stage("llm_request", time.perf_counter() - started, "stream", error=True)
+        return _llm_error_message(e)
+    observe_stage("llm_request", time.perf_counter() - started, "stream")
+    content = "".join(parts)
+    await asyncio.to_thread(cache_store, cache_key, content)
+    return content
 
-def run_tests_and_validate(test_files):
-    """Run tests and return results"""
+def parse_and_save_code(llm_response, sandbox_dir, test_dir):
+    """Parse LLM response and save code files to sandbox"""
+    with timed("parse"):
+        parser = CodeFenceParser(sandbox_dir, test_dir)
+        parser.feed(llm_response)
+        return parser.close()
+
+# How generated tests are executed: "subprocess" runs one pytest process per file,
+# "parallel" runs them in a single session spread across a CPU-sized process pool,
+# "forkserver" forks each run from a long-lived process with pytest pre-imported
+TEST_EXECUTION_MODE = os.environ.get("PLEIONE_TEST_MODE", "subprocess")
+
+def run_tests_and_validate(test_files, mode=None, use_cache=None):
+    """Run tests and return results
+
+    Test files that passed before with identical content, local imports and
+    Python/pytest versions are not re-run: they are reported as
+    "✅ <file>: PASSED (cached)" and listed under "cached". Runs are
+    resource-limited (see sandbox_limits.py); "resource_usage" maps each
+    file that ran to its CPU time, peak memory and any limit it hit.
+    """
     if not test_files:
         return {"status": "no_tests", "message": "No test files to run"}
     
+    use_cache = RESULT_CACHE_ENABLED if use_cache is None else use_cache
+    keys = {test_file: result_cache_key(test_file) for test_file in test_files} if use_cache else {}
+    cached = [f for f in test_files if keys.get(f) and lookup_pass(keys[f])]
+    to_run = [f for f in test_files if f not in cached]
+    if cached:
+        print(f"⚡ {len(cached)} test file(s) unchanged since they passed - not re-run")
+    
+    lines = {test_file: f"✅ {test_file}: PASSED (cached)" for test_file in cached}
+    TEST_FILES.inc(len(cached), result="cached")
+    all_passed = True
+    resource_usage = {}
+    if to_run:
+        with timed("test_run", mode or TEST_EXECUTION_MODE):
+            run_results = _run_tests(to_run, mode)
+        all_passed = run_results["all_passed"]
+        resource_usage = run_results.get("resource_usage", {})
+        _record_resource_usage(to_run, resource_usage, run_results["results"])
+        for line in run_results["results"]:
+            # "<icon> <file>: <outcome>..." - executors don't all keep input order
+            head = line.split("\n", 1)[0].partition(" ")[2]
+            test_file = next((f for f in to_run if head.startswith(f"{f}: ")), None)
+            if test_file is None:
+                continue
+            lines[test_file] = line
+            passed = head == f"{test_file}: PASSED"
+            TEST_FILES.inc(result="passed" if passed else "failed")
+            if passed and keys.get(test_file):
+                store_pass(keys[test_file])
+    
+    return {
+        "status": "passed" if all_passed else "failed",
+        "results": [lines.get(test_file, f"💥 {test_file}: ERROR - no result reported") for test_file in test_files],
+        "all_passed": all_passed,
+        "cached": cached,
+        "resource_usage": resource_usage
+    }
+
+def _record_resource_usage(test_files, resource_usage, result_lines):
+    # A parallel session's usage is shared by its files: count each session once
+    for usage in {id(usage): usage for usage in resource_usage.values()}.values():
+        TEST_CPU_SECONDS.observe(usage["cpu_user"] + usage["cpu_system"])
+        TEST_MAX_RSS.observe(usage["max_rss_mb"] * 1024 * 1024)
+        if usage["limit"]:
+            TEST_LIMIT_HITS.inc(limit=usage["limit"])
+    # Executors that raise on timeout report no usage for the file
+    for line in result_lines:
+        if line.startswith("⏰ ") and not any(line.startswith(f"⏰ {f}:") and f in resource_usage for f in test_files):
+            TEST_LIMIT_HITS.inc(limit="timeout")
+
+def _run_tests(test_files, mode=None):
+    """Run test files with the configured executor; one result line per file, in order"""
+    mode = mode or TEST_EXECUTION_MODE
+    if mode == "parallel":
+        return run_tests_parallel(test_files)
+    if mode == "forkserver" and forkserver_available():
+        return run_tests_forkserver(test_files)
+    
     results = []
+    resource_usage = {}
     all_passed = True
     
     for test_file in test_files:
         try:
-            result = subprocess.run(
-                ['python3', '-m', 'pytest', test_file, '-v'], 
-                capture_output=True, 
-                text=True,
-                timeout=30
-            )
+            # rlimits and a lower priority keep a runaway generated module off the API's CPU and memory
+            result = run_limited(['python3', '-m', 'pytest', test_file, '-v'], timeout=30)
+            if result["usage"]:
+                resource_usage[test_file] = result["usage"]
             
-            if result.returncode == 0:
+            if result["timed_out"]:
+                results.append(f"⏰ {test_file}: TIMEOUT")
+                all_passed = False
+            elif result["returncode"] == 0:
                 results.append(f"✅ {test_file}: PASSED")
             else:
-                results.append(f"❌ {test_file}: FAILED\n{result.stdout}\n{result.stderr}")
+                results.append(f"❌ {test_file}: FAILED\n{result['output']}")
                 all_passed = False
                 
-        except subprocess.TimeoutExpired:
-            results.append(f"⏰ {test_file}: TIMEOUT")
-            all_passed = False
         except Exception as e:
             results.append(f"💥 {test_file}: ERROR - {str(e)}")
             all_passed = False
@@ -204,7 +398,8 @@ def run_tests_and_validate(test_files):
     return {
         "status": "passed" if all_passed else "failed",
         "results": results,
-        "all_passed": all_passed
+        "all_passed": all_passed,
+        "resource_usage": resource_usage
     }
 
 def auto_implement_code(sandbox_files, test_results):
@@ -215,7 +410,7 @@ def auto_implement_code(sandbox_files, test_results):
     implemented_files = []
     
     for file_path in sandbox_files:
-        if 'test_' not in os.path.basename(file_path):
+        if not is_test_file(file_path):
             # This is a main code file - move it to backend
             filename = os.path.basename(file_path)
             new_path = os.path.join("./backend/generated/", filename)
@@ -235,13 +430,240 @@ def auto_implement_code(sandbox_files, test_results):
         "files": implemented_files,
         "message": f"Successfully implemented {len(implemented_files)} files"
     }
-def generate_code_and_tests(prompt, files_to_include=None, max_retries=3):
-    """Generate code and tests using LM Studio, iteratively fixing issues until tests pass"""
-    # Create sandbox and tests directories if they don't exist
-    sandbox_dir = "./backend/sandbox/"
-    test_dir = "./backend/tests/"
-    os.makedirs(sandbox_dir, exist_ok=True)
-    os.makedirs(test_dir, exist_ok=True)
+# Speculative generation: how many candidates each attempt requests concurrently.
+# Candidate i uses CANDIDATE_TEMPERATURES[i] and its own sandbox; the first whose
+# tests pass wins and the rest are cancelled. 1 keeps the sequential behaviour.
+GENERATION_CANDIDATES = int(os.environ.get("PLEIONE_CANDIDATES", "1"))
+CANDIDATE_TEMPERATURES = (0.7, 0.3, 1.0, 0.5, 0.9, 0.1)
+CANDIDATES_DIR = "./backend/candidates/"
+# Shared directories passing generations are promoted into (and implemented from)
+SANDBOX_DIR = "./backend/sandbox/"
+TEST_DIR = "./backend/tests/"
+
+def _split_created_files(created_files):
+    test_files = [f for f in created_files if is_test_file(f)]
+    code_files = [f for f in created_files if not is_test_file(f)]
+    return test_files, code_files
+
+def _merge_test_results(parts):
+    """Combine run_tests_and_validate results for disjoint sets of test files"""
+    all_passed = all(part.get("all_passed", False) for part in parts)
+    return {
+        "status": "passed" if all_passed else "failed",
+        "results": [line for part in parts for line in part.get("results", [])],
+        "all_passed": all_passed,
+        "cached": [test_file for part in parts for test_file in part.get("cached", [])],
+        "resource_usage": {test_file: usage for part in parts
+                           for test_file, usage in (part.get("resource_usage") or {}).items()}
+    }
+
+async def _stream_and_parse(prompt, context_files, sandbox_dir, test_dir, emit, bypass_cache):
+    """Stream a completion, writing each file as its fence closes and testing early
+
+    A test file starts running as soon as it is written. Its result is kept
+    only if no code file was written after the run started and the test file
+    itself was not rewritten; anything else is run again once the stream ends.
+    Returns (llm_response, created_files, test_results).
+    """
+    writes = {"code": 0}
+    early_runs = {}
+    
+    def on_file(file_path):
+        emit({"type": "file_written", "file": file_path})
+        if not is_test_file(file_path):
+            writes["code"] += 1
+            return
+        previous = early_runs.pop(file_path, None)
+        if previous:
+            previous[1].cancel()
+        early_runs[file_path] = (writes["code"], asyncio.create_task(
+            asyncio.to_thread(run_tests_and_validate, [file_path])))
+    
+    parser = CodeFenceParser(sandbox_dir, test_dir, on_file=on_file)
+    parse_seconds = 0.0
+    
+    def stream_emit(event):
+        nonlocal parse_seconds
+        emit(event)
+        if event["type"] == "token":
+            started = time.perf_counter()
+            parser.feed(event["text"])
+            parse_seconds += time.perf_counter() - started
+    
+    llm_response = await _get_llm_response_streaming(prompt, context_files, stream_emit, bypass_cache)
+    emit({"type": "parsing"})
+    with timed("parse", "stream_close"):
+        created_files = parser.close()
+    observe_stage("parse", parse_seconds, "stream")
+    
+    test_files, _ = _split_created_files(created_files)
+    parts = []
+    rerun = []
+    for test_file in test_files:
+        code_writes, task = early_runs.pop(test_file, (None, None))
+        if task is not None and code_writes == writes["code"]:
+            parts.append(await task)
+        else:
+            rerun.append(test_file)
+    for _, task in early_runs.values():
+        task.cancel()
+    if rerun or not parts:
+        parts.append(await asyncio.to_thread(run_tests_and_validate, rerun))
+    test_results = parts[0] if len(parts) == 1 else _merge_test_results(parts)
+    return llm_response, created_files, test_results
+
+async def _run_candidate(prompt, context_files, sandbox_dir, test_dir, emit, stream, bypass_cache, temperature=0.7):
+    """One generate -> parse -> test pass; returns {"llm_response", "created_files", "test_results"} or {"error"}"""
+    if stream:
+        # Files are written and tests started while tokens are still arriving
+        llm_response, created_files, test_results = await _stream_and_parse(
+            prompt, context_files, sandbox_dir, test_dir, emit, bypass_cache)
+        if llm_response.startswith("Error:"):
+            return {"error": llm_response}
+        test_files, _ = _split_created_files(created_files)
+        emit({"type": "files_created", "files": created_files})
+        emit({"type": "tests_running", "test_files": test_files})
+        emit({"type": "tests_done", "status": test_results.get("status")})
+        return {"llm_response": llm_response, "created_files": created_files, "test_results": test_results}
+    
+    llm_response = await get_llm_response_async(prompt, context_files=context_files,
+                                                bypass_cache=bypass_cache, temperature=temperature)
+    if llm_response.startswith("Error:"):
+        return {"error": llm_response}
+    
+    # Parse and save code files automatically
+    # File writes and pytest subprocesses run off the event loop
+    emit({"type": "parsing"})
+    created_files = await asyncio.to_thread(parse_and_save_code, llm_response, sandbox_dir, test_dir)
+    test_files, _ = _split_created_files(created_files)
+    emit({"type": "files_created", "files": created_files})
+    
+    # Run tests automatically
+    emit({"type": "tests_running", "test_files": test_files})
+    test_results = await asyncio.to_thread(run_tests_and_validate, test_files)
+    emit({"type": "tests_done", "status": test_results.get("status")})
+    return {"llm_response": llm_response, "created_files": created_files, "test_results": test_results}
+
+def _candidate_passed(outcome):
+    test_results = outcome.get("test_results") or {}
+    return test_results.get("all_passed", False) or test_results.get("status") == "no_tests"
+
+async def _race_candidates(prompt, context_files, sandbox_dir, test_dir, emit, stream, bypass_cache, count):
+    """Generate and test `count` candidates concurrently; the first to pass wins, the rest are cancelled
+
+    Each candidate gets its own sandbox/ and tests/ pair so the generated
+    "../sandbox" imports resolve to its own code. Only candidate 0 streams
+    tokens; every other event carries a "candidate" index. If none pass,
+    the first one that produced files is promoted and returned for the fix prompt.
+    """
+    race_dir = os.path.join(CANDIDATES_DIR, uuid.uuid4().hex)
+    temperatures = CANDIDATE_TEMPERATURES[:count]
+    
+    async def run(index, temperature):
+        candidate_sandbox = os.path.join(race_dir, str(index), "sandbox")
+        candidate_tests = os.path.join(race_dir, str(index), "tests")
+        os.makedirs(candidate_sandbox, exist_ok=True)
+        os.makedirs(candidate_tests, exist_ok=True)
+        
+        def candidate_emit(event):
+            if event["type"] != "token" or index == 0:
+                emit({**event, "candidate": index})
+        outcome = await _run_candidate(prompt, context_files, candidate_sandbox, candidate_tests, candidate_emit,
+                                       stream and index == 0, bypass_cache, temperature)
+        return index, outcome
+    
+    tasks = [asyncio.create_task(run(index, temperature)) for index, temperature in enumerate(temperatures)]
+    fallback = None
+    try:
+        for finished in asyncio.as_completed(tasks):
+            try:
+                index, outcome = await finished
+            except Exception as e:
+                print(f"❌ Candidate failed: {e}")
+                continue
+            if "error" not in outcome and _candidate_passed(outcome):
+                print(f"🏆 Candidate {index + 1}/{count} (temperature {temperatures[index]}) passed first")
+                emit({"type": "candidate_selected", "candidate": index, "temperature": temperatures[index]})
+                outcome["created_files"] = await asyncio.to_thread(
+                    promote_files, outcome["created_files"], sandbox_dir, test_dir)
+                return outcome
+            if fallback is None or ("error" in fallback and "error" not in outcome):
+                fallback = outcome
+        if fallback is None:
+            return {"error": "Error: all generation candidates failed"}
+        if "error" not in fallback:
+            fallback["created_files"] = await asyncio.to_thread(
+                promote_files, fallback["created_files"], sandbox_dir, test_dir)
+        return fallback
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        shutil.rmtree(race_dir, ignore_errors=True)
+
+async def generate_code_and_tests_async(prompt, files_to_include=None, max_retries=3, on_event=None,
+                                        bypass_cache=False, candidates=None):
+    """Generate code and tests using LM Studio, iteratively fixing issues until tests pass
+
+    When on_event is given, the completion is streamed and progress events
+    (attempt, token, file_written, parsing, files_created, tests_running,
+    tests_done) are passed to it as they happen; files are written and their
+    tests started while the completion is still streaming. bypass_cache
+    skips the LLM response cache.
+    With candidates > 1 (default PLEIONE_CANDIDATES) each attempt races that
+    many generations at different temperatures and keeps the first that passes.
+    Identical concurrent requests (same prompt, context contents and options,
+    streamed or not) share one run; see coalesce.py.
+    """
+    if not COALESCE_ENABLED:
+        return await _run_generation(prompt, files_to_include, max_retries, on_event, bypass_cache, candidates)
+    # A non-streamed run emits no events, so streamed and non-streamed requests never share one
+    key = await asyncio.to_thread(generation_key, prompt, files_to_include, max_retries=max_retries,
+                                  bypass_cache=bypass_cache, candidates=candidates, stream=on_event is not None)
+    return await run_coalesced(key, lambda emit: _run_generation(prompt, files_to_include, max_retries, emit,
+                                                                  bypass_cache, candidates), on_event)
+
+async def _run_generation(prompt, files_to_include, max_retries, on_event, bypass_cache, candidates):
+    progress = {"attempts": 0}
+    result = await _generate_code_and_tests(prompt, files_to_include, max_retries, on_event, bypass_cache,
+                                            candidates, progress)
+    outcome = "error" if "error" in result else ("passed" if result.get("ready_for_implementation") else "failed")
+    GENERATIONS.inc(outcome=outcome)
+    ATTEMPTS_PER_GENERATION.observe(progress["attempts"])
+    return result
+
+async def _generate_code_and_tests(prompt, files_to_include, max_retries, on_event, bypass_cache, candidates,
+                                   progress):
+    """Run the generate/test loop in a private workspace; promote its files to the shared dirs if it passes"""
+    workspace = await asyncio.to_thread(create_workspace)
+    keep = False
+    try:
+        result = await _generate_in_workspace(prompt, files_to_include, max_retries, on_event, bypass_cache,
+                                              candidates, progress, workspace["sandbox_dir"], workspace["test_dir"])
+        if result.get("ready_for_implementation"):
+            try:
+                created_files = await asyncio.to_thread(promote_files, result["created_files"], SANDBOX_DIR, TEST_DIR,
+                                                        workspace)
+            except PromotionConflict as e:
+                # Its files (and result paths) stay in the workspace; implement can take them from there
+                print(f"⚠️ Not promoting: {e}")
+                result["promotion_conflict"] = str(e)
+                keep = True
+            else:
+                test_files, code_files = _split_created_files(created_files)
+                result.update(created_files=created_files, test_files=test_files, code_files=code_files,
+                              sandbox_dir=SANDBOX_DIR, test_dir=TEST_DIR)
+        elif "error" not in result:
+            # Failed generations stay in their workspace for review until PLEIONE_WORKSPACE_TTL
+            keep = True
+        return result
+    finally:
+        await asyncio.to_thread(close_workspace, workspace, keep)
+
+async def _generate_in_workspace(prompt, files_to_include, max_retries, on_event, bypass_cache, candidates,
+                                 progress, sandbox_dir, test_dir):
+    emit = on_event or (lambda event: None)
+    candidates = max(1, min(candidates or GENERATION_CANDIDATES, len(CANDIDATE_TEMPERATURES)))
     
     # Enhanced prompt for code generation
     enhanced_prompt = f"""
@@ -264,29 +686,42 @@ def generate_code_and_tests(prompt, files_to_include=None, max_retries=3):
     if files_to_include:
         context_files = {}
         for file_path in files_to_include:
-            context_files[file_path] = read_file_contents(file_path)
+            context_files[file_path] = await asyncio.to_thread(read_file_contents, file_path)
     
+    context_report = None
     for attempt in range(max_retries + 1):
         try:
             if attempt > 0:
                 print(f"🔄 Attempt {attempt + 1}: Fixing issues...")
-                
-            llm_response = get_llm_response(enhanced_prompt, context_files=context_files)
-            if llm_response.startswith("Error:"):
-                return {"error": llm_response}
+            progress["attempts"] = attempt + 1
+            GENERATION_ATTEMPTS.inc()
+            emit({"type": "attempt", "attempt": attempt + 1, "max_attempts": max_retries + 1})
             
-            # Parse and save code files automatically
-            created_files = parse_and_save_code(llm_response, sandbox_dir, test_dir)
+            # Fit the context files around this attempt's prompt and the completion reservation
+            packed_context = context_files
+            if context_files:
+                packed_context, context_report = pack_context(enhanced_prompt, context_files, system_prompt=SYSTEM_PROMPT)
+                if context_report["trimmed"] or context_report["dropped"]:
+                    print(f"✂️ Context packed: {len(context_report['trimmed'])} trimmed, {len(context_report['dropped'])} dropped")
+                emit({"type": "context_packed", "report": context_report})
             
-            # Separate test files from main files
-            test_files = [f for f in created_files if 'test_' in os.path.basename(f)]
-            code_files = [f for f in created_files if 'test_' not in os.path.basename(f)]
+            if candidates > 1:
+                outcome = await _race_candidates(enhanced_prompt, packed_context, sandbox_dir, test_dir, emit,
+                                                 on_event is not None, bypass_cache, candidates)
+            else:
+                outcome = await _run_candidate(enhanced_prompt, packed_context, sandbox_dir, test_dir, emit,
+                                               on_event is not None, bypass_cache)
+            if "error" in outcome:
+                return {"error": outcome["error"]}
             
-            # Run tests automatically
-            test_results = run_tests_and_validate(test_files)
+            llm_response = outcome["llm_response"]
+            created_files = outcome["created_files"]
+            test_results = outcome["test_results"]
+            # Separate test files from main files
+            test_files, code_files = _split_created_files(created_files)
             
             # If tests pass, we're done!
-            if test_results.get("all_passed", False) or test_results.get("status") == "no_tests":
+            if _candidate_passed(outcome):
                 return {
                     "status": "generated", 
                     "response": llm_response + f"\n\n✅ Success after {attempt + 1} attempt(s)!",
@@ -296,6 +731,7 @@ def generate_code_and_tests(prompt, files_to_include=None, max_retries=3):
                     "test_results": test_results,
                     "sandbox_dir": sandbox_dir,
                     "test_dir": test_dir,
+                    "context_report": context_report,
                     "ready_for_implementation": True
                 }
             
@@ -335,5 +771,17 @@ def generate_code_and_tests(prompt, files_to_include=None, max_retries=3):
         "test_results": test_results,
         "sandbox_dir": sandbox_dir,
         "test_dir": test_dir,
+        "context_report": context_report,
         "ready_for_implementation": False
-    }
\ No newline at end of file
+    }
+
+def generate_code_and_tests(prompt, files_to_include=None, max_retries=3, bypass_cache=False, candidates=None):
+    """Synchronous wrapper around generate_code_and_tests_async for scripts and tests"""
+    async def _run():
+        try:
+            return await generate_code_and_tests_async(prompt, files_to_include=files_to_include, max_retries=max_retries,
+                                                       bypass_cache=bypass_cache, candidates=candidates)
+        finally:
+            # The pooled client is bound to this short-lived event loop
+            await close_async_client()
+    return asyncio.run(_run())
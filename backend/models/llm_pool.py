@@ -0,0 +1,256 @@
+"""Pool of OpenAI-compatible LLM backends (LM Studio boxes) behind one client.
+
+Each request goes to the healthy backend with the fewest outstanding
+requests, never above that backend's concurrency cap; when every backend is
+at its cap, callers wait for a slot. A connection failure marks the backend
+down and the request moves on to the next one. A background task probes
+each backend's /v1/models so dead nodes are skipped and recovered nodes
+rejoin; without the task, a down mark simply expires after one interval.
+
+Backends without an explicit cap get PLEIONE_LLM_BACKEND_MAX_CONCURRENCY,
+or when that is unset 4 each with several backends and no cap at all with
+just one, so a single LM Studio install is never throttled by the pool.
+A request waits for a slot at most as long as a request holding one may run
+(its planned total deadline) unless PLEIONE_LLM_QUEUE_TIMEOUT says otherwise.
+
+    PLEIONE_LLM_BACKENDS="http://box1:1234/v1/chat/completions|4,http://box2:1234/v1/chat/completions"
+"""
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+
+from .llm_timeouts import LLM_TIMEOUT_MAX
+from .metrics import Counter, Gauge
+
+# Comma-separated chat completion URLs, each optionally suffixed with |max_concurrency
+LLM_BACKENDS = os.environ.get("PLEIONE_LLM_BACKENDS", "")
+# Cap for backends without |N; unset: MULTI_BACKEND_CONCURRENCY with several backends, none with one
+LLM_BACKEND_MAX_CONCURRENCY = int(os.environ["PLEIONE_LLM_BACKEND_MAX_CONCURRENCY"]) \
+    if os.environ.get("PLEIONE_LLM_BACKEND_MAX_CONCURRENCY") else None
+MULTI_BACKEND_CONCURRENCY = 4
+LLM_HEALTH_INTERVAL = float(os.environ.get("PLEIONE_LLM_HEALTH_INTERVAL", "15"))
+LLM_HEALTH_TIMEOUT = float(os.environ.get("PLEIONE_LLM_HEALTH_TIMEOUT", "5"))
+# Longest wait for a slot; unset: the waiting request's planned total deadline (plan_timeouts)
+LLM_QUEUE_TIMEOUT = float(os.environ["PLEIONE_LLM_QUEUE_TIMEOUT"]) \
+    if os.environ.get("PLEIONE_LLM_QUEUE_TIMEOUT") else None
+
+# Only failures where the request never reached the backend are safe to retry elsewhere
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+BACKEND_OUTSTANDING = Gauge("pleione_llm_backend_outstanding", "Requests in flight per LLM backend",
+                            labels=("backend",))
+BACKEND_HEALTHY = Gauge("pleione_llm_backend_healthy", "1 if the LLM backend's last probe or request succeeded",
+                        labels=("backend",))
+BACKEND_FAILOVERS = Counter("pleione_llm_backend_failovers_total",
+                            "Requests moved to another backend after a connection error", labels=("backend",))
+
+class NoBackendAvailable(httpx.ConnectError):
+    """No LLM backend could take the request (all down, or all busy past the queue timeout)"""
+
+def parse_backends(spec, default_url, default_concurrency=LLM_BACKEND_MAX_CONCURRENCY):
+    """Backend dicts from a PLEIONE_LLM_BACKENDS value (falls back to default_url)
+
+    max_concurrency None means no cap, the default for a lone backend.
+    """
+    backends = []
+    entries = [entry.strip() for entry in (spec or default_url).split(",") if entry.strip()]
+    if default_concurrency is None and len(entries) > 1:
+        default_concurrency = MULTI_BACKEND_CONCURRENCY
+    for entry in entries:
+        url, _, cap = entry.partition("|")
+        url = url.strip()
+        backends.append({
+            "url": url,
+            "models_url": url.rsplit("/chat/completions", 1)[0] + "/models",
+            "max_concurrency": int(cap) if cap.strip() else default_concurrency,
+            "outstanding": 0,
+            "served": 0,
+            "failures": 0,
+            "healthy": True,
+            "down_until": 0.0,
+            "last_error": None,
+            "last_checked": None
+        })
+    return backends
+
+class LLMPool:
+    """Least-outstanding-requests routing over backend dicts, usable from threads and event loops"""
+
+    def __init__(self, backends, queue_timeout=LLM_QUEUE_TIMEOUT, health_interval=LLM_HEALTH_INTERVAL):
+        self.backends = backends
+        self.queue_timeout = queue_timeout
+        self.health_interval = health_interval
+        self._cond = threading.Condition()
+        for backend in backends:
+            BACKEND_HEALTHY.set(1, backend=backend["url"])
+
+    def _usable(self, backend, now):
+        return backend["healthy"] or now >= backend["down_until"]
+
+    def _try_select(self, exclude):
+        """Reserve a slot on the best backend; None if all are busy, NoBackendAvailable if none are left"""
+        now = time.monotonic()
+        remaining = [b for b in self.backends if b["url"] not in exclude]
+        if not remaining:
+            raise NoBackendAvailable(f"All {len(self.backends)} LLM backend(s) failed")
+        usable = [b for b in remaining if self._usable(b, now)]
+        # Every remaining backend is marked down: try them anyway rather than fail on a stale mark
+        candidates = usable or remaining
+        free = [b for b in candidates if b["max_concurrency"] is None or b["outstanding"] < b["max_concurrency"]]
+        if not free:
+            return None
+        backend = min(free, key=lambda b: (b["outstanding"] / (b["max_concurrency"] or float("inf")),
+                                           b["outstanding"], b["served"]))
+        backend["outstanding"] += 1
+        backend["served"] += 1
+        BACKEND_OUTSTANDING.inc(backend=backend["url"])
+        return backend
+
+    def _queue_timeout(self, timeout):
+        """The configured queue timeout, else the caller's deadline, else the longest any request may run"""
+        return self.queue_timeout or timeout or LLM_TIMEOUT_MAX
+
+    def acquire_blocking(self, exclude=(), timeout=None):
+        """Reserve a backend slot, waiting up to the queue timeout for one to free up"""
+        timeout = self._queue_timeout(timeout)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                backend = self._try_select(exclude)
+                if backend is not None:
+                    return backend
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise NoBackendAvailable(f"No LLM backend slot freed up within {timeout}s")
+                self._cond.wait(remaining)
+
+    async def acquire(self, exclude=(), timeout=None):
+        """Async acquire_blocking; polls so it works whichever loop or thread releases the slot"""
+        timeout = self._queue_timeout(timeout)
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                backend = self._try_select(exclude)
+            if backend is not None:
+                return backend
+            if time.monotonic() >= deadline:
+                raise NoBackendAvailable(f"No LLM backend slot freed up within {timeout}s")
+            await asyncio.sleep(0.05)
+
+    def release(self, backend):
+        with self._cond:
+            backend["outstanding"] -= 1
+            BACKEND_OUTSTANDING.dec(backend=backend["url"])
+            self._cond.notify_all()
+
+    def mark(self, backend, healthy, error=None):
+        """Record a probe or request outcome; a down backend is skipped for one health interval"""
+        with self._cond:
+            BACKEND_HEALTHY.set(1 if healthy else 0, backend=backend["url"])
+            if healthy != backend["healthy"]:
+                print(f"{'💚' if healthy else '💔'} LLM backend {backend['url']} is {'up' if healthy else 'down'}"
+                      + (f": {error}" if error else ""))
+            backend["healthy"] = healthy
+            backend["last_checked"] = time.time()
+            if not healthy:
+                backend["failures"] += 1
+                backend["last_error"] = str(error) if error else None
+                backend["down_until"] = time.monotonic() + self.health_interval
+            self._cond.notify_all()
+
+    def send_blocking(self, send):
+        """Call send(url) on the chosen backend, failing over on connection errors"""
+        tried = []
+        while True:
+            backend = self.acquire_blocking(exclude=tried)
+            try:
+                response = send(backend["url"])
+                self.succeeded(backend)
+                return response
+            except CONNECT_ERRORS as e:
+                self.failed_over(backend, e, tried)
+            finally:
+                self.release(backend)
+
+    async def send(self, send):
+        """Async send_blocking; send(url) returns an awaitable"""
+        tried = []
+        while True:
+            backend = await self.acquire(exclude=tried)
+            try:
+                response = await send(backend["url"])
+                self.succeeded(backend)
+                return response
+            except CONNECT_ERRORS as e:
+                self.failed_over(backend, e, tried)
+            finally:
+                self.release(backend)
+
+    def succeeded(self, backend):
+        if not backend["healthy"]:
+            self.mark(backend, True)
+
+    def failed_over(self, backend, error, tried):
+        self.mark(backend, False, error)
+        BACKEND_FAILOVERS.inc(backend=backend["url"])
+        tried.append(backend["url"])
+
+    async def probe(self, client=None):
+        """GET each backend's /v1/models once and update its health"""
+        async def check(backend, client):
+            try:
+                response = await client.get(backend["models_url"], timeout=LLM_HEALTH_TIMEOUT)
+                self.mark(backend, response.status_code == 200,
+                          None if response.status_code == 200 else f"HTTP {response.status_code}")
+            except httpx.HTTPError as e:
+                self.mark(backend, False, e)
+
+        if client is not None:
+            await asyncio.gather(*(check(b, client) for b in self.backends))
+            return
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*(check(b, client) for b in self.backends))
+
+    async def run_health_checks(self):
+        """Probe every health_interval seconds until cancelled"""
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.health_interval)
+
+    def status(self):
+        with self._cond:
+            return [{key: value for key, value in backend.items() if key != "down_until"}
+                    for backend in self.backends]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_llm_pool():
+    """The process-wide pool built from PLEIONE_LLM_BACKENDS (or PLEIONE_LM_STUDIO_URL)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from .llm_connector import LM_STUDIO_URL
+            _pool = LLMPool(parse_backends(LLM_BACKENDS, LM_STUDIO_URL))
+        return _pool
+
+_health_task = None
+
+def start_health_checks():
+    """Start the periodic /v1/models probe on the running loop"""
+    global _health_task
+    if _health_task is None or _health_task.done():
+        _health_task = asyncio.get_running_loop().create_task(get_llm_pool().run_health_checks())
+
+async def stop_health_checks():
+    global _health_task
+    task, _health_task = _health_task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
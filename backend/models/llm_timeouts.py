@@ -0,0 +1,156 @@
+"""LM Studio timeouts derived from the loaded model's recorded speed.
+
+Every successful completion records time to first token, prompt and
+completion size and tokens/sec under the model name LM Studio reports.
+plan_timeouts() turns that history into a connect timeout, a first-token
+timeout, an inter-token idle timeout and an overall deadline
+sized for a full max_tokens answer, so a hung request is given up on in
+seconds while a slow model still gets the time it needs. Until a model has
+a few samples, conservative defaults are used.
+"""
+import json
+import os
+import threading
+from collections import deque
+
+from .context_packer import estimate_tokens
+from .llm_client import LLM_CONNECT_TIMEOUT
+
+LLM_LATENCY_HISTORY_PATH = os.environ.get("PLEIONE_LLM_LATENCY_HISTORY", "./backend/cache/llm_latency.json")
+LLM_TIMEOUT_SAFETY = float(os.environ.get("PLEIONE_LLM_TIMEOUT_SAFETY", "2.0"))
+LLM_FIRST_TOKEN_TIMEOUT = float(os.environ.get("PLEIONE_LLM_FIRST_TOKEN_TIMEOUT", "120"))
+LLM_IDLE_TIMEOUT = float(os.environ.get("PLEIONE_LLM_IDLE_TIMEOUT", "30"))
+LLM_TIMEOUT_MIN = float(os.environ.get("PLEIONE_LLM_TIMEOUT_MIN", "30"))
+LLM_TIMEOUT_MAX = float(os.environ.get("PLEIONE_LLM_TIMEOUT_MAX", "900"))
+
+HISTORY_SIZE = 50          # Samples kept per model
+HISTORY_MIN_SAMPLES = 3    # Below this the defaults are used
+FIRST_TOKEN_FLOOR = 10     # Never expect the first token sooner than this (seconds)
+COLD_TOKENS_PER_SECOND = 5 # Assumed generation speed for a model with no history
+
+def _quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+def payload_prompt_tokens(payload):
+    """Estimated prompt size of a chat completion payload"""
+    return sum(estimate_tokens(message.get("content") or "") for message in payload.get("messages", []))
+
+class LatencyHistory:
+    """Recent completion samples per model, persisted as JSON"""
+
+    def __init__(self, path=LLM_LATENCY_HISTORY_PATH):
+        self.path = path
+        self.last_model = None
+        self._models = {}  # model -> deque of sample dicts
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.last_model = data.get("last_model")
+        for model, samples in data.get("models", {}).items():
+            self._models[model] = deque(samples, maxlen=HISTORY_SIZE)
+
+    def _save(self):
+        data = {"last_model": self.last_model,
+                "models": {model: list(samples) for model, samples in self._models.items()}}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    def record(self, model, prompt_tokens, completion_tokens, duration, first_token=None):
+        """Add one successful completion
+
+        duration is the whole request in seconds; first_token the time to the
+        first streamed token (None for non-streamed requests, whose rate then
+        includes prompt processing and is a conservative lower bound).
+        """
+        if duration <= 0 or completion_tokens <= 0:
+            return
+        generating = duration - (first_token or 0)
+        sample = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "first_token": first_token,
+                  "tokens_per_second": completion_tokens / generating if generating > 0 else None}
+        model = model or "unknown"
+        with self._lock:
+            self._load()
+            self._models.setdefault(model, deque(maxlen=HISTORY_SIZE)).append(sample)
+            self.last_model = model
+            try:
+                self._save()
+            except OSError as e:
+                print(f"⚠️ Could not save LLM latency history: {e}")
+
+    def samples(self, model=None):
+        with self._lock:
+            self._load()
+            return list(self._models.get(model or self.last_model, ()))
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self.last_model = None
+            self._loaded = True
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+_history = LatencyHistory()
+
+def get_latency_history():
+    return _history
+
+def record_completion(model, prompt_tokens, completion_tokens, duration, first_token=None):
+    _history.record(model, prompt_tokens, completion_tokens, duration, first_token)
+
+def plan_timeouts(prompt_tokens, max_tokens, model=None, history=None):
+    """Timeouts (seconds) for one request to the model last seen (or `model`)
+
+    Returns a dict with connect, first_token, idle and total, plus source
+    ("history" or "default"). Quantiles lean slow (p90 latency, p10 speed) and are then multiplied by
+    PLEIONE_LLM_TIMEOUT_SAFETY. The total deadline covers a full max_tokens
+    answer at the slow-end speed, so an unusually long but healthy answer
+    still finishes; hangs are caught by the first-token and idle timeouts.
+    """
+    samples = (history or _history).samples(model)
+    rates = [s["tokens_per_second"] for s in samples if s.get("tokens_per_second")]
+    first_tokens = [s for s in samples if s.get("first_token")]
+    if len(rates) < HISTORY_MIN_SAMPLES:
+        first_token = LLM_FIRST_TOKEN_TIMEOUT
+        total = first_token + max_tokens / COLD_TOKENS_PER_SECOND
+        source = "default"
+    else:
+        if len(first_tokens) >= HISTORY_MIN_SAMPLES:
+            # Prompt processing scales with prompt size, so also extrapolate from the slow-end prefill rate
+            prefill = [s["prompt_tokens"] / s["first_token"] for s in first_tokens if s["prompt_tokens"]]
+            predicted = _quantile([s["first_token"] for s in first_tokens], 0.9)
+            if prefill:
+                predicted = max(predicted, prompt_tokens / _quantile(prefill, 0.1))
+            first_token = _clamp(predicted * LLM_TIMEOUT_SAFETY, FIRST_TOKEN_FLOOR, LLM_TIMEOUT_MAX)
+        else:
+            first_token = LLM_FIRST_TOKEN_TIMEOUT
+        total = first_token + LLM_TIMEOUT_SAFETY * max_tokens / _quantile(rates, 0.1)
+        source = "history"
+    return {
+        "connect": LLM_CONNECT_TIMEOUT,
+        "first_token": round(first_token, 1),
+        "idle": LLM_IDLE_TIMEOUT,
+        "total": round(_clamp(total, LLM_TIMEOUT_MIN, LLM_TIMEOUT_MAX), 1),
+        "source": source
+    }
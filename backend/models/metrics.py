@@ -0,0 +1,189 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+A small dependency-free registry of counters, gauges and histograms with
+labels. Pipeline code records stage durations through `timed(stage)` (or
+`observe_stage`), and /api/metrics serves `render()`.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; spans a cached lookup (ms) up to a long LM Studio generation (15 min)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900)
+
+_registry = []
+_lock = threading.Lock()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        if not self.label_names and self.kind != "histogram":
+            # Export 0 before the first event rather than no series at all
+            self._values[()] = 0
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+    def reset(self):
+        with _lock:
+            self._values.clear()
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in progress while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def count(self, **labels):
+        series = self._values.get(self._key(labels))
+        return series["count"] if series else 0
+
+    def _render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series["counts"]):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, {"le": _format_value(float(bound))})
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, key, {"le": "+Inf"})
+        lines.append(f"{self.name}_bucket{labels} {series['count']}")
+        plain = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{plain} {_format_value(series['sum'])}")
+        lines.append(f"{self.name}_count{plain} {series['count']}")
+        return lines
+
+def render():
+    """Every registered metric, Prometheus text format (version 0.0.4)"""
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Pipeline metrics ---
+
+STAGE_DURATION = Histogram("pleione_stage_duration_seconds",
+                           "Time spent in each pipeline stage (llm_request, parse, test_run, staging, git, packaging)",
+                           labels=("stage", "detail"))
+STAGE_ERRORS = Counter("pleione_stage_errors_total", "Pipeline stages that raised or reported an error",
+                       labels=("stage", "detail"))
+GENERATION_ATTEMPTS = Counter("pleione_generation_attempts_total", "Generate/test attempts started")
+GENERATIONS = Counter("pleione_generations_total", "Finished generate_code_and_tests runs by outcome",
+                      labels=("outcome",))
+ATTEMPTS_PER_GENERATION = Histogram("pleione_attempts_per_generation", "Attempts a generation needed",
+                                    buckets=(1, 2, 3, 4, 5, 6, 8))
+TEST_FILES = Counter("pleione_test_files_total", "Test files checked, by result (passed, failed, cached)",
+                     labels=("result",))
+TEST_CPU_SECONDS = Histogram("pleione_test_cpu_seconds", "CPU time (user + system) of each test run",
+                             buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+TEST_MAX_RSS = Histogram("pleione_test_max_rss_bytes", "Peak resident memory of each test run",
+                         buckets=tuple(mb * 1024 * 1024 for mb in (32, 64, 128, 256, 512, 1024, 2048, 4096)))
+TEST_LIMIT_HITS = Counter("pleione_test_limit_hits_total", "Test runs stopped by a resource limit or timeout",
+                          labels=("limit",))
+LLM_IN_FLIGHT = Gauge("pleione_llm_requests_in_flight", "Requests to LM Studio currently waiting or streaming")
+HTTP_IN_FLIGHT = Gauge("pleione_http_requests_in_flight", "API requests currently being handled")
+HTTP_DURATION = Histogram("pleione_http_request_duration_seconds", "API request latency by route",
+                          labels=("method", "route", "status"))
+
+def observe_stage(stage, seconds, detail="", error=False):
+    STAGE_DURATION.observe(seconds, stage=stage, detail=detail)
+    if error:
+        STAGE_ERRORS.inc(stage=stage, detail=detail)
+
+@contextmanager
+def timed(stage, detail=""):
+    """Record the block's duration under `stage`; exceptions also count as stage errors"""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started, detail, error)
@@ -0,0 +1,232 @@
+"""Warm pytest fork-server for fast sandbox validation.
+
+The server process imports pytest once, then forks a fresh child for every
+validation run, so each run starts with pytest already loaded but with no
+state left over from earlier generated modules. Requests and responses are
+JSON lines over the server's stdin/stdout.
+"""
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from .sandbox_limits import apply_limits, current_limits, usage_from_rusage
+except ImportError:  # running as the server script
+    from sandbox_limits import apply_limits, current_limits, usage_from_rusage
+
+# Client side --------------------------------------------------------------
+
+_server = None
+_server_lock = threading.Lock()
+_pending = {}  # request id -> waiter: event, response and the server the request went to
+_ids = itertools.count(1)
+
+def forkserver_available():
+    """The fork-server needs os.fork (POSIX only)"""
+    return hasattr(os, "fork")
+
+def _start_server():
+    global _server
+    _server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+        bufsize=1
+    )
+    threading.Thread(target=_read_responses, args=(_server,), daemon=True).start()
+    print(f"🔥 Warm pytest fork-server started (pid {_server.pid})")
+
+def _read_responses(server):
+    """Hand each response line to the caller waiting on its request id"""
+    for line in server.stdout:
+        try:
+            response = json.loads(line)
+        except ValueError:
+            continue
+        waiter = _pending.pop(response.get("id"), None)
+        if waiter is not None:
+            waiter["response"] = response
+            waiter["event"].set()
+    # Server exited: release everyone still waiting on it (not on a server started since)
+    for request_id, waiter in list(_pending.items()):
+        if waiter["server"] is server and _pending.pop(request_id, None) is not None:
+            waiter["event"].set()
+
+def start_forkserver():
+    """Start the warm server ahead of the first validation run"""
+    with _server_lock:
+        if _server is None or _server.poll() is not None:
+            _start_server()
+
+def run_pytest_forked(args, timeout=30, cwd=None, limits=None, with_usage=False):
+    """Run `pytest args` in a child forked from the warm server
+
+    Returns (returncode, output), or (returncode, output, usage) with
+    with_usage=True. The child runs under `limits` (default: the configured
+    sandbox limits). Raises subprocess.TimeoutExpired when the child is
+    killed for exceeding `timeout`, and RuntimeError if the server dies.
+    """
+    request_id = next(_ids)
+    waiter = {"event": threading.Event(), "response": None, "server": None}
+    request = {"id": request_id, "args": list(args), "cwd": cwd or os.getcwd(), "timeout": timeout,
+               "limits": current_limits() if limits is None else limits}
+
+    with _server_lock:
+        if _server is None or _server.poll() is not None:
+            _start_server()
+        waiter["server"] = _server
+        _pending[request_id] = waiter
+        _server.stdin.write(json.dumps(request) + "\n")
+        _server.stdin.flush()
+
+    # The server enforces the timeout; the extra margin covers dispatch
+    if not waiter["event"].wait(timeout + 10) or waiter["response"] is None:
+        _pending.pop(request_id, None)
+        raise RuntimeError("pytest fork-server did not respond")
+
+    response = waiter["response"]
+    if response["timed_out"]:
+        raise subprocess.TimeoutExpired(["pytest", *args], timeout, output=response["output"])
+    if with_usage:
+        return response["returncode"], response["output"], response.get("usage")
+    return response["returncode"], response["output"]
+
+def stop_forkserver():
+    """Shut the warm server down (it is restarted on next use)"""
+    global _server
+    with _server_lock:
+        server, _server = _server, None
+    if server is not None and server.poll() is None:
+        server.stdin.close()
+        try:
+            server.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+# Server side --------------------------------------------------------------
+
+def _run_child(request, output_path):
+    """Runs in the forked child: execute pytest with output captured to a file"""
+    try:
+        os.chdir(request["cwd"])
+        sys.path.insert(0, request["cwd"])
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        out = os.open(output_path, os.O_WRONLY | os.O_TRUNC)
+        os.dup2(out, 1)
+        os.dup2(out, 2)
+        sys.stdout = open(1, 'w', closefd=False)
+        sys.stderr = open(2, 'w', closefd=False)
+        apply_limits(request.get("limits"))
+        import pytest
+        code = int(pytest.main(request["args"]))
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except BaseException as e:
+        try:
+            os.write(2, f"fork-server child error: {e}\n".encode())
+        except OSError:
+            pass
+        code = 3
+    os._exit(code)
+
+def _finish(child, status, rusage, timed_out):
+    with open(child["output_path"], 'r', errors='replace') as f:
+        output = f.read()
+    os.remove(child["output_path"])
+    duration = time.monotonic() - child["started"]
+    usage = usage_from_rusage(rusage, status, duration, child["limits"], output, timed_out)
+    response = {
+        "id": child["id"],
+        "returncode": os.waitstatus_to_exitcode(status),
+        "output": output,
+        "timed_out": timed_out,
+        "duration": duration,
+        "usage": usage
+    }
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+
+def _warm_up():
+    """Pay pytest's import and plugin-discovery cost once, before any fork
+
+    A throwaway session over an empty directory loads pytest, its built-in
+    plugins and entry-point plugins; every forked child inherits them.
+    """
+    import pytest
+    saved_stdout = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        with tempfile.TemporaryDirectory() as empty_dir:
+            pytest.main([empty_dir, '-q', '-p', 'no:cacheprovider'])
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
+        os.close(devnull)
+
+def serve():
+    """Read requests from stdin, fork a child per request, reap and reply"""
+    import selectors
+    import signal
+
+    _warm_up()
+
+    children = {}
+    selector = selectors.DefaultSelector()
+    selector.register(0, selectors.EVENT_READ)
+    stdin_open = True
+    buffer = b""
+
+    while stdin_open or children:
+        requests = []
+        if stdin_open and selector.select(timeout=0.01):
+            data = os.read(0, 65536)
+            if not data:
+                stdin_open = False
+                selector.unregister(0)
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            requests = [json.loads(line) for line in lines if line.strip()]
+        elif not stdin_open:
+            time.sleep(0.01)
+
+        for request in requests:
+            fd, output_path = tempfile.mkstemp(prefix="pleione_forkserver_", suffix=".log")
+            os.close(fd)
+            sys.stdout.flush()
+            pid = os.fork()
+            if pid == 0:
+                _run_child(request, output_path)
+            children[pid] = {
+                "id": request["id"],
+                "output_path": output_path,
+                "started": time.monotonic(),
+                "deadline": time.monotonic() + request["timeout"],
+                "limits": request.get("limits")
+            }
+
+        for pid, child in list(children.items()):
+            # wait4 also reports the child's CPU time and peak memory
+            done_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if done_pid:
+                del children[pid]
+                _finish(child, status, rusage, False)
+            elif time.monotonic() > child["deadline"]:
+                os.kill(pid, signal.SIGKILL)
+                _, status, rusage = os.wait4(pid, 0)
+                del children[pid]
+                _finish(child, status, rusage, True)
+
+if __name__ == "__main__":
+    # Don't let this directory shadow modules imported by generated tests
+    if sys.path and os.path.abspath(sys.path[0]) == os.path.dirname(os.path.abspath(__file__)):
+        sys.path.pop(0)
+    serve()
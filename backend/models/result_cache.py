@@ -0,0 +1,149 @@
+import ast
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from importlib import metadata
+
+# Test result cache: a passing test file is not re-run while it, every local
+# module it imports (transitively), the Python version and the pytest version
+# are unchanged. Only passes are stored; failures always run again.
+RESULT_CACHE_ENABLED = os.environ.get("PLEIONE_TEST_CACHE", "1") == "1"
+RESULT_CACHE_DIR = os.environ.get("PLEIONE_RESULT_CACHE_DIR", "./backend/cache/tests/")
+# Calls that import or run code the static closure can't see; such tests are never cached
+DYNAMIC_CALLS = {"import_module", "__import__", "exec", "eval", "run_path", "spec_from_file_location"}
+
+_memory = {}
+_lock = threading.Lock()
+_runtime = None
+
+def _runtime_fingerprint():
+    global _runtime
+    if _runtime is None:
+        try:
+            pytest_version = metadata.version("pytest")
+        except metadata.PackageNotFoundError:
+            pytest_version = "missing"
+        _runtime = f"python {sys.version}\npytest {pytest_version}"
+    return _runtime
+
+def _parse(path):
+    try:
+        with open(path, 'rb') as f:
+            source = f.read()
+        return source, ast.parse(source, filename=path)
+    except (OSError, SyntaxError, ValueError):
+        return None, None
+
+def _find_module(name, search_dirs):
+    """Local files executed by importing `name` (module plus package __init__s), or [] if not local"""
+    parts = name.split(".")
+    for base in search_dirs:
+        found = []
+        for i in range(1, len(parts)):
+            init = os.path.join(base, *parts[:i], "__init__.py")
+            if os.path.isfile(init):
+                found.append(init)
+        for candidate in (os.path.join(base, *parts) + ".py", os.path.join(base, *parts, "__init__.py")):
+            if os.path.isfile(candidate):
+                return found + [candidate]
+    return []
+
+def _local_imports(path, tree, search_dirs):
+    """Returns (local files imported by tree, uses_dynamic_code)"""
+    own_dir = os.path.dirname(path)
+    dirs = [own_dir] + [d for d in search_dirs if d != own_dir]
+    found = []
+    dynamic = False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                found += _find_module(alias.name, dirs)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = own_dir
+                for _ in range(node.level - 1):
+                    base = os.path.dirname(base)
+                names = [node.module] if node.module else [alias.name for alias in node.names]
+                for name in names:
+                    found += _find_module(name, [base])
+            elif node.module:
+                found += _find_module(node.module, dirs)
+                # `from pkg import submodule` imports the submodule too
+                for alias in node.names:
+                    found += _find_module(f"{node.module}.{alias.name}", dirs)
+        elif isinstance(node, ast.Call):
+            func = node.func
+            if (getattr(func, "attr", None) or getattr(func, "id", None)) in DYNAMIC_CALLS:
+                dynamic = True
+    return found, dynamic
+
+def result_cache_key(test_file):
+    """Hash of the test file, its transitive local imports and the runtime; None if uncacheable
+
+    Local modules are looked up next to each importer, in the sibling
+    ../sandbox directory generated tests add to sys.path, and in the working
+    directory. Paths are hashed relative to the test's directory, so the same
+    test and code in another sandbox share an entry.
+    """
+    test_dir = os.path.dirname(os.path.abspath(test_file))
+    search_dirs = [test_dir, os.path.normpath(os.path.join(test_dir, "..", "sandbox")), os.getcwd()]
+    pending = [os.path.abspath(test_file)]
+    conftest = os.path.join(test_dir, "conftest.py")
+    if os.path.isfile(conftest):
+        pending.append(conftest)
+    sources = {}
+    while pending:
+        path = os.path.normpath(pending.pop())
+        if path in sources:
+            continue
+        source, tree = _parse(path)
+        if tree is None:
+            return None
+        imports, dynamic = _local_imports(path, tree, search_dirs)
+        if dynamic:
+            return None
+        sources[path] = source
+        pending.extend(imports)
+
+    digest = hashlib.sha256(_runtime_fingerprint().encode("utf-8"))
+    for path in sorted(sources, key=lambda p: os.path.relpath(p, test_dir)):
+        digest.update(f"\0{os.path.relpath(path, test_dir)}\0".encode("utf-8"))
+        digest.update(sources[path])
+    return digest.hexdigest()
+
+def _path(key):
+    return os.path.join(RESULT_CACHE_DIR, key[:2], f"{key}.json")
+
+def lookup_pass(key):
+    """True if a pass was recorded for key"""
+    with _lock:
+        if key in _memory:
+            return True
+    if os.path.exists(_path(key)):
+        with _lock:
+            _memory[key] = True
+        return True
+    return False
+
+def store_pass(key):
+    with _lock:
+        _memory[key] = True
+    path = _path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump({"key": key, "created": time.time()}, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def clear_result_cache():
+    """Forget every recorded pass (memory and disk)"""
+    with _lock:
+        _memory.clear()
+    shutil.rmtree(RESULT_CACHE_DIR, ignore_errors=True)
@@ -1,10 +1,18 @@
 import shutil
+import socket
+import sys
 import tempfile
 import subprocess
 import os
 import time
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from ..models.llm_connector import read_file_contents, update_file_contents
+from ..models.impact import select_tests
+from ..models.git_ops import commit_paths, git_lock, reset_hard, run_git
+from ..models.update_packages import PACKAGES_DIR, create_delta_package, gc_packages, head_commit
+from ..models.metrics import observe_stage
 
 def create_safe_update_system():
     """Create a safe system for Pleione to update herself without breaking"""
@@ -14,73 +22,202 @@ def create_safe_update_system():
     os.makedirs("./backend/self_updates/staging/", exist_ok=True)
     os.makedirs("./backend/self_updates/packages/", exist_ok=True)
 
-def git_commit_current_state(message="Backup before Pleione update"):
-    """Create a git commit of the current state"""
-    try:
-        # Check if git repo exists
-        result = subprocess.run(['git', 'status'], capture_output=True, text=True)
-        if result.returncode != 0:
-            # Initialize git repo
-            subprocess.run(['git', 'init'], check=True)
-            subprocess.run(['git', 'add', '.'], check=True)
-            subprocess.run(['git', 'commit', '-m', 'Initial commit'], check=True)
-            print("✅ Git repository initialized")
-        
-        # Add all changes and commit
-        subprocess.run(['git', 'add', '.'], check=True)
-        result = subprocess.run(['git', 'commit', '-m', message], capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            # Get the commit hash
-            hash_result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True)
-            commit_hash = hash_result.stdout.strip()[:8]
-            print(f"✅ Git backup created: {commit_hash}")
-            return {"status": "success", "commit_hash": commit_hash}
-        else:
-            print("ℹ️ No changes to commit")
-            return {"status": "no_changes", "message": "No changes to backup"}
-            
-    except subprocess.CalledProcessError as e:
-        return {"status": "error", "message": f"Git backup failed: {str(e)}"}
+def _format_timings(timings):
+    return ", ".join(f"{t['op']} {t['duration']:.3f}s" for t in timings)
+
+def git_commit_current_state(message="Backup before Pleione update", paths=None):
+    """Create a git commit of the current state
+
+    Stages only `paths` (plus modified tracked files) under the repository
+    lock, so concurrent updates can't interleave on the index.
+    """
+    result = commit_paths(message, paths)
+    if result["status"] == "success":
+        print(f"✅ Git backup created: {result['commit_hash']} ({_format_timings(result['timings'])})")
+    elif result["status"] == "no_changes":
+        print("ℹ️ No changes to commit")
+    return result
 
 def git_rollback(steps_back=1):
     """Rollback using git to previous commits"""
-    try:
-        # Show recent commits first
-        log_result = subprocess.run(['git', 'log', '--oneline', '-5'], capture_output=True, text=True)
-        print("Recent commits:")
-        print(log_result.stdout)
-        
-        # Reset to previous commit
-        subprocess.run(['git', 'reset', '--hard', f'HEAD~{steps_back}'], check=True)
-        print(f"✅ Rolled back {steps_back} commit(s)")
-        return {"status": "success", "message": f"Rolled back {steps_back} commit(s)"}
-        
-    except subprocess.CalledProcessError as e:
-        return {"status": "error", "message": f"Git rollback failed: {str(e)}"}
+    result = reset_hard(steps_back)
+    if result["status"] == "success":
+        print(f"✅ Rolled back {steps_back} commit(s): {result['head']} ({_format_timings(result['timings'])})")
+        result["message"] = f"Rolled back {steps_back} commit(s)"
+    return result
 
-def create_staging_environment(files_to_update):
+# How staging trees are built:
+#   "overlay"  - real directories only along the changed paths, symlinks for everything else
+#   "worktree" - a detached `git worktree` of HEAD (tracked files only)
+#   "copy"     - a full copy of the project (the original behaviour)
+STAGING_MODE = os.environ.get("PLEIONE_STAGING_MODE", "overlay")
+
+# Never carried into a staging tree
+STAGING_EXCLUDES = {".git", "__pycache__", "node_modules", ".pytest_cache"}
+STAGING_EXCLUDED_PATHS = {"backend/self_updates", "backend/jobs", "backend/cache", "backend/candidates",
+                          "backend/workspaces"}
+# Directories tests write into: copied, so writes can't reach the live tree through a symlink
+STAGING_COPIED_DIRS = {"backend/sandbox", "backend/tests", "backend/generated"}
+
+def _normalize_update_path(file_path):
+    """./backend/main.py -> backend/main.py"""
+    return os.path.normpath(file_path).replace(os.sep, "/")
+
+def _staging_excluded(rel_path):
+    return os.path.basename(rel_path) in STAGING_EXCLUDES or rel_path in STAGING_EXCLUDED_PATHS
+
+def _copy_ignore(source_root):
+    """shutil.copytree ignore callback that matches project-relative paths"""
+    def ignore(directory, names):
+        rel_dir = os.path.relpath(directory, source_root).replace(os.sep, "/")
+        ignored = set()
+        for name in names:
+            rel = name if rel_dir == "." else f"{rel_dir}/{name}"
+            if _staging_excluded(rel) or name.endswith(".pyc"):
+                ignored.add(name)
+        return ignored
+    return ignore
+
+def _build_overlay(source_root, staging_dir, changed_paths):
+    """Materialize only the directories on changed paths; symlink everything else
+
+    Cost grows with the size of the directories along the changed paths,
+    not with the size of the repository.
+    """
+    materialized = {""}
+    for rel_path in list(changed_paths) + list(STAGING_EXCLUDED_PATHS):
+        parent = os.path.dirname(rel_path)
+        while parent:
+            materialized.add(parent)
+            parent = os.path.dirname(parent)
+
+    def build(rel_dir):
+        os.makedirs(os.path.join(staging_dir, rel_dir), exist_ok=True)
+        for entry in os.scandir(os.path.join(source_root, rel_dir)):
+            rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            target = os.path.join(staging_dir, rel)
+            if _staging_excluded(rel) or rel in changed_paths:
+                continue
+            if rel in STAGING_COPIED_DIRS and entry.is_dir(follow_symlinks=False):
+                shutil.copytree(entry.path, target, ignore=_copy_ignore(source_root), symlinks=True)
+            elif rel in materialized and entry.is_dir(follow_symlinks=False):
+                build(rel)
+            else:
+                os.symlink(entry.path, target)
+
+    build("")
+
+def create_staging_environment(files_to_update, mode=None):
     """Create a staging environment with proposed changes"""
+    mode = mode or STAGING_MODE
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     staging_dir = f"./backend/self_updates/staging/pleione_staging_{timestamp}"
+    source_root = os.path.abspath(".")
+    changed_paths = {_normalize_update_path(file_path) for file_path in files_to_update}
+    started = time.monotonic()
     
-    # Copy current system to staging
-    shutil.copytree(".", staging_dir, ignore=shutil.ignore_patterns(
-        '*.pyc', '__pycache__', '.git', 'backend/sandbox/*', 
-        'backend/self_updates/*', 'node_modules'
-    ))
+    if mode == "worktree":
+        os.makedirs(os.path.dirname(staging_dir), exist_ok=True)
+        with git_lock():
+            run_git(['worktree', 'add', '--detach', staging_dir, 'HEAD'], check=True)
+    elif mode == "copy":
+        # Copy current system to staging
+        shutil.copytree(".", staging_dir, ignore=_copy_ignore(source_root), symlinks=True)
+    else:
+        _build_overlay(source_root, staging_dir, changed_paths)
     
     # Apply proposed changes to staging
     for file_path, new_content in files_to_update.items():
-        staging_file_path = os.path.join(staging_dir, file_path)
+        staging_file_path = os.path.join(staging_dir, _normalize_update_path(file_path))
         os.makedirs(os.path.dirname(staging_file_path), exist_ok=True)
+        if os.path.islink(staging_file_path):
+            # Never write through a link into the live tree
+            os.unlink(staging_file_path)
         with open(staging_file_path, 'w') as f:
             f.write(new_content)
     
+    observe_stage("staging", time.monotonic() - started, mode)
+    print(f"⏱️ Staging ({mode}) built in {time.monotonic() - started:.3f}s")
     return staging_dir
 
-def run_comprehensive_tests(staging_dir):
-    """Run all tests in the staging environment"""
+# Keep each staging tree after its update for debugging (normally removed once packaged or failed)
+KEEP_STAGING = os.environ.get("PLEIONE_KEEP_STAGING", "0") == "1"
+
+def remove_staging_environment(staging_dir):
+    """Delete a staging tree; symlinks are removed without touching their targets"""
+    if os.path.exists(os.path.join(staging_dir, ".git")):
+        with git_lock():
+            run_git(['worktree', 'remove', '--force', staging_dir])
+    if os.path.lexists(staging_dir):
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+SMOKE_TEST_TIMEOUT = 20  # seconds for the staged server to answer its health check
+
+def _run_check(command, cwd, timeout):
+    """Run one validation subprocess in cwd; returns (passed, error_output)"""
+    try:
+        result = subprocess.run(command, cwd=cwd, capture_output=True, text=True, timeout=timeout)
+        return result.returncode == 0, f"{result.stdout[-2000:]}\n{result.stderr}".strip()
+    except subprocess.TimeoutExpired:
+        return False, f"timed out after {timeout}s"
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _smoke_test_server(staging_dir, timeout=SMOKE_TEST_TIMEOUT):
+    """Start the staged app on a free port and poll /api/health until it answers"""
+    port = _free_port()
+    with tempfile.TemporaryFile(mode='w+') as log:
+        proc = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'backend.main:app', '--host', '127.0.0.1', '--port', str(port)],
+                                cwd=staging_dir, stdout=subprocess.DEVNULL, stderr=log)
+        try:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if proc.poll() is not None:
+                    log.seek(0)
+                    return False, f"server exited with code {proc.returncode}: {log.read()[-2000:]}"
+                try:
+                    response = httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1)
+                    if response.status_code == 200:
+                        return True, ""
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.1)
+            return False, f"server did not become healthy within {timeout}s"
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+# Which tests a self-update runs: "full" (all of backend/tests/) or
+# "affected" (only tests that import a changed file, falling back to full)
+TEST_SELECTION = os.environ.get("PLEIONE_TEST_SELECTION", "full")
+
+def _basic_tests_check(staging_dir, changed_files, test_selection):
+    """Pick the pytest targets for the basic stage; returns (check, selection_report)"""
+    targets = ['backend/tests/']
+    report = None
+    if test_selection == "affected" and changed_files is not None:
+        report = select_tests(changed_files, root=staging_dir)
+        if report["mode"] == "affected":
+            if not report["selected"]:
+                return (lambda: (True, "No tests observe the changed files")), report
+            targets = report["selected"]
+    return (lambda: _run_check([sys.executable, '-m', 'pytest', *targets, '-v'], staging_dir, 60)), report
+
+def run_comprehensive_tests(staging_dir, changed_files=None, test_selection=None):
+    """Run all tests in the staging environment
+
+    The stages are independent, so they run concurrently, each as a
+    subprocess with cwd set to the staging tree (no process-wide chdir).
+    With test_selection="affected" and the list of changed files, the basic
+    stage only runs the tests that import one of them; the selection report
+    (including skipped tests and why) is returned under "test_selection".
+    """
     results = {
         "basic_tests": False,
         "api_tests": False,
@@ -89,111 +226,125 @@ def run_comprehensive_tests(staging_dir):
         "errors": []
     }
     
-    try:
-        # Change to staging directory
-        original_dir = os.getcwd()
-        os.chdir(staging_dir)
-        
-        # Run basic tests
-        result = subprocess.run(['python3', '-m', 'pytest', 'backend/tests/', '-v'], 
-                              capture_output=True, text=True, timeout=60)
-        results["basic_tests"] = result.returncode == 0
-        if result.returncode != 0:
-            results["errors"].append(f"Basic tests failed: {result.stderr}")
-        
-        # Test API startup
-        try:
-            result = subprocess.run(['python3', '-c', 'from backend.main import app; print("API import successful")'], 
-                                  capture_output=True, text=True, timeout=30)
-            results["api_tests"] = result.returncode == 0
-            if result.returncode != 0:
-                results["errors"].append(f"API test failed: {result.stderr}")
-        except Exception as e:
-            results["errors"].append(f"API test error: {str(e)}")
-        
-        # Test LLM connector
-        try:
-            result = subprocess.run(['python3', '-c', 'from backend.models.llm_connector import get_llm_response; print("LLM connector import successful")'], 
-                                  capture_output=True, text=True, timeout=30)
-            results["self_test"] = result.returncode == 0
-            if result.returncode != 0:
-                results["errors"].append(f"Self test failed: {result.stderr}")
-        except Exception as e:
-            results["errors"].append(f"Self test error: {str(e)}")
-        
-        # Integration test - try to start the server briefly
+    basic_check, results["test_selection"] = _basic_tests_check(
+        staging_dir, changed_files, test_selection or TEST_SELECTION)
+    stages = {
+        "basic_tests": ("Basic tests failed", basic_check),
+        "api_tests": ("API test failed", lambda: _run_check(
+            [sys.executable, '-c', 'from backend.main import app; print("API import successful")'], staging_dir, 30)),
+        "self_test": ("Self test failed", lambda: _run_check(
+            [sys.executable, '-c', 'from backend.models.llm_connector import get_llm_response; print("LLM connector import successful")'], staging_dir, 30)),
+        # Integration test - start the server and wait until it actually answers
+        "integration_tests": ("Integration test failed", lambda: _smoke_test_server(staging_dir)),
+    }
+    
+    def run_stage(name, check):
+        stage_started = time.monotonic()
+        passed = False
         try:
-            # This would start the server for a few seconds to test it works
-            proc = subprocess.Popen(['python3', '-m', 'uvicorn', 'backend.main:app', '--port', '8001'], 
-                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            # Let it run for 3 seconds then kill it
-            time.sleep(3)
-            proc.terminate()
-            proc.wait(timeout=5)
-            results["integration_tests"] = True
-        except Exception as e:
-            results["errors"].append(f"Integration test error: {str(e)}")
-        
-    finally:
-        os.chdir(original_dir)
+            passed, output = check()
+            return passed, output
+        finally:
+            observe_stage("validation", time.monotonic() - stage_started, name, error=not passed)
+    
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(stages)) as pool:
+        futures = {name: pool.submit(run_stage, name, check) for name, (_, check) in stages.items()}
+        for name, future in futures.items():
+            try:
+                passed, output = future.result()
+            except Exception as e:
+                passed, output = False, str(e)
+            results[name] = passed
+            if not passed:
+                results["errors"].append(f"{stages[name][0]}: {output}")
+    results["duration"] = round(time.monotonic() - started, 3)
     
     # All tests must pass for safety
     results["all_passed"] = all([
         results["basic_tests"],
         results["api_tests"], 
-        results["self_test"]
+        results["self_test"],
+        results["integration_tests"]
     ])
     
     return results
 
-def create_update_package(staging_dir, test_results):
-    """Create a deployable package if all tests pass"""
+# How generated deploy scripts apply a package:
+#   "restart"   - stop.sh, apply, run.sh (the service is down in between)
+#   "bluegreen" - start the new version beside the running one and switch the proxy once healthy
+DEPLOY_MODE = os.environ.get("PLEIONE_DEPLOY_MODE", "restart")
+
+def _deploy_steps(manifest_path, changed_paths, mode):
+    if mode == "bluegreen":
+        return f"""# Start the new version on the idle worker port, switch traffic once healthy,
+# then drain the old worker (switches back and reverts the files on failure)
+if ! python3 -m backend.models.bluegreen deploy {manifest_path}; then
+    echo "❌ Update not deployed - still serving the previous version"
+    exit 1
+fi
+
+echo "✅ Pleione update deployed with no downtime!"
+"""
+    return f"""# Stop current Pleione
+./stop.sh
+
+# Apply the changed files (refuses if they were modified since the package was built)
+if ! python3 -m backend.models.update_packages apply {manifest_path}; then
+    echo "❌ Update not applied"
+    ./run.sh
+    exit 1
+fi
+
+# Start updated Pleione
+./run.sh
+
+echo "✅ Pleione update deployed successfully!"
+echo "   Rollback with: git checkout -- {' '.join(changed_paths)}"
+"""
+
+def create_update_package(staging_dir, test_results, changed_files, deploy_mode=None):
+    """Create a deployable delta package if all tests pass
+
+    Only the changed files are stored (deduplicated in the package blob
+    store), together with the commit they were staged against; older
+    packages beyond PLEIONE_PACKAGE_RETENTION are garbage collected.
+    The deploy script restarts the service or, with deploy_mode="bluegreen",
+    hands traffic over without downtime.
+    """
     if not test_results["all_passed"]:
         return {"status": "failed", "message": "Tests failed - package creation blocked"}
     
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    package_name = f"pleione_update_{timestamp}.tar.gz"
-    package_path = f"./backend/self_updates/packages/{package_name}"
-    
-    # Create tar.gz package of the staging directory
-    shutil.make_archive(package_path.replace('.tar.gz', ''), 'gztar', staging_dir)
+    started = time.monotonic()
+    changed_paths = [_normalize_update_path(file_path) for file_path in changed_files]
+    package_id, manifest_path = create_delta_package(
+        staging_dir, changed_paths, base_commit=head_commit(), packages_dir=PACKAGES_DIR)
     
     # Create deployment script
     deploy_script = f"""#!/bin/bash
 # Pleione Self-Update Deployment Script
-# Generated: {timestamp}
+# Package: {package_id}
 
 echo "🤖 Pleione Self-Update Deployment"
 echo "================================="
 
-# Stop current Pleione
-./stop.sh
-
-# Backup current version
-cp -r . "./pleione_backup_pre_update_{timestamp}"
-
-# Extract update
-tar -xzf {package_path}
-mv pleione_staging_{timestamp}/* .
-
-# Start updated Pleione
-./run.sh
-
-echo "✅ Pleione update deployed successfully!"
-echo "   Backup available at: pleione_backup_pre_update_{timestamp}"
-"""
+{_deploy_steps(manifest_path, changed_paths, deploy_mode or DEPLOY_MODE)}"""
     
-    deploy_script_path = f"./backend/self_updates/packages/deploy_update_{timestamp}.sh"
+    deploy_script_path = os.path.join(PACKAGES_DIR, f"deploy_{package_id}.sh")
     with open(deploy_script_path, 'w') as f:
         f.write(deploy_script)
     
     os.chmod(deploy_script_path, 0o755)
+    gc_result = gc_packages(packages_dir=PACKAGES_DIR)
+    observe_stage("packaging", time.monotonic() - started)
+    print(f"⏱️ Delta package ({len(changed_paths)} file(s)) built in {time.monotonic() - started:.3f}s")
     
     return {
         "status": "success",
-        "package_path": package_path,
+        "package_path": manifest_path,
         "deploy_script": deploy_script_path,
-        "message": f"Update package created: {package_name}"
+        "gc": gc_result,
+        "message": f"Update package created: {package_id}"
     }
 
 def safe_self_update(files_to_update):
@@ -203,7 +354,9 @@ def safe_self_update(files_to_update):
     
     # Step 1: Git backup current system
     print("📦 Creating git backup...")
-    backup_result = git_commit_current_state("Backup before Pleione self-update")
+    backup_result = git_commit_current_state(
+        "Backup before Pleione self-update",
+        paths=[_normalize_update_path(file_path) for file_path in files_to_update])
     if backup_result["status"] == "error":
         return {"status": "failed", "message": f"Git backup failed: {backup_result['message']}"}
     print("✅ Git backup completed")
@@ -213,34 +366,45 @@ def safe_self_update(files_to_update):
     staging_dir = create_staging_environment(files_to_update)
     print(f"✅ Staging created: {staging_dir}")
     
-    # Step 3: Run comprehensive tests
-    print("🧪 Running comprehensive tests...")
-    test_results = run_comprehensive_tests(staging_dir)
-    
-    if test_results["all_passed"]:
-        print("✅ All tests passed!")
-        
-        # Step 4: Create deployment package
-        print("📦 Creating deployment package...")
-        package_result = create_update_package(staging_dir, test_results)
+    try:
+        # Step 3: Run comprehensive tests
+        print("🧪 Running comprehensive tests...")
+        test_results = run_comprehensive_tests(staging_dir, changed_files=list(files_to_update))
+        selection = test_results["test_selection"]
+        if selection:
+            print(f"🎯 Test selection ({selection['mode']}): {len(selection['selected'])} run, {len(selection['skipped'])} skipped")
+            for test, reason in selection["skipped"].items():
+                print(f"   ⏭️ {test}: {reason}")
         
-        return {
-            "status": "ready_for_deployment",
-            "git_backup": backup_result,
-            "staging_dir": staging_dir,
-            "test_results": test_results,
-            "package": package_result,
-            "message": "Self-update package ready for deployment",
-            "rollback_info": "Use 'git reset --hard HEAD~1' to rollback if needed"
-        }
-    else:
-        print("❌ Tests failed - update blocked for safety")
-        return {
-            "status": "failed",
-            "git_backup": backup_result,
-            "staging_dir": staging_dir,
-            "test_results": test_results,
-            "message": "Self-update blocked due to test failures",
-            "errors": test_results["errors"],
-            "rollback_info": "Use 'git reset --hard HEAD~1' to rollback if needed"
-        }
+        if test_results["all_passed"]:
+            print("✅ All tests passed!")
+            
+            # Step 4: Create deployment package (it holds its own copy of the changed files)
+            print("📦 Creating deployment package...")
+            package_result = create_update_package(staging_dir, test_results, files_to_update)
+            
+            return {
+                "status": "ready_for_deployment",
+                "git_backup": backup_result,
+                "staging_dir": staging_dir if KEEP_STAGING else None,
+                "test_results": test_results,
+                "package": package_result,
+                "message": "Self-update package ready for deployment",
+                "rollback_info": "Use 'git reset --hard HEAD~1' to rollback if needed"
+            }
+        else:
+            print("❌ Tests failed - update blocked for safety")
+            return {
+                "status": "failed",
+                "git_backup": backup_result,
+                "staging_dir": staging_dir if KEEP_STAGING else None,
+                "test_results": test_results,
+                "message": "Self-update blocked due to test failures",
+                "errors": test_results["errors"],
+                "rollback_info": "Use 'git reset --hard HEAD~1' to rollback if needed"
+            }
+    finally:
+        if KEEP_STAGING:
+            print(f"🔍 Staging kept for debugging: {staging_dir}")
+        else:
+            remove_staging_environment(staging_dir)
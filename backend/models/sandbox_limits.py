@@ -0,0 +1,133 @@
+"""Resource limits and usage accounting for generated-test runs.
+
+Generated tests run untrusted code on the machine serving the API, so each
+validation run gets rlimits (CPU seconds, address space, open files,
+processes) and a lower scheduling priority, and its CPU time and peak
+memory are recorded. Subprocess runs go through this file as a launcher
+(limits applied, then exec), which stays safe when runs are started from
+several threads; the fork-server applies the same limits in its children.
+
+Standard library only: the fork-server imports it as a plain module.
+"""
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TEST_LIMITS_ENABLED = os.environ.get("PLEIONE_TEST_LIMITS", "1") == "1" and resource is not None
+TEST_CPU_SECONDS = int(os.environ.get("PLEIONE_TEST_CPU_SECONDS", "60"))
+TEST_MEMORY_MB = int(os.environ.get("PLEIONE_TEST_MEMORY_MB", "2048"))
+TEST_MAX_OPEN_FILES = int(os.environ.get("PLEIONE_TEST_MAX_OPEN_FILES", "256"))
+# RLIMIT_NPROC counts every process of the user, not just the test's
+TEST_MAX_PROCESSES = int(os.environ.get("PLEIONE_TEST_MAX_PROCESSES", "512"))
+TEST_NICE = int(os.environ.get("PLEIONE_TEST_NICE", "10"))
+
+# Seconds between the soft CPU limit (SIGXCPU) and the hard one (SIGKILL)
+CPU_GRACE_SECONDS = 5
+
+def current_limits():
+    """The configured limits, or None when limiting is off or unsupported; 0 means unlimited"""
+    if not TEST_LIMITS_ENABLED:
+        return None
+    return {"cpu_seconds": TEST_CPU_SECONDS, "memory_mb": TEST_MEMORY_MB, "open_files": TEST_MAX_OPEN_FILES,
+            "processes": TEST_MAX_PROCESSES, "nice": TEST_NICE}
+
+def _lower(kind, soft, hard=None):
+    hard = soft if hard is None else hard
+    _, current_hard = resource.getrlimit(kind)
+    if current_hard != resource.RLIM_INFINITY:
+        soft, hard = min(soft, current_hard), min(hard, current_hard)
+    resource.setrlimit(kind, (soft, hard))
+
+def apply_limits(limits):
+    """Apply limits to the current process (a test child before it runs anything)"""
+    if not limits or resource is None:
+        return
+    if limits.get("cpu_seconds"):
+        _lower(resource.RLIMIT_CPU, limits["cpu_seconds"], limits["cpu_seconds"] + CPU_GRACE_SECONDS)
+    if limits.get("memory_mb"):
+        _lower(resource.RLIMIT_AS, limits["memory_mb"] * 1024 * 1024)
+    if limits.get("open_files"):
+        _lower(resource.RLIMIT_NOFILE, limits["open_files"])
+    if limits.get("processes") and hasattr(resource, "RLIMIT_NPROC"):
+        _lower(resource.RLIMIT_NPROC, limits["processes"])
+    if limits.get("nice"):
+        os.nice(limits["nice"])
+
+def usage_from_rusage(rusage, status, wall, limits=None, output="", timed_out=False):
+    """Summarize a reaped child: CPU seconds, peak RSS, wall time and which limit (if any) stopped it"""
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    max_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    cpu = rusage.ru_utime + rusage.ru_stime
+    usage = {"cpu_user": round(rusage.ru_utime, 3), "cpu_system": round(rusage.ru_stime, 3),
+             "max_rss_mb": round(max_rss / (1024 * 1024), 1), "wall": round(wall, 3),
+             "signal": None, "limit": None}
+    if os.WIFSIGNALED(status):
+        signum = os.WTERMSIG(status)
+        usage["signal"] = signal.Signals(signum).name
+        if signum == signal.SIGXCPU or (limits and limits.get("cpu_seconds") and cpu >= limits["cpu_seconds"]):
+            usage["limit"] = "cpu"
+    if timed_out:
+        usage["limit"] = "timeout"
+    # Hitting RLIMIT_AS surfaces as a MemoryError in the test output rather than a signal
+    elif usage["limit"] is None and limits and limits.get("memory_mb") and "MemoryError" in output:
+        usage["limit"] = "memory"
+    return usage
+
+def run_limited(command, timeout, cwd=None, limits=None):
+    """Run command under limits; returns {"returncode", "output", "timed_out", "usage"}
+
+    stdout and stderr are combined. On timeout the whole process group is
+    killed. usage covers the process and the children it waited for.
+    """
+    limits = current_limits() if limits is None else limits
+    argv = [sys.executable, os.path.abspath(__file__), json.dumps(limits), *command] if limits else list(command)
+    with tempfile.TemporaryFile() as output:
+        started = time.monotonic()
+        proc = subprocess.Popen(argv, cwd=cwd, stdin=subprocess.DEVNULL, stdout=output, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+        deadline = started + timeout
+        timed_out = False
+        if not hasattr(os, "wait4"):
+            # No rusage per child here (Windows): plain wait, no usage figures
+            try:
+                proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+                timed_out = True
+            output.seek(0)
+            return {"returncode": proc.returncode, "timed_out": timed_out, "usage": None,
+                    "output": output.read().decode("utf-8", errors="replace")}
+        while True:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.monotonic() > deadline:
+                timed_out = True
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                _, status, rusage = os.wait4(proc.pid, 0)
+                break
+            time.sleep(0.01)
+        # Reaped here, so tell Popen not to wait for it again
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        output.seek(0)
+        text = output.read().decode("utf-8", errors="replace")
+    usage = usage_from_rusage(rusage, status, time.monotonic() - started, limits, text, timed_out)
+    return {"returncode": proc.returncode, "output": text, "timed_out": timed_out, "usage": usage}
+
+if __name__ == "__main__":
+    # Launcher: python sandbox_limits.py '<limits json>' command...
+    apply_limits(json.loads(sys.argv[1]))
+    os.execvp(sys.argv[2], sys.argv[2:])
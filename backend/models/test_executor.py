@@ -0,0 +1,165 @@
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from .pytest_forkserver import run_pytest_forked
+from .sandbox_limits import run_limited
+
+# Seconds allowed per test file; a session's budget scales with the files it runs
+TEST_TIMEOUT_PER_FILE = 30
+
+def get_worker_count(file_count):
+    """Size the worker pool to the CPU count, never more workers than files"""
+    return max(1, min(os.cpu_count() or 1, file_count))
+
+def _chunk(items, count):
+    """Split items round-robin into `count` non-empty lists"""
+    chunks = [items[i::count] for i in range(count)]
+    return [chunk for chunk in chunks if chunk]
+
+def _has_xdist():
+    return importlib.util.find_spec("xdist") is not None
+
+def _parse_junit(junit_path, test_files):
+    """Collect per-file outcomes from a JUnit XML report
+
+    Returns {test_file: {"tests": n, "failures": [messages]}} for every file
+    that produced at least one test case or collection error.
+    """
+    # JUnit file attributes are relative to the rootdir (the working directory)
+    by_path = {os.path.abspath(f): f for f in test_files}
+    outcomes = {}
+    try:
+        root = ET.parse(junit_path).getroot()
+    except (OSError, ET.ParseError):
+        return outcomes
+
+    for case in root.iter("testcase"):
+        test_file = by_path.get(os.path.abspath(case.get("file", "")))
+        if test_file is None:
+            continue
+        outcome = outcomes.setdefault(test_file, {"tests": 0, "failures": []})
+        outcome["tests"] += 1
+        for tag in ("failure", "error"):
+            problem = case.find(tag)
+            if problem is not None:
+                name = case.get("name")
+                outcome["failures"].append(f"{name}: {problem.get('message', tag)}\n{problem.text or ''}".rstrip())
+    return outcomes
+
+def _run_session(test_files, workers=None):
+    """Run test_files in one resource-limited pytest session
+
+    Returns (outcomes, returncode, output, usage); raises
+    subprocess.TimeoutExpired if the session overruns its time budget.
+    """
+    fd, junit_path = tempfile.mkstemp(prefix="pleione_junit_", suffix=".xml")
+    os.close(fd)
+    command = [
+        sys.executable, '-m', 'pytest', *test_files,
+        '-q', '-p', 'no:cacheprovider',
+        '--rootdir', os.getcwd(),
+        '--continue-on-collection-errors',
+        '--junitxml', junit_path, '-o', 'junit_family=xunit1'
+    ]
+    if workers:
+        command += ['-n', str(workers)]
+    try:
+        timeout = TEST_TIMEOUT_PER_FILE * len(test_files)
+        result = run_limited(command, timeout)
+        if result["timed_out"]:
+            raise subprocess.TimeoutExpired(command, timeout, output=result["output"])
+        return _parse_junit(junit_path, test_files), result["returncode"], result["output"], result["usage"]
+    finally:
+        if os.path.exists(junit_path):
+            os.remove(junit_path)
+
+def run_tests_parallel(test_files):
+    """Run all test files in a single pytest session spread over a process pool
+
+    Uses pytest-xdist when it is installed. Otherwise the files are split into
+    one pytest session per CPU, run concurrently. Outcomes are reported per
+    file in the same format as the sequential runner; a session's resource
+    usage is reported for each file it ran.
+    """
+    workers = get_worker_count(len(test_files))
+    if _has_xdist():
+        sessions = [(test_files, workers)]
+    else:
+        sessions = [(chunk, None) for chunk in _chunk(list(test_files), workers)]
+
+    def run(session):
+        files, xdist_workers = session
+        try:
+            return files, _run_session(files, xdist_workers), None
+        except subprocess.TimeoutExpired:
+            return files, None, "TIMEOUT"
+        except Exception as e:
+            return files, None, str(e)
+
+    results = []
+    resource_usage = {}
+    all_passed = True
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        for files, session_result, problem in pool.map(run, sessions):
+            if problem == "TIMEOUT":
+                results.extend(f"⏰ {test_file}: TIMEOUT" for test_file in files)
+                all_passed = False
+                continue
+            if problem:
+                results.extend(f"💥 {test_file}: ERROR - {problem}" for test_file in files)
+                all_passed = False
+                continue
+
+            outcomes, returncode, output, usage = session_result
+            for test_file in files:
+                resource_usage[test_file] = usage
+                outcome = outcomes.get(test_file)
+                if outcome is None:
+                    # No test cases recorded: nothing collected or the session crashed
+                    results.append(f"❌ {test_file}: FAILED\nNo tests collected (pytest exit code {returncode})\n{output}")
+                    all_passed = False
+                elif outcome["failures"]:
+                    results.append(f"❌ {test_file}: FAILED\n" + "\n".join(outcome["failures"]))
+                    all_passed = False
+                else:
+                    results.append(f"✅ {test_file}: PASSED")
+
+    return {
+        "status": "passed" if all_passed else "failed",
+        "results": results,
+        "all_passed": all_passed,
+        "resource_usage": resource_usage
+    }
+
+def run_tests_forkserver(test_files):
+    """Run each test file in a child forked from the warm pytest server
+
+    Files are dispatched concurrently and reported in the same format as the
+    sequential runner, in input order.
+    """
+    def run(test_file):
+        try:
+            returncode, output, usage = run_pytest_forked([test_file, '-v', '-p', 'no:cacheprovider'],
+                                                          timeout=TEST_TIMEOUT_PER_FILE, with_usage=True)
+            if returncode == 0:
+                return f"✅ {test_file}: PASSED", True, usage
+            return f"❌ {test_file}: FAILED\n{output}", False, usage
+        except subprocess.TimeoutExpired:
+            return f"⏰ {test_file}: TIMEOUT", False, None
+        except Exception as e:
+            return f"💥 {test_file}: ERROR - {str(e)}", False, None
+
+    with ThreadPoolExecutor(max_workers=get_worker_count(len(test_files))) as pool:
+        outcomes = list(pool.map(run, test_files))
+
+    all_passed = all(passed for _, passed, _ in outcomes)
+    return {
+        "status": "passed" if all_passed else "failed",
+        "results": [message for message, _, _ in outcomes],
+        "all_passed": all_passed,
+        "resource_usage": {test_file: usage for test_file, (_, _, usage) in zip(test_files, outcomes) if usage}
+    }
@@ -0,0 +1,270 @@
+"""Delta update packages backed by a content-addressed blob store.
+
+A package is a JSON manifest naming the base commit it was built against
+and, for every changed path, the sha256 of its new content. Contents live
+once in `blobs/<sha[:2]>/<sha>` no matter how many packages reference
+them, so creating, applying and storing a package costs time and space
+proportional to the diff rather than to the project.
+
+Creating a package and garbage collection hold a lock on the packages
+directory, so a collection never sees blobs whose manifest is not written
+yet. Rollback snapshots (manifests with "rollback_for") are kept for as
+long as the package they revert.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from .git_ops import git_lock, run_git
+
+try:
+    import fcntl  # POSIX; serializes package writes and GC across processes
+except ImportError:
+    fcntl = None
+
+PACKAGES_DIR = "./backend/self_updates/packages/"
+PACKAGE_RETENTION = int(os.environ.get("PLEIONE_PACKAGE_RETENTION", "5"))
+
+_thread_lock = threading.Lock()
+
+@contextmanager
+def packages_lock(packages_dir=PACKAGES_DIR):
+    """Exclusive access to packages_dir between threads and between processes"""
+    with _thread_lock:
+        os.makedirs(packages_dir, exist_ok=True)
+        lock_file = open(os.path.join(packages_dir, ".lock"), 'w') if fcntl is not None else None
+        try:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+def _blobs_dir(packages_dir):
+    return os.path.join(packages_dir, "blobs")
+
+def _blob_path(packages_dir, digest):
+    return os.path.join(_blobs_dir(packages_dir), digest[:2], digest)
+
+def _write_atomic(path, data, mode=None):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    if mode is not None:
+        os.chmod(tmp_path, mode)
+    os.replace(tmp_path, path)
+
+def store_blob(data, packages_dir=PACKAGES_DIR):
+    """Store bytes under their sha256 (no-op if already present); returns the digest"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(packages_dir, digest)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    return digest
+
+def read_blob(digest, packages_dir=PACKAGES_DIR):
+    with open(_blob_path(packages_dir, digest), 'rb') as f:
+        data = f.read()
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"Blob {digest} is corrupt")
+    return data
+
+def head_commit(root="."):
+    with git_lock(root):
+        result = run_git(['rev-parse', 'HEAD'], root)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def create_delta_package(source_dir, changed_paths, base_commit=None, packages_dir=PACKAGES_DIR, metadata=None):
+    """Write a manifest for changed_paths as they exist under source_dir
+
+    Paths missing from source_dir are recorded as deletions. Returns
+    (package_id, manifest_path).
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    package_id = f"pleione_update_{timestamp}_{os.urandom(3).hex()}"
+    files = {}
+    deleted = []
+    # Blobs are unreferenced until the manifest lands, so GC must not run in between
+    with packages_lock(packages_dir):
+        for rel_path in sorted({os.path.normpath(p) for p in changed_paths}):
+            source = os.path.join(source_dir, rel_path)
+            if not os.path.isfile(source):
+                deleted.append(rel_path)
+                continue
+            with open(source, 'rb') as f:
+                data = f.read()
+            files[rel_path] = {
+                "sha256": store_blob(data, packages_dir),
+                "size": len(data),
+                "executable": os.access(source, os.X_OK)
+            }
+
+        manifest = {
+            "id": package_id,
+            "created": time.time(),
+            "base_commit": base_commit,
+            "files": files,
+            "deleted": deleted,
+            **(metadata or {})
+        }
+        manifest_path = os.path.join(packages_dir, f"{package_id}.json")
+        _write_atomic(manifest_path, json.dumps(manifest, indent=2).encode("utf-8"))
+    return package_id, manifest_path
+
+def load_manifest(manifest_path):
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def verify_package(manifest_path, packages_dir=None):
+    """Return a list of problems (missing or corrupt blobs); empty means the package is intact"""
+    packages_dir = packages_dir or os.path.dirname(manifest_path)
+    problems = []
+    for rel_path, entry in load_manifest(manifest_path)["files"].items():
+        try:
+            read_blob(entry["sha256"], packages_dir)
+        except (OSError, ValueError) as e:
+            problems.append(f"{rel_path}: {e}")
+    return problems
+
+def _diverged_paths(manifest, root):
+    """Paths in the package that changed in the repository since its base commit"""
+    base = manifest.get("base_commit")
+    paths = list(manifest["files"]) + manifest["deleted"]
+    if not base or not paths:
+        return []
+    with git_lock(root):
+        result = run_git(['diff', '--name-only', base, '--', *paths], root)
+    if result.returncode != 0:
+        return []
+    return result.stdout.split()
+
+def apply_package(manifest_path, root=".", force=False, packages_dir=None):
+    """Write a package's files into root; returns {"status", "applied", "deleted", ...}
+
+    Refuses (unless force) when a packaged path was modified after the
+    base commit, since applying would silently discard that change.
+    """
+    packages_dir = packages_dir or os.path.dirname(manifest_path)
+    manifest = load_manifest(manifest_path)
+
+    diverged = _diverged_paths(manifest, root)
+    if diverged and not force:
+        return {"status": "conflict", "paths": diverged,
+                "message": f"Changed since base commit {manifest['base_commit'][:8]}: {', '.join(diverged)}"}
+
+    problems = verify_package(manifest_path, packages_dir)
+    if problems:
+        return {"status": "error", "message": "; ".join(problems)}
+
+    applied = []
+    for rel_path, entry in manifest["files"].items():
+        target = os.path.join(root, rel_path)
+        data = read_blob(entry["sha256"], packages_dir)
+        # Symlinks (e.g. an overlay staging link) are replaced, never written through
+        if os.path.islink(target):
+            os.unlink(target)
+        _write_atomic(target, data, 0o755 if entry.get("executable") else 0o644)
+        applied.append(rel_path)
+    removed = []
+    for rel_path in manifest["deleted"]:
+        target = os.path.join(root, rel_path)
+        if os.path.lexists(target):
+            os.remove(target)
+            removed.append(rel_path)
+    return {"status": "success", "applied": applied, "deleted": removed}
+
+def list_packages(packages_dir=PACKAGES_DIR):
+    """Manifests in packages_dir, oldest first"""
+    manifests = []
+    if not os.path.isdir(packages_dir):
+        return manifests
+    for name in os.listdir(packages_dir):
+        if name.startswith("pleione_update_") and name.endswith(".json"):
+            path = os.path.join(packages_dir, name)
+            try:
+                manifests.append((load_manifest(path)["created"], path))
+            except (OSError, ValueError, KeyError):
+                continue
+    return [path for _, path in sorted(manifests)]
+
+def gc_packages(keep=PACKAGE_RETENTION, packages_dir=PACKAGES_DIR):
+    """Keep the newest `keep` packages, then delete blobs no remaining package references
+
+    Rollback snapshots don't count towards `keep`; each goes when the
+    package it reverts does.
+    """
+    with packages_lock(packages_dir):
+        manifests = [(path, load_manifest(path)) for path in list_packages(packages_dir)]
+        updates = [(path, manifest) for path, manifest in manifests if not manifest.get("rollback_for")]
+        expired = updates[:-keep] if keep > 0 else updates
+        kept_ids = {manifest["id"] for path, manifest in updates} - {manifest["id"] for path, manifest in expired}
+        expired += [(path, manifest) for path, manifest in manifests
+                    if manifest.get("rollback_for") and manifest["rollback_for"] not in kept_ids]
+        for path, manifest in expired:
+            for leftover in (path, os.path.join(packages_dir, f"deploy_{manifest['id']}.sh")):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        referenced = set()
+        for path in list_packages(packages_dir):
+            referenced.update(entry["sha256"] for entry in load_manifest(path)["files"].values())
+
+        removed_blobs = 0
+        freed = 0
+        blobs_dir = _blobs_dir(packages_dir)
+        if os.path.isdir(blobs_dir):
+            for dirpath, _, filenames in os.walk(blobs_dir):
+                for filename in filenames:
+                    if filename not in referenced:
+                        path = os.path.join(dirpath, filename)
+                        freed += os.path.getsize(path)
+                        os.remove(path)
+                        removed_blobs += 1
+    return {"packages_removed": len(expired), "blobs_removed": removed_blobs, "bytes_freed": freed}
+
+def _main(argv):
+    """python3 -m backend.models.update_packages apply <manifest> [--force] | verify <manifest> | gc [keep] | list"""
+    if not argv:
+        print(_main.__doc__)
+        return 2
+    command, args = argv[0], argv[1:]
+    if command == "apply" and args:
+        result = apply_package(args[0], force="--force" in args)
+        if result["status"] != "success":
+            print(f"❌ {result['message']}")
+            return 1
+        for rel_path in result["applied"]:
+            print(f"   ✅ Updated: {rel_path}")
+        for rel_path in result["deleted"]:
+            print(f"   🗑️ Removed: {rel_path}")
+        return 0
+    if command == "verify" and args:
+        problems = verify_package(args[0])
+        for problem in problems:
+            print(f"❌ {problem}")
+        if not problems:
+            print(f"✅ Package intact: {args[0]}")
+        return 1 if problems else 0
+    if command == "gc":
+        result = gc_packages(int(args[0]) if args else PACKAGE_RETENTION)
+        print(f"🧹 Removed {result['packages_removed']} package(s) and {result['blobs_removed']} blob(s), "
+              f"freed {result['bytes_freed']} bytes")
+        return 0
+    if command == "list":
+        for path in list_packages():
+            manifest = load_manifest(path)
+            base = (manifest.get("base_commit") or "?")[:8]
+            print(f"{manifest['id']}  base {base}  {len(manifest['files'])} file(s), {len(manifest['deleted'])} deletion(s)")
+        return 0
+    print(_main.__doc__)
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
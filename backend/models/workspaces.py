@@ -0,0 +1,119 @@
+"""Per-generation workspaces, so concurrent generations never share files.
+
+Each generate_code_and_tests run writes into its own
+backend/workspaces/<id>/{sandbox,tests} pair (the sibling layout keeps the
+generated "../sandbox" imports working) and tests only what it wrote.
+Files are copied into the shared backend/sandbox and backend/tests only
+when the generation passes, and never over a different file of the same
+name promoted by a generation that ran at the same time; such a generation
+keeps its files in its workspace instead. Promoted and errored workspaces
+are removed right away; the others are kept for inspection and removed
+once older than PLEIONE_WORKSPACE_TTL.
+"""
+import filecmp
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from .code_parser import is_test_file
+
+WORKSPACES_DIR = os.environ.get("PLEIONE_WORKSPACES_DIR", "./backend/workspaces/")
+WORKSPACE_TTL = float(os.environ.get("PLEIONE_WORKSPACE_TTL", str(24 * 3600)))
+
+_promote_lock = threading.Lock()
+_promoted = {}  # absolute target path -> (workspace id, monotonic time it was promoted)
+_open = {}  # workspace id -> creation time, while its generation runs
+
+class PromotionConflict(Exception):
+    """A concurrent generation already promoted a different file of the same name"""
+
+def create_workspace():
+    """Make a fresh workspace; returns {"id", "root", "sandbox_dir", "test_dir", "created"}"""
+    cleanup_workspaces()
+    workspace_id = uuid.uuid4().hex
+    root = os.path.join(WORKSPACES_DIR, workspace_id)
+    workspace = {"id": workspace_id, "root": root, "created": time.monotonic(),
+                 "sandbox_dir": os.path.join(root, "sandbox", ""), "test_dir": os.path.join(root, "tests", "")}
+    os.makedirs(workspace["sandbox_dir"])
+    os.makedirs(workspace["test_dir"])
+    with _promote_lock:
+        _open[workspace_id] = workspace["created"]
+    return workspace
+
+def remove_workspace(workspace):
+    shutil.rmtree(workspace["root"], ignore_errors=True)
+
+def close_workspace(workspace, keep=False):
+    """Mark the workspace's generation finished; its files are removed unless keep"""
+    with _promote_lock:
+        _open.pop(workspace["id"], None)
+    if not keep:
+        remove_workspace(workspace)
+
+def _prune_promoted():
+    """Forget promotions older than every running generation; only those can conflict"""
+    with _promote_lock:
+        oldest = min(_open.values(), default=time.monotonic())
+        for target in [target for target, (_, promoted_at) in _promoted.items() if promoted_at < oldest]:
+            del _promoted[target]
+
+def _clobbers(file_path, target, workspace):
+    """True if target was promoted by another generation since workspace was created, with other contents"""
+    owner = _promoted.get(os.path.abspath(target))
+    if owner is None or owner[0] == workspace["id"] or owner[1] < workspace["created"]:
+        return False
+    try:
+        return not filecmp.cmp(file_path, target, shallow=False)
+    except OSError:
+        return False
+
+def promote_files(created_files, sandbox_dir, test_dir, workspace=None):
+    """Copy generated files into sandbox_dir / test_dir by name; returns their new paths
+
+    Each file is written to a temporary name and renamed into place, so a
+    reader never sees half a file. When promoting from a workspace, files
+    left by generations that finished earlier are replaced, but if one
+    running alongside it already promoted a different file of the same name,
+    nothing is copied and PromotionConflict is raised.
+    """
+    targets = [(file_path, os.path.join(test_dir if is_test_file(file_path) else sandbox_dir,
+                                        os.path.basename(file_path)))
+               for file_path in created_files]
+    with _promote_lock:
+        if workspace is not None:
+            conflicts = [os.path.basename(target) for file_path, target in targets
+                         if _clobbers(file_path, target, workspace)]
+            if conflicts:
+                raise PromotionConflict(f"{', '.join(conflicts)} already promoted by a concurrent generation")
+        for file_path, target in targets:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_path = f"{target}.{os.getpid()}.tmp"
+            shutil.copyfile(file_path, temp_path)
+            os.replace(temp_path, target)
+            if workspace is not None:
+                _promoted[os.path.abspath(target)] = (workspace["id"], time.monotonic())
+    return [target for _, target in targets]
+
+def cleanup_workspaces(ttl=None):
+    """Remove workspaces last modified more than ttl seconds ago; returns how many"""
+    _prune_promoted()
+    ttl = WORKSPACE_TTL if ttl is None else ttl
+    try:
+        entries = list(os.scandir(WORKSPACES_DIR))
+    except FileNotFoundError:
+        return 0
+    cutoff = time.time() - ttl
+    removed = 0
+    for entry in entries:
+        try:
+            expired = entry.is_dir() and entry.stat().st_mtime < cutoff
+        except OSError:
+            continue
+        if expired:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    if removed:
+        print(f"🧹 Removed {removed} expired generation workspace(s)")
+    return removed
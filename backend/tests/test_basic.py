@@ -27,6 +27,1108 @@ def test_llm_connector_basic():
     assert 'error' in result or 'status' in result
     print("✅ LLM connector basic test passed")
 
+def test_llm_client_pool_reused():
+    """Test that synchronous LLM calls share one pooled client"""
+    from backend.models.llm_client import get_sync_client, close_sync_client
+    
+    client = get_sync_client()
+    assert get_sync_client() is client
+    close_sync_client()
+    assert get_sync_client() is not client
+    close_sync_client()
+    print("✅ LLM client pool test passed")
+
+def test_job_recovery_marks_running_interrupted(tmp_path, monkeypatch):
+    """Test that jobs left running by a previous server are marked interrupted"""
+    import json
+    from backend.models import jobs
+    
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    monkeypatch.setattr(jobs, "_jobs", {})
+    (tmp_path / "abc.json").write_text(json.dumps({"id": "abc", "status": "running", "created_at": 0}))
+    
+    jobs.recover_jobs()
+    assert jobs.get_job("abc")["status"] == "interrupted"
+    assert json.loads((tmp_path / "abc.json").read_text())["status"] == "interrupted"
+    print("✅ Job recovery test passed")
+
+def test_finished_jobs_are_pruned(tmp_path, monkeypatch):
+    """Test that finished jobs expire by age and count while active ones are kept"""
+    import json
+    import time
+    from backend.models import jobs
+
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    monkeypatch.setattr(jobs, "_jobs", {})
+    monkeypatch.setattr(jobs, "JOB_TTL", 3600)
+    monkeypatch.setattr(jobs, "JOB_MAX_FINISHED", 2)
+    now = time.time()
+    records = {"expired": ("completed", now - 7200), "oldest": ("failed", now - 300),
+               "newer": ("cancelled", now - 200), "newest": ("interrupted", now - 100),
+               # Still running in another (live) worker: never pruned, whatever its age
+               "elsewhere": ("running", now - 7200)}
+    for job_id, (status, finished_at) in records.items():
+        (tmp_path / f"{job_id}.json").write_text(json.dumps(
+            {"id": job_id, "status": status, "created_at": finished_at, "finished_at": finished_at,
+             "owner_pid": os.getppid() if status == "running" else None}))
+
+    jobs.recover_jobs()
+    assert sorted(os.listdir(tmp_path)) == ["elsewhere.json", "newer.json", "newest.json"]
+    assert sorted(jobs._jobs) == ["newer", "newest"] and jobs.get_job("expired") is None
+    assert jobs.prune_jobs(now=now + 7200) == 2 and jobs._jobs == {}
+    print("✅ Job retention test passed")
+
+def test_draining_worker_hands_off_queued_jobs(tmp_path, monkeypatch):
+    """Test that a draining worker's queued jobs are taken over by the worker replacing it"""
+    import asyncio
+    import json
+    from backend.models import jobs
+
+    async def slow_generation(prompt, **kwargs):
+        await asyncio.sleep(10)
+
+    async def drain():
+        running = jobs.submit_job("running")
+        queued = jobs.submit_job("queued")
+        await asyncio.sleep(0.01)
+        await jobs.shutdown_jobs(drain_timeout=0.05)
+        return running["id"], queued["id"]
+
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    monkeypatch.setattr(jobs, "JOB_MAX_WORKERS", 1)
+    monkeypatch.setattr(jobs, "_semaphore", None)
+    monkeypatch.setattr(jobs, "_jobs", {})
+    monkeypatch.setattr(jobs, "generate_code_and_tests_async", slow_generation)
+    running_id, queued_id = asyncio.run(drain())
+    handed_off = json.loads((tmp_path / f"{queued_id}.json").read_text())
+    assert handed_off["status"] == "queued" and handed_off["owner_pid"] is None
+    assert json.loads((tmp_path / f"{running_id}.json").read_text())["status"] == "interrupted"
+
+    # The new worker started (and ran its first recovery) before the hand-off; its rescan picks the job up
+    async def fast_generation(prompt, **kwargs):
+        return {"ready_for_implementation": True}
+
+    async def take_over():
+        rescans = asyncio.create_task(jobs.run_job_recovery(0.01))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if (jobs.get_job(queued_id) or {}).get("status") == "completed":
+                break
+        rescans.cancel()
+
+    monkeypatch.setattr(jobs, "_semaphore", None)
+    monkeypatch.setattr(jobs, "_jobs", {})
+    monkeypatch.setattr(jobs, "generate_code_and_tests_async", fast_generation)
+    asyncio.run(take_over())
+    assert jobs.get_job(queued_id)["status"] == "completed" and jobs.get_job(queued_id)["owner_pid"] == os.getpid()
+    print("✅ Job hand-off test passed")
+
+def test_parallel_test_mode_reports_per_file(tmp_path):
+    """Test that the single-session parallel runner keeps per-file results"""
+    from backend.models.llm_connector import run_tests_and_validate
+    
+    passing = tmp_path / "test_passing.py"
+    failing = tmp_path / "test_failing.py"
+    passing.write_text("def test_ok():\n    assert True\n")
+    failing.write_text("def test_bad():\n    assert False\n")
+    
+    result = run_tests_and_validate([str(passing), str(failing)], mode="parallel", use_cache=False)
+    assert result["status"] == "failed"
+    assert f"✅ {passing}: PASSED" in result["results"]
+    assert any(r.startswith(f"❌ {failing}: FAILED") for r in result["results"])
+    print("✅ Parallel test mode test passed")
+
+def test_forkserver_test_mode():
+    """Test that the warm fork-server runs a test file"""
+    from backend.models.llm_connector import run_tests_and_validate
+    from backend.models.pytest_forkserver import forkserver_available, stop_forkserver
+    
+    if not forkserver_available():
+        pytest.skip("fork-server needs os.fork")
+    hello_tests = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_hello.py")
+    try:
+        result = run_tests_and_validate([hello_tests], mode="forkserver", use_cache=False)
+        assert result["all_passed"], result["results"]
+    finally:
+        stop_forkserver()
+    print("✅ Fork-server test mode test passed")
+
+def test_forkserver_exit_releases_only_its_own_requests(monkeypatch):
+    """Test that a fork-server exiting doesn't fail requests already sent to its replacement"""
+    import json
+    import threading
+    from backend.models import pytest_forkserver
+
+    class FakeServer:
+        def __init__(self, lines):
+            self.stdout = lines
+
+    old = FakeServer([json.dumps({"id": 1, "returncode": 0}) + "\n", "not json\n"])
+    new = FakeServer([])
+    waiters = {request_id: {"event": threading.Event(), "response": None, "server": server}
+               for request_id, server in ((1, old), (2, old), (3, new))}
+    monkeypatch.setattr(pytest_forkserver, "_pending", dict(waiters))
+
+    pytest_forkserver._read_responses(old)
+    assert waiters[1]["event"].is_set() and waiters[1]["response"]["returncode"] == 0
+    assert waiters[2]["event"].is_set() and waiters[2]["response"] is None  # lost with the old server
+    assert not waiters[3]["event"].is_set() and list(pytest_forkserver._pending) == [3]
+    print("✅ Fork-server restart test passed")
+
+def test_speculative_candidates_keep_first_passing(tmp_path, monkeypatch):
+    """Test that racing candidates promotes the one whose tests pass and cleans up the rest"""
+    from backend.models import llm_connector
+
+    def response(check):
+        return ("```python\n# Filename: feature.py\ndef value():\n    return 1\n```\n"
+                "```python\n# Filename: test_feature.py\nimport os, sys\n"
+                "sys.path.append(os.path.join(os.path.dirname(__file__), '../sandbox'))\n"
+                f"from feature import value\ndef test_value():\n    assert value() == {check}\n```\n")
+
+    async def fake_llm(prompt, context_files=None, bypass_cache=False, temperature=0.7):
+        return response(1 if temperature == 0.3 else 2)
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llm_connector, "get_llm_response_async", fake_llm)
+    result = llm_connector.generate_code_and_tests("feature", max_retries=0, candidates=3)
+
+    assert result["ready_for_implementation"] is True
+    assert sorted(os.listdir(tmp_path / "backend" / "tests")) == ["test_feature.py"]
+    assert "== 1" in (tmp_path / "backend" / "tests" / "test_feature.py").read_text()
+    assert os.listdir(tmp_path / "backend" / "candidates") == []
+    print("✅ Speculative candidates test passed")
+
+def test_code_fence_parser_streams_and_names_files(tmp_path):
+    """Test that files are written as their fences close, named by header, prose or content"""
+    from backend.models.code_parser import CodeFenceParser
+
+    sandbox = tmp_path / "sandbox"
+    tests = tmp_path / "tests"
+    sandbox.mkdir()
+    tests.mkdir()
+    response = ("Here is `calculator.py`:\n```python\ndef add(a, b):\n    return a + b\n```\n"
+                "It uses helpers from utils.py.\n```python\nfrom calculator import add\n"
+                "def test_add():\n    assert add(1, 2) == 3\n```\n"
+                "```bash\npytest\n```\n```python\n# Filename: ../../escape.py\nX = 1\n```\n"
+                "```python\n# truncated")
+    written = []
+    parser = CodeFenceParser(str(sandbox), str(tests), on_file=written.append)
+    for i in range(0, len(response), 7):
+        parser.feed(response[i:i + 7])
+    assert len(written) == 3  # written before close(); the truncated block never is
+    files = parser.close()
+
+    assert files == written == [str(sandbox / "calculator.py"), str(tests / "test_calculator.py"), str(sandbox / "escape.py")]
+    assert "def test_add" in (tests / "test_calculator.py").read_text()
+    print("✅ Code fence parser test passed")
+
+def test_streamed_generation_tests_files_early(tmp_path, monkeypatch):
+    """Test that a streamed completion writes files and reuses early test results"""
+    from backend.models import llm_connector
+
+    chunks = ["```python\n# Filename: feature.py\ndef value():\n    return 1\n```\n",
+              "```python\n# Filename: test_feature.py\nimport os, sys\n",
+              "sys.path.append(os.path.join(os.path.dirname(__file__), '../sandbox'))\n",
+              "from feature import value\ndef test_value():\n    assert value() == 1\n```\n",
+              "Done."]
+
+    async def fake_stream(prompt, context_files=None):
+        for chunk in chunks:
+            yield chunk
+
+    runs = []
+    real_run = llm_connector.run_tests_and_validate
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llm_connector, "stream_llm_response", fake_stream)
+    monkeypatch.setattr(llm_connector, "run_tests_and_validate", lambda files: runs.append(list(files)) or real_run(files))
+    events = []
+    import asyncio
+    result = asyncio.run(llm_connector.generate_code_and_tests_async("feature", max_retries=0, on_event=events.append,
+                                                                     bypass_cache=True))
+
+    assert result["ready_for_implementation"] is True
+    # Written and tested in the generation's own workspace, then promoted
+    assert len(runs) == 1 and len(runs[0]) == 1  # only the early run
+    assert runs[0][0].startswith("./backend/workspaces/") and runs[0][0].endswith("/tests/test_feature.py")
+    written = [e["file"] for e in events if e["type"] == "file_written"]
+    assert [os.path.relpath(f, os.path.dirname(runs[0][0])) for f in written] == ["../sandbox/feature.py", "test_feature.py"]
+    assert result["created_files"] == ["./backend/sandbox/feature.py", "./backend/tests/test_feature.py"]
+    assert [e["type"] for e in events].index("file_written") < [e["type"] for e in events].index("parsing")
+    print("✅ Streamed generation early test passed")
+
+def test_chat_stream_endpoint_sends_sse_events(tmp_path, monkeypatch):
+    """Test /api/chat/stream framing: started, tokens and progress in order, then the result"""
+    import json
+    from fastapi.testclient import TestClient
+    from backend.main import app
+    from backend.models import llm_connector
+
+    chunks = ["Here you go:\n", "```python\n# Filename: feature.py\ndef value():\n    return 1\n```\n",
+              "```python\n# Filename: test_feature.py\nimport os, sys\n"
+              "sys.path.append(os.path.join(os.path.dirname(__file__), '../sandbox'))\n"
+              "from feature import value\ndef test_value():\n    assert value() == 1\n```\n", "Done."]
+
+    async def fake_stream(prompt, context_files=None):
+        for chunk in chunks:
+            yield chunk
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llm_connector, "stream_llm_response", fake_stream)
+    with TestClient(app).stream("POST", "/api/chat/stream", json={"prompt": "sse feature", "bypass_cache": True}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.headers["cache-control"] == "no-cache"
+        body = response.read().decode("utf-8")
+
+    assert body.endswith("\n\n")
+    events = []
+    for frame in body[:-2].split("\n\n"):
+        name_line, data_line = frame.split("\n")
+        assert name_line.startswith("event: ") and data_line.startswith("data: ")
+        event = json.loads(data_line[len("data: "):])
+        assert event["type"] == name_line[len("event: "):]
+        events.append(event)
+
+    types = [event["type"] for event in events]
+    assert types[0] == "started" and types[1] == "attempt" and types[-1] == "result"
+    assert types.count("result") == 1 and "error" not in types
+    assert "".join(event["text"] for event in events if event["type"] == "token") == "".join(chunks)
+    # Each file is announced as soon as its fence closes, before the rest of the completion arrives
+    token_indexes = [i for i, t in enumerate(types) if t == "token"]
+    written_indexes = [i for i, t in enumerate(types) if t == "file_written"]
+    assert len(written_indexes) == 2 and written_indexes[0] < token_indexes[-1]
+    assert token_indexes[-1] < types.index("parsing") < types.index("tests_done") < len(types) - 1
+    result = events[-1]["response"]
+    assert result["ready_for_implementation"] is True
+    assert result["created_files"] == ["./backend/sandbox/feature.py", "./backend/tests/test_feature.py"]
+    print("✅ Chat stream SSE test passed")
+
+def test_test_results_cached_until_imports_change(tmp_path, monkeypatch):
+    """Test that passes are reused while the test and its sandbox import are unchanged"""
+    from backend.models import llm_connector, result_cache
+
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(result_cache, "_memory", {})
+    (tmp_path / "sandbox").mkdir()
+    (tmp_path / "tests").mkdir()
+    module = tmp_path / "sandbox" / "feature.py"
+    test_file = tmp_path / "tests" / "test_feature.py"
+    module.write_text("def value():\n    return 1\n")
+    test_file.write_text("import os, sys\nsys.path.append(os.path.join(os.path.dirname(__file__), '../sandbox'))\n"
+                         "from feature import value\ndef test_value():\n    assert value() == 1\n")
+
+    first = llm_connector.run_tests_and_validate([str(test_file)], use_cache=True)
+    second = llm_connector.run_tests_and_validate([str(test_file)], use_cache=True)
+    assert first["cached"] == [] and first["all_passed"]
+    assert second["results"] == [f"✅ {test_file}: PASSED (cached)"]
+
+    module.write_text("def value():\n    return 2\n")
+    third = llm_connector.run_tests_and_validate([str(test_file)], use_cache=True)
+    assert third["cached"] == [] and not third["all_passed"]
+    print("✅ Test result cache test passed")
+
+def test_file_index_respects_gitignore_and_updates(tmp_path):
+    """Test that the project file index skips ignored paths and picks up changes"""
+    from backend.models.file_index import ProjectFileIndex
+    
+    (tmp_path / ".gitignore").write_text("*.log\nbuild/\n")
+    (tmp_path / "app.py").write_text("")
+    (tmp_path / "debug.log").write_text("")
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "out.py").write_text("")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "HEAD").write_text("")
+    
+    index = ProjectFileIndex(str(tmp_path))
+    try:
+        assert index.all_files() == [".gitignore", "app.py"]
+        
+        (tmp_path / "pkg").mkdir()
+        (tmp_path / "pkg" / "mod.py").write_text("")
+        index.refresh(force=True)
+        total, page = index.query(extensions=[".py"], offset=1, limit=1)
+        assert total == 2
+        assert page == ["pkg/mod.py"]
+    finally:
+        index.close()
+    print("✅ File index test passed")
+
+def test_llm_response_cache_tiers(tmp_path):
+    """Test LLM cache memory/disk tiers, size-based eviction and TTL"""
+    from backend.models.llm_cache import ResponseCache, cache_key
+    
+    payload = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "temperature": 0.7, "max_tokens": 10}
+    key = cache_key(payload)
+    assert key == cache_key(dict(payload, stream=True))
+    assert key != cache_key(dict(payload, temperature=0.1))
+    
+    cache = ResponseCache(cache_dir=str(tmp_path), memory_bytes=10, disk_bytes=10000, ttl=60)
+    assert cache.get(key) is None
+    cache.put(key, "hello")
+    assert cache.get(key) == "hello"
+    cache.put("other", "0123456789")  # pushes "hello" out of the 10-byte memory tier
+    assert cache.get(key) == "hello"  # ...but it is still on disk
+    assert cache.counters["memory_hits"] == 1
+    assert cache.counters["disk_hits"] == 1
+    assert cache.counters["memory_evictions"] >= 1
+    
+    expired = ResponseCache(cache_dir=str(tmp_path), ttl=-1)
+    assert expired.get(key) is None
+    print("✅ LLM response cache test passed")
+
+def test_read_file_contents_bounded_and_cached(tmp_path):
+    """Test that context reads stop at the line/byte limits and are cached until the file changes"""
+    from backend.models.llm_connector import read_file_contents
+    
+    path = tmp_path / "big.py"
+    path.write_text("".join(f"line {i}\n" for i in range(1000)))
+    assert read_file_contents(str(path), max_lines=3) == "line 0\nline 1\nline 2\n"
+    assert read_file_contents(str(path), max_bytes=10) == "line 0\nlin"
+    
+    first = read_file_contents(str(path))
+    assert first.count("\n") == 200
+    assert read_file_contents(str(path)) is first
+    
+    path.write_text("changed\n")
+    assert read_file_contents(str(path)) == "changed\n"
+    assert read_file_contents(str(tmp_path / "missing.py")).startswith("Error reading")
+    print("✅ Bounded file reader test passed")
+
+def test_context_packer_fits_window():
+    """Test that context files are ranked, trimmed and dropped to fit the window"""
+    from backend.models.context_packer import pack_context, estimate_tokens
+    
+    files = {
+        "./big.py": "x = 1\n" * 2000,
+        "./small.py": "y = 2\n",
+        "./routes.py": "z = 3\n" * 10,
+    }
+    packed, report = pack_context("Please fix routes.py", files, context_window=2000, max_tokens=500)
+    
+    assert list(packed)[0] == "./routes.py"  # Mentioned in the prompt, so ranked first
+    assert "./small.py" in report["included"]
+    assert [t["path"] for t in report["trimmed"]] == ["./big.py"]
+    assert "truncated" in packed["./big.py"]
+    total = report["prompt_tokens"] + sum(estimate_tokens(c) for c in packed.values())
+    assert total <= 2000 - 500
+    
+    packed, report = pack_context("fix", files, context_window=600, max_tokens=500)
+    assert "./big.py" in [d["path"] for d in report["dropped"]]
+    print("✅ Context packer test passed")
+
+def test_overlay_staging_only_materializes_changed_paths(tmp_path, monkeypatch):
+    """Test that overlay staging links unchanged files and never writes into the live tree"""
+    from backend.models.safe_update import create_staging_environment, remove_staging_environment
+    
+    (tmp_path / "backend" / "models").mkdir(parents=True)
+    (tmp_path / "backend" / "models" / "core.py").write_text("OLD = True\n")
+    (tmp_path / "backend" / "models" / "other.py").write_text("")
+    (tmp_path / "backend" / "self_updates" / "staging").mkdir(parents=True)
+    (tmp_path / "frontend").mkdir()
+    (tmp_path / "frontend" / "chat.js").write_text("")
+    monkeypatch.chdir(tmp_path)
+    
+    staging_dir = create_staging_environment({"./backend/models/core.py": "NEW = True\n"}, mode="overlay")
+    try:
+        assert os.path.islink(os.path.join(staging_dir, "frontend"))
+        assert os.path.islink(os.path.join(staging_dir, "backend", "models", "other.py"))
+        assert not os.path.exists(os.path.join(staging_dir, "backend", "self_updates"))
+        staged = os.path.join(staging_dir, "backend", "models", "core.py")
+        assert not os.path.islink(staged)
+        assert open(staged).read() == "NEW = True\n"
+        assert (tmp_path / "backend" / "models" / "core.py").read_text() == "OLD = True\n"
+    finally:
+        remove_staging_environment(staging_dir)
+    assert (tmp_path / "frontend" / "chat.js").exists()
+    print("✅ Overlay staging test passed")
+
+def test_self_update_removes_staging_unless_kept(tmp_path, monkeypatch):
+    """Test that a self-update deletes its staging tree whether it passes or fails"""
+    from backend.models import safe_update
+
+    (tmp_path / "backend" / "models").mkdir(parents=True)
+    (tmp_path / "backend" / "self_updates" / "staging").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    staging_root = tmp_path / "backend" / "self_updates" / "staging"
+    outcome = {"all_passed": True}
+    monkeypatch.setattr(safe_update, "git_commit_current_state", lambda *args, **kwargs: {"status": "no_changes"})
+    monkeypatch.setattr(safe_update, "run_comprehensive_tests", lambda staging_dir, changed_files=None: {
+        "all_passed": outcome["all_passed"], "errors": [], "test_selection": None})
+    monkeypatch.setattr(safe_update, "create_update_package", lambda *args: {"status": "success"})
+    update = {"./backend/models/core.py": "NEW = True\n"}
+
+    assert safe_update.safe_self_update(update)["status"] == "ready_for_deployment"
+    assert list(staging_root.iterdir()) == []
+    outcome["all_passed"] = False
+    assert safe_update.safe_self_update(update)["status"] == "failed"
+    assert list(staging_root.iterdir()) == []
+
+    monkeypatch.setattr(safe_update, "KEEP_STAGING", True)
+    result = safe_update.safe_self_update(update)
+    assert os.path.isdir(result["staging_dir"])
+    safe_update.remove_staging_environment(result["staging_dir"])
+    print("✅ Staging cleanup test passed")
+
+def test_validation_stages_run_in_parallel_and_aggregate(monkeypatch):
+    """Test that validation stages run concurrently and every failure is reported"""
+    import time
+    from fastapi.testclient import TestClient
+    from backend.main import app
+    from backend.api import routes
+    from backend.models import safe_update
+
+    def fake_check(command, cwd, timeout):
+        time.sleep(0.3)
+        if "get_llm_response" in command[-1]:
+            return False, "ImportError: get_llm_response"
+        return True, ""
+
+    def broken_smoke_test(staging_dir):
+        time.sleep(0.3)
+        raise OSError("no free port")
+
+    monkeypatch.setattr(safe_update, "_run_check", fake_check)
+    monkeypatch.setattr(safe_update, "_smoke_test_server", broken_smoke_test)
+    results = safe_update.run_comprehensive_tests("/staging", test_selection="full")
+    assert results["duration"] < 0.9  # four 0.3 s stages, not 1.2 s back to back
+    assert results["basic_tests"] and results["api_tests"]
+    assert not results["self_test"] and not results["integration_tests"] and not results["all_passed"]
+    assert sorted(results["errors"]) == ["Integration test failed: no free port",
+                                         "Self test failed: ImportError: get_llm_response"]
+
+    # The endpoint runs the blocking update off the event loop
+    def fake_update(files_to_update):
+        import asyncio
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()
+        return {"status": "success", "files": list(files_to_update)}
+
+    monkeypatch.setattr(routes, "safe_self_update", fake_update)
+    response = TestClient(app).post("/api/self-update", json={"files_to_update": {"a.py": ""}})
+    assert response.json()["response"] == {"status": "success", "files": ["a.py"]}
+    print("✅ Parallel validation stages test passed")
+
+def test_smoke_test_waits_for_slow_server_and_gives_up_on_dead_one(tmp_path):
+    """Test the staged-server smoke test against a server that starts late and one that never answers"""
+    import time
+    from backend.models.safe_update import _smoke_test_server
+
+    # `python -m uvicorn` run from the staging dir finds this stand-in first
+    server = (
+        "import sys, time\n"
+        "from http.server import BaseHTTPRequestHandler, HTTPServer\n"
+        "class Health(BaseHTTPRequestHandler):\n"
+        "    def do_GET(self):\n"
+        "        self.send_response(200 if self.path == '/api/health' else 404)\n"
+        "        self.end_headers()\n"
+        "time.sleep(DELAY)\n"
+        "HTTPServer(('127.0.0.1', int(sys.argv[sys.argv.index('--port') + 1])), Health).serve_forever()\n"
+    )
+    late = tmp_path / "late"
+    late.mkdir()
+    (late / "uvicorn.py").write_text(server.replace("DELAY", "1"))
+    assert _smoke_test_server(str(late), timeout=15) == (True, "")
+
+    dead = tmp_path / "dead"
+    dead.mkdir()
+    (dead / "uvicorn.py").write_text(server.replace("DELAY", "60"))
+    started = time.monotonic()
+    passed, output = _smoke_test_server(str(dead), timeout=1)
+    assert not passed and output == "server did not become healthy within 1s"
+    assert time.monotonic() - started < 10  # the stuck server was terminated, not waited for
+
+    crashing = tmp_path / "crashing"
+    crashing.mkdir()
+    (crashing / "uvicorn.py").write_text("import sys\nprint('boom', file=sys.stderr)\nsys.exit(3)\n")
+    passed, output = _smoke_test_server(str(crashing), timeout=15)
+    assert not passed and output.startswith("server exited with code 3") and "boom" in output
+    print("✅ Smoke test timing test passed")
+
+def test_impact_selects_tests_through_imports(tmp_path):
+    """Test that only tests reaching a changed file are selected, with full-suite fallback"""
+    from backend.models.impact import select_tests
+
+    for package in ["backend", "backend/models"]:
+        (tmp_path / package).mkdir(exist_ok=True)
+        (tmp_path / package / "__init__.py").write_text("")
+    (tmp_path / "backend" / "sandbox").mkdir()
+    (tmp_path / "backend" / "tests").mkdir()
+    (tmp_path / "backend" / "models" / "core.py").write_text("X = 1\n")
+    (tmp_path / "backend" / "models" / "api.py").write_text("from .core import X\n")
+    (tmp_path / "backend" / "sandbox" / "adder.py").write_text("def add(a, b): return a + b\n")
+    (tmp_path / "backend" / "tests" / "test_api.py").write_text("from backend.models import api\n")
+    (tmp_path / "backend" / "tests" / "test_adder.py").write_text("import sys\nsys.path.append('../sandbox')\nfrom adder import add\n")
+
+    report = select_tests(["./backend/models/core.py"], root=str(tmp_path))
+    assert report["mode"] == "affected"
+    assert report["selected"] == ["backend/tests/test_api.py"]
+    assert "backend/tests/test_adder.py" in report["skipped"]
+
+    assert select_tests(["backend/sandbox/adder.py"], root=str(tmp_path))["selected"] == ["backend/tests/test_adder.py"]
+    assert select_tests(["frontend/chat.js"], root=str(tmp_path))["selected"] == []
+
+    full = select_tests(["requirements.txt"], root=str(tmp_path))
+    assert full["mode"] == "full" and len(full["selected"]) == 2
+    print("✅ Impact-based test selection test passed")
+
+def test_git_commit_paths_stages_only_known_paths(tmp_path):
+    """Test that backups commit named paths and tracked edits, but leave other untracked files alone"""
+    import subprocess
+    from backend.models.git_ops import commit_paths, reset_hard
+
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=tmp_path, capture_output=True, text=True, check=True).stdout
+
+    git('init', '-q')
+    git('config', 'user.email', 'test@example.com')
+    git('config', 'user.name', 'test')
+    (tmp_path / "tracked.py").write_text("A = 1\n")
+    git('add', 'tracked.py')
+    git('commit', '-q', '-m', 'base')
+
+    (tmp_path / "tracked.py").write_text("A = 2\n")
+    (tmp_path / "new.py").write_text("")
+    (tmp_path / "sandbox.py").write_text("")
+    result = commit_paths("backup", paths=["new.py", "missing.py"], root=str(tmp_path))
+
+    assert result["status"] == "success"
+    assert git('rev-parse', 'HEAD').startswith(result["commit_hash"])
+    assert sorted(git('show', '--name-only', '--format=', 'HEAD').split()) == ["new.py", "tracked.py"]
+    assert "?? sandbox.py" in git('status', '--porcelain')
+    assert [t["op"] for t in result["timings"]] == ["add", "commit"]
+
+    assert commit_paths("again", root=str(tmp_path))["status"] == "no_changes"
+    assert reset_hard(1, root=str(tmp_path))["status"] == "success"
+    assert (tmp_path / "tracked.py").read_text() == "A = 1\n"
+    print("✅ Git commit paths test passed")
+
+def test_delta_packages_apply_and_gc(tmp_path, monkeypatch):
+    """Test that packages store only changed files once, apply them, and get garbage collected"""
+    import threading
+    from backend.models import update_packages
+    from backend.models.update_packages import create_delta_package, apply_package, gc_packages, verify_package
+
+    staging = tmp_path / "staging"
+    live = tmp_path / "live"
+    packages = tmp_path / "packages"
+    (staging / "frontend").mkdir(parents=True)
+    (live / "frontend").mkdir(parents=True)
+    (staging / "frontend" / "chat.js").write_text("new\n")
+    (staging / "frontend" / "copy.js").write_text("new\n")
+    (live / "frontend" / "chat.js").write_text("old\n")
+    (live / "frontend" / "gone.js").write_text("")
+
+    _, first = create_delta_package(str(staging), ["./frontend/chat.js", "frontend/copy.js", "frontend/gone.js"],
+                                    packages_dir=str(packages))
+    blobs = [f for _, _, files in os.walk(packages / "blobs") for f in files]
+    assert len(blobs) == 1  # identical contents share one blob
+
+    result = apply_package(first, root=str(live))
+    assert result["status"] == "success"
+    assert (live / "frontend" / "chat.js").read_text() == "new\n"
+    assert result["deleted"] == ["frontend/gone.js"]
+
+    (staging / "frontend" / "chat.js").write_text("newer\n")
+    second_id, second = create_delta_package(str(staging), ["frontend/chat.js"], packages_dir=str(packages))
+    # Blue/green rollback snapshots don't count towards `keep` but go with the package they revert
+    (staging / "frontend" / "chat.js").write_text("snapshot\n")
+    _, snapshot = create_delta_package(str(staging), ["frontend/chat.js"], packages_dir=str(packages),
+                                       metadata={"rollback_for": second_id})
+    _, stale_snapshot = create_delta_package(str(staging), ["frontend/copy.js"], packages_dir=str(packages),
+                                             metadata={"rollback_for": os.path.basename(first)[:-len(".json")]})
+    result = gc_packages(keep=1, packages_dir=str(packages))
+    assert result == {"packages_removed": 2, "blobs_removed": 1, "bytes_freed": 4}
+    assert not os.path.exists(first) and not os.path.exists(stale_snapshot)
+    assert os.path.exists(second) and os.path.exists(snapshot)
+
+    # A GC started while a package is being written waits for its manifest instead of deleting its blobs
+    gc_thread = None
+    real_store_blob = update_packages.store_blob
+
+    def store_then_collect(data, packages_dir):
+        nonlocal gc_thread
+        digest = real_store_blob(data, packages_dir)
+        if gc_thread is None:
+            gc_thread = threading.Thread(target=gc_packages, kwargs={"keep": 5, "packages_dir": packages_dir})
+            gc_thread.start()
+            gc_thread.join(0.2)
+            assert gc_thread.is_alive()
+        return digest
+
+    (staging / "frontend" / "chat.js").write_text("racing\n")
+    monkeypatch.setattr(update_packages, "store_blob", store_then_collect)
+    _, racing = create_delta_package(str(staging), ["frontend/chat.js"], packages_dir=str(packages))
+    gc_thread.join()
+    assert verify_package(racing) == []
+    print("✅ Delta package test passed")
+
+def test_bluegreen_proxy_follows_active_worker(tmp_path):
+    """Test that new proxy connections go to whichever worker the state file names"""
+    import asyncio
+    from backend.models.bluegreen import save_state, start_proxy
+
+    state_path = str(tmp_path / "bluegreen.json")
+
+    async def scenario():
+        async def worker(name, reader, writer):
+            await reader.read(100)
+            writer.write(name.encode())
+            writer.close()
+
+        blue = await asyncio.start_server(lambda r, w: worker("blue", r, w), "127.0.0.1", 0)
+        green = await asyncio.start_server(lambda r, w: worker("green", r, w), "127.0.0.1", 0)
+        ports = {"blue": blue.sockets[0].getsockname()[1], "green": green.sockets[0].getsockname()[1]}
+        proxy = await start_proxy(0, state_path, host="127.0.0.1")
+        proxy_port = proxy.sockets[0].getsockname()[1]
+
+        async def ask():
+            reader, writer = await asyncio.open_connection("127.0.0.1", proxy_port)
+            writer.write(b"ping")
+            writer.write_eof()
+            answer = await reader.read()
+            writer.close()
+            return answer.decode()
+
+        answers = []
+        for color in ("blue", "green"):
+            save_state({"active": {"color": color, "port": ports[color], "pid": 0}}, state_path)
+            answers.append(await ask())
+        for server in (proxy, blue, green):
+            server.close()
+        return answers
+
+    assert asyncio.run(scenario()) == ["blue", "green"]
+    print("✅ Blue/green proxy test passed")
+
+def test_bluegreen_worker_stopped_from_another_process(tmp_path):
+    """Test that a worker started by one process (the proxy) is seen as stopped by another (deploy)"""
+    import subprocess
+    import sys
+    import time
+    from backend.models import bluegreen
+
+    if not os.path.exists("/proc/self/stat"):
+        pytest.skip("zombie detection reads /proc")
+    # `python -m uvicorn` run from the worker's root finds this stand-in first
+    (tmp_path / "uvicorn.py").write_text("import signal, sys, time\n"
+                                         "signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))\n"
+                                         "while True:\n    time.sleep(0.1)\n")
+    pid, _ = bluegreen.start_worker("blue", root=str(tmp_path), port=1)
+    try:
+        time.sleep(0.5)
+        repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        started = time.monotonic()
+        # We are the parent and deliberately don't reap, so the stopped worker lingers as a zombie
+        subprocess.run([sys.executable, "-c", f"from backend.models.bluegreen import stop_worker, pid_alive\n"
+                        f"stop_worker({pid}, drain_timeout=30)\nassert not pid_alive({pid})"],
+                       cwd=repo_root, check=True, timeout=60)
+        assert time.monotonic() - started < 15  # not the 65 s SIGKILL grace period
+        assert bluegreen._is_zombie(pid)
+        assert pid in bluegreen._reap_children() and not bluegreen.pid_alive(pid)
+    finally:
+        if bluegreen.pid_alive(pid):
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+    print("✅ Blue/green cross-process stop test passed")
+
+def test_bluegreen_deploy_switches_back_when_unhealthy(tmp_path, monkeypatch):
+    """Test that a deploy whose new worker never gets healthy keeps the old worker and restores the files"""
+    from backend.models import bluegreen
+    from backend.models.update_packages import create_delta_package
+
+    staging = tmp_path / "staging"
+    live = tmp_path / "live"
+    packages = tmp_path / "packages"
+    (staging / "frontend").mkdir(parents=True)
+    (live / "frontend").mkdir(parents=True)
+    (staging / "frontend" / "chat.js").write_text("new\n")
+    (staging / "frontend" / "added.js").write_text("")
+    (live / "frontend" / "chat.js").write_text("old\n")
+    _, manifest = create_delta_package(str(staging), ["frontend/chat.js", "frontend/added.js"],
+                                       packages_dir=str(packages))
+
+    state_path = str(tmp_path / "bluegreen.json")
+    old = {"color": "blue", "port": 8001, "pid": os.getpid()}
+    bluegreen.save_state({"proxy_pid": os.getpid(), "active": old}, state_path)
+    stopped = []
+    monkeypatch.setattr(bluegreen, "start_worker", lambda color, root: (424242, 8002))
+    monkeypatch.setattr(bluegreen, "wait_healthy", lambda pid, port: (False, "did not answer"))
+    monkeypatch.setattr(bluegreen, "stop_worker", lambda pid, drain_timeout=0: stopped.append(pid))
+
+    result = bluegreen.deploy(manifest, root=str(live), state_path=state_path, packages_dir=str(packages))
+    assert result["status"] == "rolled_back"
+    assert stopped == [424242]
+    assert bluegreen.load_state(state_path)["active"] == old
+    assert (live / "frontend" / "chat.js").read_text() == "old\n"
+    assert not (live / "frontend" / "added.js").exists()
+    print("✅ Blue/green switch-back test passed")
+
+def test_fake_lm_studio_and_load_report():
+    """Test the fake LM Studio's streaming and failure injection, and the load-test percentiles"""
+    import asyncio
+    import json
+    import httpx
+    from fastapi.testclient import TestClient
+    from backend.bench.fake_lm_studio import create_app, DEFAULT_RESPONSE
+    from backend.bench.loadtest import percentile, summarize, run_load
+
+    client = TestClient(create_app({"latency": 0, "tokens_per_second": 0}))
+    with client.stream("POST", "/v1/chat/completions", json={"messages": [], "stream": True}) as response:
+        lines = [line for line in response.iter_lines() if line.startswith("data:")]
+    assert lines[-1] == "data: [DONE]"
+    text = "".join(json.loads(line[5:])["choices"][0]["delta"].get("content", "") for line in lines[:-1])
+    assert text == DEFAULT_RESPONSE
+
+    failing = TestClient(create_app({"latency": 0, "tokens_per_second": 0, "error_rate": 1.0}))
+    assert failing.post("/v1/chat/completions", json={"messages": []}).status_code == 500
+    assert failing.get("/stats").json()["injected"]["error"] == 1
+
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    samples = [{"endpoint": "files", "latency": i / 100, "ok": i != 0} for i in range(101)]
+    report = summarize(samples, elapsed=2.0)["files"]
+    assert report["errors"] == 1 and report["p99"] == pytest.approx(0.9901)
+    assert report["throughput"] == 50.0
+
+    # Every chat request (warm-up included) carries its own prompt, so none can be coalesced or cached
+    prompts = []
+
+    def handler(request):
+        prompts.append(json.loads(request.content)["prompt"])
+        return httpx.Response(200, json={"response": {}})
+
+    samples, _ = asyncio.run(run_load("http://bench", ["chat"], 3, 6, transport=httpx.MockTransport(handler)))
+    assert len(samples) == 6 and all(sample["ok"] for sample in samples)
+    assert len(prompts) == 7 and len(set(prompts)) == 7
+    print("✅ Fake LM Studio and load report test passed")
+
+def test_metrics_endpoint_reports_stage_histograms(tmp_path):
+    """Test that pipeline stages show up as Prometheus histograms at /api/metrics"""
+    from fastapi.testclient import TestClient
+    from backend.main import app
+    from backend.models.llm_connector import parse_and_save_code
+    from backend.models.metrics import STAGE_DURATION
+
+    before = STAGE_DURATION.count(stage="parse", detail="")
+    parse_and_save_code("```python\n# Filename: a.py\nA = 1\n```\n", str(tmp_path), str(tmp_path))
+    assert STAGE_DURATION.count(stage="parse", detail="") == before + 1
+
+    client = TestClient(app)
+    client.get("/api/health")
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert "# TYPE pleione_stage_duration_seconds histogram" in body
+    assert f'pleione_stage_duration_seconds_count{{stage="parse",detail=""}} {before + 1}' in body
+    assert 'pleione_stage_duration_seconds_bucket{stage="parse",detail="",le="+Inf"}' in body
+    assert 'pleione_http_request_duration_seconds_count{method="GET",route="/api/health",status="200"}' in body
+    assert "pleione_llm_requests_in_flight 0" in body
+    print("✅ Metrics endpoint test passed")
+
+def test_adaptive_llm_timeouts_detect_stalls(tmp_path, monkeypatch):
+    """Test history-sized timeouts and first-token / idle stall detection on streams"""
+    import asyncio
+    import json
+    import httpx
+    import time
+    from backend.models import llm_connector
+    from backend.models.llm_timeouts import LatencyHistory, plan_timeouts
+
+    history = LatencyHistory(str(tmp_path / "latency.json"))
+    cold = plan_timeouts(100, 2000, history=history)
+    assert cold["source"] == "default" and cold["total"] == 120 + 2000 / 5
+    for _ in range(5):
+        history.record("fast-model", 100, 200, duration=5, first_token=1)
+    warm = plan_timeouts(100, 2000, history=LatencyHistory(history.path))
+    assert warm["source"] == "history"
+    assert warm["total"] < cold["total"] and warm["first_token"] < cold["first_token"]
+    # History only saw 200-token answers at 50 tok/s; a healthy 2000-token one (~1 s + 40 s) must still fit
+    short = LatencyHistory(str(tmp_path / "short.json"))
+    for _ in range(10):
+        short.record("short-answers", 100, 200, duration=4, first_token=None)
+    long_answer = plan_timeouts(100, 2000, history=short)
+    assert long_answer["source"] == "history" and long_answer["total"] >= 1 + 2000 / 50
+    assert plan_timeouts(100, 4000, history=short)["total"] > long_answer["total"]
+
+    class StallingTransport(httpx.AsyncBaseTransport):
+        def __init__(self, tokens, finish=False):
+            self.tokens = tokens
+            self.finish = finish
+
+        async def handle_async_request(self, request):
+            async def body():
+                for token in self.tokens:
+                    chunk = {"model": "fast-model", "choices": [{"delta": {"content": token}}]}
+                    yield f"data: {json.dumps(chunk)}\n\n".encode()
+                if self.finish:
+                    yield b"data: [DONE]\n\n"
+                    return
+                await asyncio.sleep(30)
+            return httpx.Response(200, content=body())
+
+    plan = {"connect": 1, "first_token": 0.3, "idle": 0.2, "total": 20, "source": "test"}
+    monkeypatch.setattr(llm_connector, "plan_timeouts", lambda *args, **kwargs: plan)
+
+    async def consume(tokens):
+        received = []
+        async with httpx.AsyncClient(transport=StallingTransport(tokens)) as client:
+            monkeypatch.setattr(llm_connector, "get_async_client", lambda: client)
+            try:
+                async for token in llm_connector.stream_llm_response("hi"):
+                    received.append(token)
+            except httpx.ReadTimeout as e:
+                return received, str(e)
+        return received, None
+
+    received, error = asyncio.run(consume([]))
+    assert received == [] and "no first token" in error
+    received, error = asyncio.run(consume(["def ", "add"]))
+    assert received == ["def ", "add"] and "stalled" in error
+
+    # Callers wanting the whole answer at once get the same stall detection
+    async def whole(transport):
+        async with httpx.AsyncClient(transport=transport) as client:
+            monkeypatch.setattr(llm_connector, "get_async_client", lambda: client)
+            return await llm_connector.get_llm_response_async("hi", bypass_cache=True)
+
+    monkeypatch.setattr(llm_connector, "record_completion", lambda *args: None)
+    started = time.monotonic()
+    assert asyncio.run(whole(StallingTransport([]))) == "Error: Request to LM Studio timed out."
+    assert time.monotonic() - started < 5
+    assert asyncio.run(whole(StallingTransport(["def ", "add"], finish=True))) == "def add"
+    print("✅ Adaptive LLM timeout test passed")
+
+def test_llm_pool_routes_least_outstanding_and_fails_over():
+    """Test backend selection under concurrency caps, failover on connection errors and health probes"""
+    import asyncio
+    import httpx
+    from backend.models.llm_pool import LLMPool, parse_backends, NoBackendAvailable
+
+    a, b = "http://a:1234/v1/chat/completions", "http://b:1234/v1/chat/completions"
+    pool = LLMPool(parse_backends(f"{a}|2, {b}|1", a), queue_timeout=0.1)
+    assert pool.backends[0]["models_url"] == "http://a:1234/v1/models"
+    held = [pool.acquire_blocking() for _ in range(3)]
+    assert [backend["url"] for backend in held] == [a, b, a]
+    try:
+        pool.acquire_blocking()
+        assert False, "all backends are at their cap"
+    except NoBackendAvailable:
+        pass
+    for backend in held:
+        pool.release(backend)
+
+    def send(url):
+        if url == b:
+            raise httpx.ConnectError("connection refused")
+        return f"served by {url}"
+
+    # b has served fewer requests, so it is tried first and a takes over
+    assert pool.send_blocking(send) == f"served by {a}"
+    assert not pool.backends[1]["healthy"] and pool.backends[1]["failures"] == 1
+    assert pool.acquire_blocking()["url"] == a
+    assert [backend["outstanding"] for backend in pool.backends] == [1, 0]
+
+    def models(request):
+        return httpx.Response(200 if request.url.host == "b" else 503, json={"data": []})
+
+    async def probe():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(models)) as client:
+            await pool.probe(client)
+
+    asyncio.run(probe())
+    assert pool.backends[1]["healthy"] and not pool.backends[0]["healthy"]
+
+    # A lone backend is never capped; several default to MULTI_BACKEND_CONCURRENCY each
+    assert [backend["max_concurrency"] for backend in parse_backends(f"{a}, {b}|1", a)] == [4, 1]
+    single = LLMPool(parse_backends("", a), queue_timeout=None)
+    assert single.backends[0]["max_concurrency"] is None
+    held = [single.acquire_blocking() for _ in range(20)]
+    assert single.backends[0]["outstanding"] == 20
+
+    # Without a configured queue timeout, a waiter gives up at the deadline it was given
+    capped = LLMPool(parse_backends(f"{a}|1", a), queue_timeout=None)
+    capped.acquire_blocking()
+    try:
+        capped.acquire_blocking(timeout=0.1)
+        assert False, "the only slot is taken"
+    except NoBackendAvailable as e:
+        assert "0.1s" in str(e)
+    print("✅ LLM pool routing test passed")
+
+def test_identical_generations_are_coalesced(tmp_path, monkeypatch):
+    """Test that concurrent identical requests share one run, its events and its result"""
+    import asyncio
+    from backend.models import llm_connector
+    from backend.models.coalesce import generation_key, run_coalesced, in_flight
+
+    context = tmp_path / "calc.py"
+    context.write_text("A = 1\n")
+    key = generation_key("Write  add()\n", [str(context)], candidates=1)
+    assert key == generation_key("Write add()", [str(context)], candidates=1)
+    context.write_text("A = 2\n")
+    assert key != generation_key("Write add()", [str(context)], candidates=1)
+
+    runs = []
+
+    async def run(emit):
+        runs.append(emit)
+        emit({"type": "attempt", "attempt": 1})
+        await asyncio.sleep(0.05)
+        emit({"type": "tests_done"})
+        return {"ready_for_implementation": True}
+
+    async def scenario():
+        leader_events, late_events = [], []
+        leader = asyncio.create_task(run_coalesced("k", run, leader_events.append))
+        await asyncio.sleep(0.01)
+        quitter = asyncio.create_task(run_coalesced("k", run))
+        late = asyncio.create_task(run_coalesced("k", run, late_events.append))
+        await asyncio.sleep(0.01)
+        quitter.cancel()
+        results = await asyncio.gather(leader, late)
+        return results, leader_events, late_events
+
+    (first, second), leader_events, late_events = asyncio.run(scenario())
+    assert len(runs) == 1 and in_flight() == 0
+    assert first == {"ready_for_implementation": True}
+    assert second == {"ready_for_implementation": True, "coalesced": True}
+    assert late_events == leader_events == [{"type": "attempt", "attempt": 1}, {"type": "tests_done"}]
+
+    cancelled = []
+
+    async def slow(emit):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def abandon():
+        task = asyncio.create_task(run_coalesced("slow", slow))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(abandon())
+    assert cancelled == [True] and in_flight() == 0
+
+    # A streamed request never attaches to a non-streamed run, which would give it no events
+    generations = []
+
+    async def fake_generation(prompt, files_to_include, max_retries, on_event, bypass_cache, candidates):
+        generations.append(on_event is not None)
+        if on_event:
+            on_event({"type": "attempt", "attempt": 1})
+        await asyncio.sleep(0.05)
+        return {"ready_for_implementation": True}
+
+    async def mixed():
+        streamed_events = []
+        plain = asyncio.create_task(llm_connector.generate_code_and_tests_async("Write add()"))
+        await asyncio.sleep(0.01)
+        streamed = await llm_connector.generate_code_and_tests_async("Write add()", on_event=streamed_events.append)
+        return await plain, streamed, streamed_events
+
+    monkeypatch.setattr(llm_connector, "_run_generation", fake_generation)
+    plain, streamed, streamed_events = asyncio.run(mixed())
+    assert sorted(generations) == [False, True] and "coalesced" not in streamed
+    assert streamed_events == [{"type": "attempt", "attempt": 1}]
+    print("✅ Request coalescing test passed")
+
+def test_concurrent_generations_use_isolated_workspaces(tmp_path, monkeypatch):
+    """Test that concurrent generations writing the same file names don't clobber each other"""
+    import asyncio
+    import runpy
+    from backend.models import llm_connector
+
+    async def fake_llm(prompt, context_files=None, bypass_cache=False, temperature=0.7):
+        value = 1 if "one" in prompt else 2
+        check = 3 if "broken" in prompt else value
+        await asyncio.sleep(0.05)
+        return ("```python\n# Filename: feature.py\ndef value():\n    return " + str(value) + "\n```\n"
+                "```python\n# Filename: test_feature.py\nimport os, sys\n"
+                "sys.path.append(os.path.join(os.path.dirname(__file__), '../sandbox'))\n"
+                f"from feature import value\ndef test_value():\n    assert value() == {check}\n```\n")
+
+    async def run_all():
+        return await asyncio.gather(*(llm_connector.generate_code_and_tests_async(prompt, max_retries=0)
+                                      for prompt in ("one", "two", "two broken")))
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llm_connector, "get_llm_response_async", fake_llm)
+    monkeypatch.setattr(llm_connector, "RESULT_CACHE_ENABLED", False)
+    one, two, broken = asyncio.run(run_all())
+
+    assert one["ready_for_implementation"] and two["ready_for_implementation"]
+    # Both wrote feature.py: the first promoted wins the shared name, the other stays in its workspace
+    promoted, kept = (one, two) if "promotion_conflict" in two else (two, one)
+    assert promoted["created_files"] == ["./backend/sandbox/feature.py", "./backend/tests/test_feature.py"]
+    assert "feature.py" in kept["promotion_conflict"] and kept["sandbox_dir"].startswith("./backend/workspaces/")
+    for result, expected in ((one, 1), (two, 2)):
+        assert runpy.run_path(result["code_files"][0])["value"]() == expected
+    assert not broken["ready_for_implementation"]
+    # The failed and the unpromoted generations' workspaces are left, for review
+    workspaces = sorted(os.listdir(tmp_path / "backend" / "workspaces"))
+    assert sorted(r["sandbox_dir"].split("/")[3] for r in (kept, broken)) == workspaces
+
+    # A later, non-concurrent generation replaces the shared file as before
+    three = asyncio.run(llm_connector.generate_code_and_tests_async("one again", max_retries=0))
+    assert "promotion_conflict" not in three and runpy.run_path(three["code_files"][0])["value"]() == 1
+
+    # With nothing running, remembered promotions can no longer conflict and are forgotten
+    from backend.models import workspaces
+    assert workspaces._promoted and not workspaces._open
+    workspaces.cleanup_workspaces()
+    assert workspaces._promoted == {}
+    running = workspaces.create_workspace()
+    workspaces.promote_files([runpy.__file__], str(tmp_path / "shared"), str(tmp_path / "shared_tests"), running)
+    workspaces.cleanup_workspaces()
+    assert len(workspaces._promoted) == 1  # promoted after a generation that is still running started
+    workspaces.close_workspace(running)
+    workspaces.cleanup_workspaces()
+    assert workspaces._promoted == {} and not os.path.exists(running["root"])
+    print("✅ Isolated workspaces test passed")
+
+def test_sandbox_test_runs_are_resource_limited(tmp_path, monkeypatch):
+    """Test that a runaway generated test is stopped by its CPU limit and usage is recorded"""
+    from backend.models import sandbox_limits
+    from backend.models.llm_connector import run_tests_and_validate, _merge_test_results
+    from backend.models.metrics import TEST_LIMIT_HITS
+    from backend.models.pytest_forkserver import forkserver_available, stop_forkserver
+
+    if not sandbox_limits.TEST_LIMITS_ENABLED:
+        pytest.skip("rlimits need the resource module")
+    # Starting pytest alone takes about a CPU second; leave the passing file headroom
+    monkeypatch.setattr(sandbox_limits, "TEST_CPU_SECONDS", 3)
+    passing = tmp_path / "test_passing.py"
+    spinning = tmp_path / "test_spinning.py"
+    passing.write_text("def test_ok():\n    assert True\n")
+    spinning.write_text("def test_spin():\n    while True:\n        pass\n")
+
+    before = TEST_LIMIT_HITS.value(limit="cpu")
+    result = run_tests_and_validate([str(passing), str(spinning)], mode="subprocess", use_cache=False)
+    assert result["results"][0] == f"✅ {passing}: PASSED"
+    assert result["results"][1].startswith(f"❌ {spinning}: FAILED")
+    usage = result["resource_usage"]
+    assert usage[str(passing)]["limit"] is None and usage[str(passing)]["max_rss_mb"] > 0
+    assert usage[str(spinning)]["limit"] == "cpu" and usage[str(spinning)]["signal"] == "SIGXCPU"
+    assert TEST_LIMIT_HITS.value(limit="cpu") == before + 1
+
+    # Streamed generations test each file as it is written and merge the runs; usage must survive that
+    early = run_tests_and_validate([str(passing)], mode="subprocess", use_cache=False)
+    late = run_tests_and_validate([str(spinning)], mode="subprocess", use_cache=False)
+    merged = _merge_test_results([early, late])
+    assert not merged["all_passed"] and sorted(merged["resource_usage"]) == sorted([str(passing), str(spinning)])
+    assert merged["resource_usage"][str(spinning)]["limit"] == "cpu"
+
+    if forkserver_available():
+        try:
+            forked = run_tests_and_validate([str(spinning)], mode="forkserver", use_cache=False)
+        finally:
+            stop_forkserver()
+        assert not forked["all_passed"] and forked["resource_usage"][str(spinning)]["limit"] == "cpu"
+    print("✅ Resource-limited test executor test passed")
+
 def test_directories_exist():
     """Test that required directories exist"""
     import os
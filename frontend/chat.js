@@ -46,11 +46,47 @@ function sendMessage() {
         loadingDiv.textContent = 'Pleione: Self-update detected! Reading current code and preparing safe update...';
     }
     
-    // Send to backend API
-    fetch('/api/chat', {
+    // Stream tokens and pipeline progress from the backend as they happen
+    let streamDiv = null;
+    let finished = false;
+    
+    const handleEvent = (event) => {
+        if (event.type === 'attempt') {
+            loadingDiv.innerHTML = `<span class="spinner"></span>Attempt ${event.attempt} of ${event.max_attempts}: generating...`;
+            streamDiv = null;
+        } else if (event.type === 'token') {
+            if (!streamDiv) {
+                streamDiv = addMessage('Pleione: ', 'ai-message streaming');
+                chatWindow.insertBefore(streamDiv, loadingDiv);
+            }
+            streamDiv.textContent += event.text;
+            chatWindow.scrollTop = chatWindow.scrollHeight;
+        } else if (event.type === 'parsing') {
+            loadingDiv.innerHTML = '<span class="spinner"></span>Parsing generated code...';
+        } else if (event.type === 'tests_running') {
+            loadingDiv.innerHTML = `<span class="spinner"></span>Running ${event.test_files.length} test file(s)...`;
+        } else if (event.type === 'tests_done') {
+            loadingDiv.innerHTML = `<span class="spinner"></span>Tests ${event.status}`;
+        } else if (event.type === 'result') {
+            finished = true;
+            chatWindow.removeChild(loadingDiv);
+            // The streamed text is replaced by the final response below
+            if (streamDiv && streamDiv.parentNode) {
+                chatWindow.removeChild(streamDiv);
+            }
+            renderChatResult(event, isUpdate, filesToInclude);
+        } else if (event.type === 'error') {
+            finished = true;
+            chatWindow.removeChild(loadingDiv);
+            addMessage(`Pleione: ${event.error}`, 'ai-message');
+        }
+    };
+    
+    fetch('/api/chat/stream', {
         method: 'POST',
         headers: {
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream'
         },
         body: JSON.stringify({
             prompt: message,
@@ -61,40 +97,12 @@ function sendMessage() {
         if (!response.ok) {
             throw new Error(`HTTP ${response.status}: ${response.statusText}`);
         }
-        return response.json();
+        return readEventStream(response, handleEvent);
     })
-    .then(data => {
-        // Remove loading indicator
-        chatWindow.removeChild(loadingDiv);
-        
-        if (data.error) {
-            addMessage(`Pleione: ${data.error}`, 'ai-message');
-        } else if (data.response) {
-            // Show the AI response
-            addMessage(`Pleione: ${data.response.response || data.response}`, 'ai-message');
-            
-            // Show files created
-            if (data.response.created_files && data.response.created_files.length > 0) {
-                addMessage(`📁 Files created: ${data.response.created_files.join(', ')}`, 'ai-message');
-            }
-            
-            // Show test results
-            if (data.response.test_results) {
-                const testStatus = data.response.test_results.status;
-                const testMessage = data.response.test_results.results ? 
-                    data.response.test_results.results.join('\n') : 
-                    'Tests completed';
-                addMessage(`🧪 Test Results: ${testStatus.toUpperCase()}\n${testMessage}`, 'ai-message');
-            }
-            
-            // Add appropriate buttons based on update type
-            if (isUpdate && data.response.ready_for_implementation) {
-                addSelfUpdateButtons(data.response, filesToInclude);
-            } else if (data.response.ready_for_implementation) {
-                addImplementButton(data.response);
-            } else if (data.response.test_results && data.response.test_results.status === 'failed') {
-                addMessage('❌ Tests failed - implementation blocked for safety', 'ai-message');
-            }
+    .then(() => {
+        if (!finished && loadingDiv.parentNode) {
+            chatWindow.removeChild(loadingDiv);
+            addMessage('Pleione: Connection closed before the response finished.', 'ai-message');
         }
     })
     .catch(error => {
@@ -108,6 +116,72 @@ function sendMessage() {
     userInput.value = '';
 }
 
+// Read a Server-Sent Events body and pass each parsed event to onEvent
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            const data = frame.split('\n')
+                .filter(line => line.startsWith('data:'))
+                .map(line => line.slice(5).trim())
+                .join('\n');
+            if (data) {
+                onEvent(JSON.parse(data));
+            }
+        }
+    }
+}
+
+function renderChatResult(data, isUpdate, filesToInclude) {
+    if (data.error) {
+        addMessage(`Pleione: ${data.error}`, 'ai-message');
+    } else if (data.response) {
+        // Show the AI response
+        addMessage(`Pleione: ${data.response.response || data.response.error || data.response}`, 'ai-message');
+        
+        // Show files created
+        if (data.response.created_files && data.response.created_files.length > 0) {
+            addMessage(`📁 Files created: ${data.response.created_files.join(', ')}`, 'ai-message');
+        }
+        
+        // Show context files that had to be trimmed or left out to fit the model's window
+        const contextReport = data.response.context_report;
+        if (contextReport && (contextReport.trimmed.length || contextReport.dropped.length)) {
+            const trimmed = contextReport.trimmed.map(t => `${t.path} (trimmed)`);
+            const dropped = contextReport.dropped.map(d => `${d.path} (dropped)`);
+            addMessage(`✂️ Context adjusted to fit the model: ${trimmed.concat(dropped).join(', ')}`, 'ai-message');
+        }
+        
+        // Show test results
+        if (data.response.test_results) {
+            const testStatus = data.response.test_results.status;
+            const testMessage = data.response.test_results.results ? 
+                data.response.test_results.results.join('\n') : 
+                'Tests completed';
+            addMessage(`🧪 Test Results: ${testStatus.toUpperCase()}\n${testMessage}`, 'ai-message');
+        }
+        
+        // Add appropriate buttons based on update type
+        if (isUpdate && data.response.ready_for_implementation) {
+            addSelfUpdateButtons(data.response, filesToInclude);
+        } else if (data.response.ready_for_implementation) {
+            addImplementButton(data.response);
+        } else if (data.response.test_results && data.response.test_results.status === 'failed') {
+            addMessage('❌ Tests failed - implementation blocked for safety', 'ai-message');
+        }
+    }
+}
+
 function addSelfUpdateButtons(codeData, originalFiles) {
     const buttonContainer = document.createElement('div');
     buttonContainer.className = 'button-container self-update';
@@ -143,7 +217,7 @@ function initiateSafeUpdate(codeData, originalFiles) {
     // Simulate the safe update process
     setTimeout(() => {
         addMessage('✅ All safety tests passed!\n📦 Update package created and ready for deployment.', 'ai-message');
-        addMessage('🚀 Use ./backend/self_updates/packages/deploy_update_*.sh to apply the update safely.', 'ai-message');
+        addMessage('🚀 Use ./backend/self_updates/packages/deploy_pleione_update_*.sh to apply the update safely.', 'ai-message');
     }, 3000);
 }
 
@@ -43,9 +43,18 @@ fi
 echo ""
 echo "🧪 Running tests..."
 
-# Run all tests in the test directory
+# Run all tests in the test directory, or with PLEIONE_TEST_SELECTION=affected
+# only the tests that import a sandbox file (skipped tests are reported)
 if [ -d "$TEST_DIR" ] && [ -n "$(ls -A $TEST_DIR 2>/dev/null)" ]; then
-    python3 -m pytest $TEST_DIR -v
+    TEST_TARGETS="$TEST_DIR"
+    if [ "${PLEIONE_TEST_SELECTION:-full}" = "affected" ]; then
+        if SELECTED_TESTS=$(python3 -m backend.models.impact --full-if-empty $SANDBOX_DIR/*) && [ -n "$SELECTED_TESTS" ]; then
+            TEST_TARGETS="$SELECTED_TESTS"
+        else
+            echo "⚠️  Test selection failed - running the full suite"
+        fi
+    fi
+    python3 -m pytest $TEST_TARGETS -v
     TEST_EXIT_CODE=$?
     
     if [ $TEST_EXIT_CODE -eq 0 ]; then
@@ -29,6 +29,10 @@ echo "🏃 Starting Pleione backend on port 8000..."
 
 # Start the FastAPI backend
 cd /Users/calebcuster/AI/pleione-civic
+if [ "$PLEIONE_DEPLOY_MODE" = "bluegreen" ]; then
+    # Proxy on port 8000 in front of a worker on 8001/8002, so deploys can switch without downtime
+    exec python3 -m backend.models.bluegreen start 8000
+fi
 python3 -m uvicorn backend.main:app --host 0.0.0.0 --port 8000 --reload
 
 echo "✅ Pleione backend started. Open http://localhost:8000 to use the interface."
\ No newline at end of file
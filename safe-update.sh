@@ -67,7 +67,7 @@ case $choice in
         
         if [ -f "backend/self_updates/packages/$package_name" ]; then
             echo "Testing package: $package_name"
-            echo "✅ Package test completed (simulation)"
+            python3 -m backend.models.update_packages verify "backend/self_updates/packages/$package_name"
         else
             echo "❌ Package not found: $package_name"
         fi
@@ -161,12 +161,9 @@ case $choice in
                 echo "✅ Old staging directories cleaned"
             fi
             
-            # Clean packages (keep last 5)
+            # Clean packages (keep last 5) and blobs no remaining package uses
             if [ -d "backend/self_updates/packages" ]; then
-                cd backend/self_updates/packages
-                ls -t *.tar.gz 2>/dev/null | tail -n +6 | xargs rm -f 2>/dev/null || true
-                ls -t deploy_*.sh 2>/dev/null | tail -n +6 | xargs rm -f 2>/dev/null || true
-                cd ../../..
+                python3 -m backend.models.update_packages gc 5
                 echo "✅ Old packages cleaned"
             fi
             